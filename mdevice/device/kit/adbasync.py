@@ -0,0 +1,322 @@
+import asyncio
+import os
+import platform
+import signal
+import struct
+import time
+from typing import List, Optional, Tuple
+
+from mdevice.device.kit.adbkit import ADBKit
+from mdevice.device.kit.adbsocket import ADB_HOST, ADB_PORT, SHELL_ID_EXIT, SHELL_ID_STDERR, SHELL_ID_STDOUT, \
+    called_error, timeout_error
+from mdevice.error import AdbError
+from mdevice.perf.android_cpu import PckCpuinfo
+from mdevice.perf.android_mem import MemInfoPackage
+from mdevice.tools.log import LogUtils
+
+logger = LogUtils.LOGGER_DEBUG
+
+
+class AsyncAdbConnection(object):
+    """
+    基于 asyncio streams 与adb server的一条连接, 协议同 adbsocket.AdbConnection
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host: str, port: int) -> "AsyncAdbConnection":
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.writer.close()
+
+    async def send_request(self, service: str):
+        data = service.encode('utf-8')
+        self.writer.write(b'%04x' % len(data) + data)
+        await self.writer.drain()
+
+    async def read_exact(self, size: int) -> bytes:
+        try:
+            return await self.reader.readexactly(size)
+        except asyncio.IncompleteReadError:
+            raise AdbError('connection closed by adb server')
+
+    async def read_string(self) -> str:
+        length = int(await self.read_exact(4), 16)
+        return (await self.read_exact(length)).decode('utf-8', errors='replace')
+
+    async def read_all(self) -> bytes:
+        return await self.reader.read()
+
+    async def check_okay(self):
+        status = await self.read_exact(4)
+        if status == b'OKAY':
+            return
+        if status == b'FAIL':
+            raise AdbError(await self.read_string())
+        raise AdbError('unexpected adb response: %r' % status)
+
+
+class AsyncADBKit(object):
+    """
+    ADBKit 的 asyncio 版本, 单个事件循环即可驱动大量设备:
+    shell / exec-out 通过 asyncio streams 直连adb server, push / pull / install 使用 asyncio 子进程,
+    超时或任务被取消时会关闭连接或杀掉整个子进程组
+
+    注意: shell 命令原样交给设备端 sh 解释(与 ADBKit.run_shell_script 一致), 不经过本机shell
+    """
+
+    def __init__(self, sn: str = None, device_proxy_ip: str = None, socket_transport=True):
+        """
+        :param sn: 设备序列号
+        :param device_proxy_ip: 设备代理IP
+        :param socket_transport: 是否优先通过socket直连adb server执行shell命令
+        """
+        self._sn = sn
+        self.device_proxy_ip = device_proxy_ip
+        self._adb_path = ADBKit.get_adb_path()
+        self._socket_transport = socket_transport
+        self._features = None
+        self._properties = {}
+
+    @property
+    def sn(self):
+        return self._sn
+
+    def _log(self, info):
+        logger.info("%s: %s" % (self._sn, info))
+
+    def _adb_args(self, *args) -> List[str]:
+        cmdlet = [self._adb_path]
+        if self.device_proxy_ip:
+            cmdlet += ['-H', self.device_proxy_ip, '-P', str(ADB_PORT)]
+        if self._sn:
+            cmdlet += ['-s', self._sn]
+        return cmdlet + list(args)
+
+    async def run_adb_cmd(self, *args, timeout=60) -> str:
+        """
+        以子进程方式执行adb命令, 返回值格式与 CmdKit.run_sysCmd 一致
+        超时或任务被取消时杀掉整个子进程组(adb可能派生子进程)
+        """
+        cmdlet = self._adb_args(*args)
+        cmd = ' '.join(cmdlet)
+        proc = await asyncio.create_subprocess_exec(*cmdlet, stdout=asyncio.subprocess.PIPE,
+                                                    stderr=asyncio.subprocess.STDOUT, close_fds=True,
+                                                    start_new_session=True)
+        try:
+            msg, _ = await asyncio.wait_for(proc.communicate(), timeout=timeout)
+        except asyncio.TimeoutError:
+            await self._kill(proc)
+            msg = timeout_error(cmd, timeout)
+            logger.debug(msg)
+            return msg
+        except asyncio.CancelledError:
+            await self._kill(proc)
+            raise
+        encoding_format = 'gbk' if platform.system() == "Windows" else 'utf-8'
+        output = msg.decode(encoding_format, errors='replace')
+        if proc.returncode:
+            output = called_error(output, cmd)
+            logger.debug(output)
+        return output
+
+    @staticmethod
+    async def _kill(proc):
+        try:
+            if platform.system() == "Windows":
+                proc.kill()
+            else:
+                os.killpg(proc.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError) as e:
+            logger.debug(e)
+        await proc.wait()
+
+    async def _connect(self) -> AsyncAdbConnection:
+        return await AsyncAdbConnection.connect(self.device_proxy_ip or ADB_HOST, ADB_PORT)
+
+    async def _host_command(self, service: str) -> str:
+        conn = await self._connect()
+        async with conn:
+            await conn.send_request(service)
+            await conn.check_okay()
+            return await conn.read_string()
+
+    async def _open_service(self, service: str) -> AsyncAdbConnection:
+        conn = await self._connect()
+        try:
+            await conn.send_request('host:transport:%s' % self._sn if self._sn else 'host:transport-any')
+            await conn.check_okay()
+            await conn.send_request(service)
+            await conn.check_okay()
+        except BaseException:
+            conn.close()
+            raise
+        return conn
+
+    async def _supports_shell_v2(self) -> bool:
+        if self._features is None:
+            service = 'host-serial:%s:features' % self._sn if self._sn else 'host:features'
+            try:
+                self._features = set((await self._host_command(service)).split(','))
+            except AdbError:
+                self._features = set()
+        return 'shell_v2' in self._features
+
+    async def _socket_shell(self, cmd: str) -> Tuple[int, bytes]:
+        if not await self._supports_shell_v2():
+            conn = await self._open_service('shell:%s' % cmd)
+            async with conn:
+                return 0, await conn.read_all()
+        conn = await self._open_service('shell,v2,raw:%s' % cmd)
+        async with conn:
+            output = []
+            exit_code = 0
+            while True:
+                try:
+                    header = await conn.reader.readexactly(5)
+                except asyncio.IncompleteReadError:
+                    break
+                packet_id, length = struct.unpack('<BI', header)
+                data = await conn.read_exact(length) if length else b''
+                if packet_id in (SHELL_ID_STDOUT, SHELL_ID_STDERR):
+                    output.append(data)
+                elif packet_id == SHELL_ID_EXIT:
+                    exit_code = data[0] if data else 0
+                    break
+            return exit_code, b''.join(output)
+
+    async def shell(self, cmd: str, timeout=60) -> str:
+        """
+        执行设备端shell命令, 返回值格式与 ADBKit.run_shell_cmd 一致
+        :param cmd: 设备端执行的命令(由设备端 sh 解释)
+        :param timeout: 超时时间, 单位秒
+        """
+        if self._socket_transport:
+            display_cmd = ' '.join(self._adb_args('shell', cmd))
+            try:
+                code, out = await asyncio.wait_for(self._socket_shell(cmd), timeout=timeout)
+                output = out.decode('utf-8', errors='replace')
+                return called_error(output, display_cmd) if code else output
+            except asyncio.TimeoutError:
+                return timeout_error(display_cmd, timeout)
+            except AdbError as e:
+                return called_error('adb: error: %s\n' % e.info, display_cmd)
+            except OSError as e:
+                logger.debug('adb socket unavailable: %s' % e)
+        return await self.run_adb_cmd('shell', cmd, timeout=timeout)
+
+    async def _socket_exec(self, cmd: str) -> bytes:
+        conn = await self._open_service('exec:%s' % cmd)
+        async with conn:
+            return await conn.read_all()
+
+    async def exec_out(self, cmd: str, timeout=60) -> Optional[bytes]:
+        """adb exec-out, 返回原始二进制输出, 失败返回None. timeout 覆盖连接、打开服务与读取全过程"""
+        try:
+            return await asyncio.wait_for(self._socket_exec(cmd), timeout=timeout)
+        except (asyncio.TimeoutError, AdbError, OSError) as e:
+            self._log(e)
+            return None
+
+    async def get_prop(self, name: str, cache=True) -> str:
+        if cache and name in self._properties:
+            return self._properties[name]
+        value = self._properties[name] = (await self.shell('getprop %s' % name)).strip()
+        return value
+
+    async def get_sdk_version(self) -> int:
+        res = await self.get_prop('ro.build.version.sdk')
+        if 'Error' in res or res == '':
+            return 25
+        return int(res)
+
+    async def push_file(self, src_path: str, dst_path: str, timeout=5 * 60) -> str:
+        return await self.run_adb_cmd('push', src_path, dst_path, timeout=timeout)
+
+    async def pull_file(self, src_path: str, dst_path: str, timeout=180) -> str:
+        result = await self.run_adb_cmd('pull', src_path, dst_path, timeout=timeout)
+        if 'failed to copy' in result:
+            self._log("failed to pull file:" + src_path)
+        return result
+
+    async def install_apk(self, apk_path: str, over_install: bool = True, downgrade: bool = False,
+                          timeout=5 * 60) -> str:
+        """
+        安装应用, 返回 adb install 的输出
+        """
+        args = ['install', '-r', '-t'] if over_install else ['install', '-t']
+        if downgrade:
+            args.append('-d')
+        ret = await self.run_adb_cmd(*(args + [apk_path]), timeout=timeout)
+        self._log("安装结果：" + ret)
+        return ret
+
+    async def screenshot(self, filename: str = None) -> Optional[str]:
+        """原生截图(exec-out screencap -p), 图片保存在本地"""
+        if filename is None:
+            filename = str(int(time.time() * 1000)) + '.png'
+        data = await self.exec_out('screencap -p')
+        if not data:
+            return None
+        with open(filename, 'wb') as writer:
+            writer.write(data)
+        return filename
+
+    async def list_process(self) -> list:
+        if await self.get_sdk_version() < 26:
+            result = await self.shell('ps')
+        else:
+            result = await self.shell('ps -A')
+        return ADBKit.parse_ps(result)
+
+    async def dump_xml(self) -> Optional[str]:
+        """获取当前Activity控件树"""
+        for i in range(3):
+            out = await self.exec_out('uiautomator dump /dev/tty')
+            if out:
+                out = out.decode('utf-8', errors='replace')
+                if "UI hierchary dumped to" in out:
+                    return out.split('UI hierchary dumped to')[0]
+        return None
+
+    async def top_cpuinfo(self, package) -> Optional[PckCpuinfo]:
+        """top 执行失败(超时 / adb错误)时返回None, 与 ADBKit._top_cpuinfo 一致"""
+        top_cmd = 'top -b -n 1 -d 1'
+        ret = await self.shell(top_cmd)
+        if 'Invalid argument "-b"' in ret:
+            ret = await self.shell('top -n 1 -d 1')
+        if not ret or 'Error' in ret or '[ERROR]' in ret:
+            logger.debug('%s: top failed: %s' % (self._sn, ret))
+            return None
+        return PckCpuinfo(package, ret.replace('\r', ''), await self.get_sdk_version())
+
+    async def get_app_cpu(self, package) -> Optional[str]:
+        """应用CPU占用, 如 12.50%, top 执行失败或解析不到整机CPU时返回None"""
+        cpu = await self.top_cpuinfo(package)
+        res = cpu.app_cpu_rate if cpu is not None else None
+        if res is None:
+            return None
+        return str('%.2f%%' % res)
+
+    async def get_app_memory(self, package) -> Optional[MemInfoPackage]:
+        """获取应用内存信息, 应用未运行时返回None"""
+        pid = None
+        for item in await self.list_process():
+            if item["proc_name"] == package:
+                pid = item["pid"]
+                break
+        if pid is None:
+            return None
+        out = await self.shell('dumpsys meminfo %s' % pid)
+        return MemInfoPackage(dump=out.replace('\r', ''))
@@ -0,0 +1,66 @@
+import re
+import shlex
+import uuid
+from typing import List
+
+
+class ShellResult(object):
+    """
+    批量执行中单条命令的结果
+    """
+
+    def __init__(self, cmd: str, exit_code: int = None, output: str = ''):
+        """
+        :param cmd: 命令
+        :param exit_code: 退出码, 未执行完成(超时/连接断开)时为None
+        :param output: 输出(stderr 与 stdout 合并)
+        """
+        self.cmd = cmd
+        self.exit_code = exit_code
+        self.output = output
+
+    @property
+    def ok(self) -> bool:
+        return self.exit_code == 0
+
+    def __repr__(self):
+        return 'ShellResult(cmd=%r, exit_code=%r, output=%r)' % (self.cmd, self.exit_code, self.output)
+
+
+class ShellBatch(object):
+    """
+    将多条命令拼接为一个设备端脚本, 每条命令输出前后加上带序号的分隔标记, 结束标记携带退出码,
+    一次往返即可拿到所有命令的结果; 每条命令通过 eval 在子shell中执行, 单条命令失败或语法错误不影响后续命令
+    """
+
+    def __init__(self, cmds: List[str]):
+        self.cmds = list(cmds)
+        self.marker = '__MDEVICE_BATCH_%s__' % uuid.uuid4().hex
+        self._pattern = re.compile(r'%s:(\d+):B\n(.*?)\n%s:\1:E:(\d+)\n' % (self.marker, self.marker), re.S)
+
+    @property
+    def script(self) -> str:
+        lines = []
+        for index, cmd in enumerate(self.cmds):
+            lines.append('echo %s:%d:B' % (self.marker, index))
+            lines.append('(eval %s) </dev/null 2>&1' % shlex.quote(cmd))
+            lines.append('echo "\n%s:%d:E:$?"' % (self.marker, index))
+        return '\n'.join(lines) + '\n'
+
+    def parse(self, output: str) -> List[ShellResult]:
+        """
+        按分隔标记切分脚本输出
+        :param output: 脚本的完整输出
+        :return: 与命令一一对应的结果列表
+        """
+        results = [ShellResult(cmd) for cmd in self.cmds]
+        if not output:
+            return results
+        # 老版本设备 adb shell 走pty, 换行符为 \r\n
+        output = output.replace('\r\n', '\n')
+        for match in self._pattern.finditer(output):
+            index = int(match.group(1))
+            if index < len(results):
+                results[index].exit_code = int(match.group(3))
+                results[index].output = match.group(2)
+        return results
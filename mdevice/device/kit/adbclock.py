@@ -0,0 +1,246 @@
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from mdevice.tools.log import LogUtils
+
+logger = LogUtils.LOGGER_DEBUG
+
+# 一条命令同时读取设备的墙上时间与开机时长, 两次读取之间只有微秒级间隔
+CLOCK_CMD = 'date +%s.%N; cat /proc/uptime'
+# 设备重启后 开机时间(本机时间轴) 会变化, 超过该值时丢弃历史估计
+REBOOT_THRESHOLD = 2.0
+# 同步失败后的最短重试间隔, 单位秒
+RETRY_INTERVAL = 30
+
+
+class ClockEstimate(object):
+    """
+    一轮同步(多次探测中往返最短的一次)的结果
+    """
+    __slots__ = ('host_time', 'offset', 'boot_time', 'rtt', 'precise')
+
+    def __init__(self, host_time: float, offset: float, boot_time: float, rtt: float, precise: bool):
+        """
+        :param host_time: 探测往返中点的本机时间
+        :param offset: 设备墙上时间 - 本机时间, 单位秒
+        :param boot_time: 设备开机时刻在本机时间轴上的位置(本机时间 - 设备开机时长)
+        :param rtt: 探测往返耗时, 误差不超过 rtt / 2
+        :param precise: 设备 date 是否支持 %N(不支持时墙上时间只精确到秒)
+        """
+        self.host_time = host_time
+        self.offset = offset
+        self.boot_time = boot_time
+        self.rtt = rtt
+        self.precise = precise
+
+    @property
+    def error(self) -> float:
+        return self.rtt / 2
+
+    def __repr__(self):
+        return 'ClockEstimate(offset=%.4fs, rtt=%.1fms)' % (self.offset, self.rtt * 1000)
+
+
+def parse_clock(output: str) -> Optional[Tuple[float, float, bool]]:
+    """
+    :return: (设备墙上时间, 设备开机时长, 是否精确到亚秒), 解析失败返回None
+    """
+    lines = [line.strip() for line in (output or '').replace('\r', '').split('\n') if line.strip()]
+    if len(lines) < 2:
+        return None
+    seconds, _, fraction = lines[0].partition('.')
+    try:
+        uptime = float(lines[1].split()[0])
+        wall = float(seconds)
+    except ValueError:
+        return None
+    precise = fraction.isdigit()
+    if precise:
+        wall += float('0.' + fraction)
+    return wall, uptime, precise
+
+
+class DeviceClock(object):
+    """
+    设备时钟与本机时钟的对齐: 类似NTP, 每轮同步执行多次 date +%s.%N; cat /proc/uptime,
+    取往返最短的一次, 以往返中点作为设备读取时钟的本机时间; 多轮同步的结果线性拟合得到时钟漂移
+
+    offset 用于换算设备墙上时间(logcat / trace 时间戳), boot_time 用于换算设备开机时长(/proc/uptime、
+    /proc/<pid>/stat 等采样数据), 按设备在进程内共享; 首次使用时同步一轮(并发调用者等待同一轮),
+    之后超过 resync_interval 时在后台线程重新同步, 期间按已有的漂移估计换算, 不阻塞采样线程
+
+    usage:
+        clock = kit.clock
+        clock.to_host(device_time)       # 设备墙上时间 -> 本机时间
+        clock.uptime_to_host(uptime)     # 设备开机时长 -> 本机时间
+    """
+    _clocks = {}  # type: Dict[Tuple[str, str], DeviceClock]
+    _clocks_lock = threading.Lock()
+
+    def __init__(self, kit, probes: int = 8, resync_interval: float = 300, history: int = 32):
+        """
+        :param kit: ADBKit
+        :param probes: 每轮同步的探测次数
+        :param resync_interval: 自动重新同步的间隔, 单位秒
+        :param history: 保留的同步结果数(用于估计漂移)
+        """
+        self.kit = kit
+        self.probes = probes
+        self.resync_interval = resync_interval
+        self.history = history
+        self.estimates = []  # type: List[ClockEstimate]
+        self._lock = threading.Lock()
+        # 同一时间只进行一轮同步
+        self._sync_lock = threading.Lock()
+        self._attempted_at = 0.0
+        self._resync_thread = None  # type: Optional[threading.Thread]
+
+    @classmethod
+    def get(cls, kit) -> "DeviceClock":
+        """获取设备的时钟(按 (设备代理IP, 序列号) 共享)"""
+        key = kit.prop.key
+        with cls._clocks_lock:
+            clock = cls._clocks.get(key)
+            if clock is None:
+                clock = cls._clocks[key] = DeviceClock(kit)
+            return clock
+
+    @classmethod
+    def invalidate(cls, key: Tuple[str, str]):
+        with cls._clocks_lock:
+            clock = cls._clocks.pop(key, None)
+        if clock is not None:
+            # 采样器可能仍持有该实例, 清空后下次使用时重新同步
+            clock.reset()
+
+    def reset(self):
+        """丢弃全部同步结果, 下次使用时重新同步"""
+        with self._lock:
+            self.estimates = []
+            self._attempted_at = 0.0
+
+    def probe(self) -> Optional[ClockEstimate]:
+        """探测一次"""
+        begin = time.time()
+        out = self.kit.run_shell_script(CLOCK_CMD, timeout=10)
+        end = time.time()
+        parsed = parse_clock(out)
+        if parsed is None:
+            logger.debug('clock probe failed: %r' % out)
+            return None
+        wall, uptime, precise = parsed
+        middle = (begin + end) / 2
+        return ClockEstimate(middle, wall - middle, middle - uptime, end - begin, precise)
+
+    def sync(self) -> Optional[ClockEstimate]:
+        """
+        同步一轮, 取往返最短的一次探测
+        :return: 全部探测失败时返回None
+        """
+        with self._sync_lock:
+            return self._sync()
+
+    def _sync(self) -> Optional[ClockEstimate]:
+        self._attempted_at = time.time()
+        results = [estimate for estimate in (self.probe() for _ in range(self.probes)) if estimate is not None]
+        if not results:
+            return None
+        best = min(results, key=lambda estimate: estimate.rtt)
+        with self._lock:
+            if self.estimates and abs(self._predict_boot(best.host_time) - best.boot_time) > REBOOT_THRESHOLD:
+                logger.info('device clock: reboot detected, history dropped')
+                self.estimates = []
+            self.estimates.append(best)
+            del self.estimates[:-self.history]
+        logger.debug('device clock synced: %r, drift %.1fppm' % (best, self.drift * 1e6))
+        return best
+
+    def _ensure(self):
+        latest = self.estimates[-1] if self.estimates else None
+        now = time.time()
+        if latest is None:
+            if now - self._attempted_at < RETRY_INTERVAL:
+                return
+            with self._sync_lock:
+                if not self.estimates and time.time() - self._attempted_at >= RETRY_INTERVAL:
+                    self._sync()
+        elif now - latest.host_time > self.resync_interval and now - self._attempted_at >= RETRY_INTERVAL:
+            self._resync_background()
+
+    def _resync_background(self):
+        with self._lock:
+            if self._resync_thread is not None and self._resync_thread.is_alive():
+                return
+            self._resync_thread = threading.Thread(target=self.sync, name='device-clock-%s' % self.kit.sn,
+                                                   daemon=True)
+            self._resync_thread.start()
+
+    @staticmethod
+    def _fit(points: List[Tuple[float, float]]) -> float:
+        """最小二乘斜率"""
+        count = len(points)
+        mean_x = sum(x for x, _ in points) / count
+        mean_y = sum(y for _, y in points) / count
+        var = sum((x - mean_x) ** 2 for x, _ in points)
+        if var <= 0:
+            return 0.0
+        return sum((x - mean_x) * (y - mean_y) for x, y in points) / var
+
+    def _slope(self, name: str) -> float:
+        estimates = self.estimates
+        if len(estimates) < 2 or estimates[-1].host_time - estimates[0].host_time < 1:
+            return 0.0
+        return self._fit([(estimate.host_time, getattr(estimate, name)) for estimate in estimates])
+
+    @property
+    def drift(self) -> float:
+        """设备开机时长相对本机时钟的漂移(秒/秒), 同步不足两轮时为0"""
+        return self._slope('boot_time')
+
+    @property
+    def wall_drift(self) -> float:
+        """设备墙上时间相对本机时钟的漂移(秒/秒), 包含设备端NTP校时的影响"""
+        return self._slope('offset')
+
+    def _predict_boot(self, host_time: float) -> float:
+        latest = self.estimates[-1]
+        return latest.boot_time + self.drift * (host_time - latest.host_time)
+
+    def offset(self, at: float = None) -> float:
+        """
+        :param at: 本机时间, 默认当前时间
+        :return: 设备墙上时间 - 本机时间, 未能同步时为0
+        """
+        self._ensure()
+        if not self.estimates:
+            return 0.0
+        latest = self.estimates[-1]
+        at = time.time() if at is None else at
+        offset = latest.offset + self.wall_drift * (at - latest.host_time)
+        if not latest.precise:
+            # date 不支持 %N 时秒数被截断, 取截断误差的期望
+            offset += 0.5
+        return offset
+
+    def to_host(self, device_time: float) -> float:
+        """设备墙上时间 -> 本机时间"""
+        return device_time - self.offset(device_time)
+
+    def from_host(self, host_time: float) -> float:
+        """本机时间 -> 设备墙上时间"""
+        return host_time + self.offset(host_time)
+
+    def uptime_to_host(self, uptime: float) -> float:
+        """设备开机时长(/proc/uptime) -> 本机时间, 未能同步时为当前时间"""
+        self._ensure()
+        if not self.estimates:
+            return time.time()
+        latest = self.estimates[-1]
+        drift = self.drift
+        # boot_time 随本机时间线性漂移, 代入 host = boot_time(host) + uptime 求解
+        return (latest.boot_time - drift * latest.host_time + uptime) / (1 - drift)
+
+    def __repr__(self):
+        latest = self.estimates[-1] if self.estimates else None
+        return 'DeviceClock(%r, drift=%.1fppm)' % (latest, self.drift * 1e6)
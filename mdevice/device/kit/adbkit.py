@@ -3,19 +3,38 @@ import logging
 import os
 import platform
 import re
+import shlex
 import shutil
 import time
 import xml.etree.cElementTree as ET
-from typing import Tuple
+from typing import Dict, List, Optional, Tuple
 
 from adbutils import AdbClient
 from retry import retry
 
 from mdevice import app_path
+from mdevice.device.kit.adbbatch import ShellBatch, ShellResult
+from mdevice.device.kit.adbclock import DeviceClock
+from mdevice.device.kit.adbprocess import PS_COMPACT_CMD, PS_COMPACT_HEADER, ProcessTable
+from mdevice.device.kit.adbprofile import DeviceProfile, TOP_BATCH_CMD, TOP_CMD
+from mdevice.device.kit.adbprop import BOOT_COMPLETED_CMD, BOOT_ID_CMD, REVALIDATE_INTERVAL, PropertyCache, \
+    PropertySnapshot, parse_getprop
+from mdevice.device.kit.adbshell import ShellSession
+from mdevice.device.kit.adbsocket import AdbSocketClient, ADB_PORT, called_error, is_plain_cmd, timeout_error
+from mdevice.device.kit.adbtracker import DeviceTracker
+from mdevice.error import AdbError
 from mdevice.model import AppInfo, DeviceInfo
+from mdevice.perf.android_cores import CoreCpuinfo, CoreCpuSampler
 from mdevice.perf.android_cpu import PckCpuinfo
+from mdevice.perf.android_gfx import FrameTimingCollector, GfxSample
+from mdevice.perf.android_gpu import GpuSample, GpuSampler
+from mdevice.perf.android_jiffies import JiffiesCpuinfo, JiffiesCpuSampler
 from mdevice.perf.android_mem import MemInfoPackage
-from mdevice.tools.utils import TimeUtils, FileUtils
+from mdevice.perf.android_power import PowerMonitor, PowerSample
+from mdevice.perf.android_procmem import MemSample, ProcMemSampler
+from mdevice.perf.android_snapshot import DeviceSnapshot, SnapshotCollector
+from mdevice.perf.android_threads import ThreadCpuinfo, ThreadCpuSampler
+from mdevice.tools.rawlog import RawLogWriter
 from mdevice.tools.cmdkit import CmdKit
 from mdevice.tools.apkparse import parse_apk
 from mdevice.tools.host import HostToolKit
@@ -27,14 +46,24 @@ from mdevice.tools.usb import USBHelper
 logger = LogUtils.LOGGER_DEBUG
 MNC_HOME = '/data/local/tmp/minicap'
 MNC_SO_HOME = '/data/local/tmp/minicap.so'
+# probe_health 的检查项: 名称 -> 设备端命令, 多个检查项共用的命令只执行一次
+HEALTH_CMDS = {
+    'anr': 'wm size',
+    'wifi': 'ip -f inet addr',
+    'battery_level': 'dumpsys battery',
+    'battery_temperature': 'dumpsys battery',
+    'available_size': 'df',
+}
 
 
 class ADBKit(object):
     os_name = None
     adb_path = None
+    # top / dumpsys meminfo 原始数据日志的存放目录
+    raw_log_dir = '.'
 
     def __init__(self, sn: str = None, device_proxy_ip: str = None, logger: logging.Logger = None, mnc=True,
-                 monkey=False):
+                 monkey=False, socket_transport=True, persistent_shell=False):
         """
         初始化
         :param sn: 设备序列号
@@ -42,10 +71,15 @@ class ADBKit(object):
         :param logger: log打印handler
         :param mnc:
         :param monkey: 是否触发monkey任务
+        :param socket_transport: 是否优先通过socket直连adb server执行命令(不支持的命令自动回退到adb命令行)
+        :param persistent_shell: 是否复用设备常驻shell会话执行 run_shell_cmd (依赖socket_transport)
         """
         self.host = HostToolKit() # 本机IP
         self.device_proxy_ip = device_proxy_ip
         self._adb_path = ADBKit.get_adb_path()  # ADBKit.exe程序的绝对路径
+        self._socket_transport = socket_transport
+        self._socket_client = None
+        self._persistent_shell = persistent_shell and socket_transport
         self._sn = sn
         if self._sn is None:
             devices = self.list_device()
@@ -53,7 +87,15 @@ class ADBKit(object):
                 self._sn = devices[0]
         self._os_name = None
         self.pattern = re.compile(r"\d+")
-        self._properties = {}
+        self._prop = None
+        self._cpu_samplers = {}
+        self._mem_samplers = {}
+        self._snapshot_collectors = {}
+        self._core_sampler = None
+        self._thread_samplers = {}
+        self._power_monitor = None
+        self._gpu_sampler = None
+        self._gfx_collectors = {}
         self.logger = logger if logger else LogUtils.LOGGER_DEBUG
         if mnc:
             MNCInstaller(self)
@@ -65,12 +107,66 @@ class ADBKit(object):
 
     @property
     def prop(self) -> "Property":
-        return Property(self)
+        if self._prop is None:
+            self._prop = Property(self)
+        return self._prop
 
     @property
     def sn(self):
         return self._sn
 
+    @property
+    def profile(self) -> DeviceProfile:
+        """设备静态信息, 进程内按设备共享, 属性快照失效(设备重启/断开)后自动重建
+        """
+        snapshot = self.prop.cached()
+        profile = DeviceProfile.get(self.prop.key)
+        if profile is None or snapshot is None or profile.snapshot is not snapshot:
+            profile = self._build_profile()
+        return profile
+
+    @property
+    def clock(self) -> DeviceClock:
+        """设备时钟与本机时钟的对齐(偏差/漂移), 进程内按设备共享, 首次使用时同步
+        """
+        return DeviceClock.get(self)
+
+    def refresh_profile(self) -> DeviceProfile:
+        """重新构建设备静态信息(修改分辨率等场景)
+        """
+        DeviceProfile.invalidate(self.prop.key)
+        return self._build_profile()
+
+    def _build_profile(self) -> DeviceProfile:
+        props, (_, wm_size, wm_density, page_size) = self.query(
+            ['ro.build.version.sdk', 'ro.product.cpu.abilist', 'ro.product.cpu.abi', 'ro.product.brand',
+             'ro.product.model'],
+            ['wm size reset', 'wm size', 'wm density', 'getconf PAGESIZE'])
+        sdk = DeviceProfile.parse_sdk(props['ro.build.version.sdk'])
+        abi = props['ro.product.cpu.abilist'] if sdk >= 21 else props['ro.product.cpu.abi']
+        snapshot = self.prop.cached()
+        profile = DeviceProfile(sdk=sdk, abis=[item for item in abi.strip().split(',') if item],
+                                brand=props['ro.product.brand'].strip(), model=props['ro.product.model'].strip(),
+                                display=self._parse_wm_size(wm_size),
+                                density=DeviceProfile.parse_density(wm_density.output),
+                                page_size_kb=DeviceProfile.parse_page_size(page_size.output), snapshot=snapshot)
+        # 属性快照获取失败(设备离线等)时不缓存, 下次访问重新构建
+        if snapshot is not None:
+            previous = DeviceProfile.get(self.prop.key)
+            if previous is not None and previous.snapshot is snapshot:
+                profile.top_cmd = previous.top_cmd
+                profile.ps_compact = previous.ps_compact
+                profile.gpu_nodes = previous.gpu_nodes
+            DeviceProfile.put(self.prop.key, profile)
+        return profile
+
+    @property
+    def socket_client(self) -> AdbSocketClient:
+        """直连adb server的客户端, 设备代理IP存在时连接代理机上的adb server"""
+        if self._socket_client is None or self._socket_client.serial != self._sn:
+            self._socket_client = AdbSocketClient(serial=self._sn, host=self.device_proxy_ip, port=ADB_PORT)
+        return self._socket_client
+
     @staticmethod
     def get_adb_path():
         """返回adb.exe的绝对路径。优先使用指定的adb，若环境变量未指定，则返回当前脚本tools目录下的adb
@@ -108,10 +204,23 @@ class ADBKit(object):
         ADBKit.os_name = platform.system()
         return ADBKit.os_name
 
+    @property
+    def tracker(self):
+        """设备连接状态监听器(与adb server同步后才可用), 不可用时返回None
+        """
+        if not self._socket_transport:
+            return None
+        tracker = DeviceTracker.get(host=self.device_proxy_ip, port=ADB_PORT)
+        PropertyCache.watch(tracker, self.device_proxy_ip)
+        return tracker if tracker.synced else None
+
     @time_cost(info='检查设备是否连接上')
     def is_connected(self):
         """检查设备是否连接上
         """
+        tracker = self.tracker
+        if tracker is not None:
+            return tracker.is_online(self._sn)
         if self._sn in self.list_device():
             return True
         else:
@@ -123,6 +232,9 @@ class ADBKit(object):
         :return: 返回设备列表
         :rtype: list
         """
+        tracker = self.tracker
+        if tracker is not None:
+            return tracker.devices()
         result = self.run_adb_cmd('devices')
         if not isinstance(result, str):
             result = result.decode('utf-8')
@@ -139,11 +251,14 @@ class ADBKit(object):
     @property
     def info(self):
         try:
-            device_info = DeviceInfo(sn=self._sn, os_type="Android", os_version=self.get_android_version(),
-                                     sdk_version=self.get_sdk_version(),
-                                     brand=self.get_product_brand(), model=self.get_product_model(),
-                                     rom_version=self.get_product_rom(), cpu_abi=self.get_cpu_abi(),
-                                     cpu_hardware=self.get_cpu_hardware(), display=self.get_wm_size())
+            profile = self.profile
+            props, _ = self.query(['ro.build.version.release', 'ro.build.version.sdk', 'ro.build.display.id',
+                                   'ro.hardware'])
+            sdk_version = props['ro.build.version.sdk'] or profile.sdk
+            device_info = DeviceInfo(sn=self._sn, os_type="Android", os_version=props['ro.build.version.release'],
+                                     sdk_version=sdk_version, brand=profile.brand, model=profile.model,
+                                     rom_version=props['ro.build.display.id'], cpu_abi=','.join(profile.abis),
+                                     cpu_hardware=props['ro.hardware'], display=profile.display)
             return device_info
         except Exception as e:
             self._log(e)
@@ -193,6 +308,15 @@ class ADBKit(object):
         :return: 执行adb命令的子进程或执行的结果
         :rtype: Popen or str
         """
+        timeout = 60
+        if "timeout" in kwds:
+            timeout = kwds['timeout']
+        args = [arg if isinstance(arg, str) else arg.decode('utf8') for arg in (cmd,) + argv]
+        if self._socket_transport:
+            # 优先socket直连adb server, 返回None表示该命令需要回退到adb命令行执行
+            out = self.socket_client.run_command(args, timeout=timeout)
+            if out is not None:
+                return out
         if self._sn:
             if self.device_proxy_ip:
                 cmdlet = [self._adb_path, '-H', self.device_proxy_ip, '-P 5037', '-s', self._sn, cmd]
@@ -203,15 +327,8 @@ class ADBKit(object):
                 cmdlet = [self._adb_path, '-H', self.device_proxy_ip, '-P 5037', cmd]
             else:
                 cmdlet = [self._adb_path, cmd]
-        for i in range(len(argv)):
-            arg = argv[i]
-            if not isinstance(argv[i], str):
-                arg = arg.decode('utf8')
-            cmdlet.append(arg)
+        cmdlet.extend(args[1:])
         cmd = " ".join(cmdlet)
-        timeout = 60
-        if "timeout" in kwds:
-            timeout = kwds['timeout']
         out = CmdKit.run_sysCmd(cmd, timeout=timeout)
         return out
 
@@ -233,15 +350,82 @@ class ADBKit(object):
                 return ret
             retry_count = retry_count - 1
 
+    def _run_session_cmd(self, cmd, timeout=60):
+        """通过常驻shell会话执行命令, 会话不可用时返回None
+        """
+        try:
+            code, out = ShellSession.get(self.socket_client).execute(cmd, timeout=timeout)
+        except (OSError, AdbError) as e:
+            logger.debug('%s: shell session unavailable: %s' % (self._sn, e))
+            return None
+        display_cmd = self.socket_client.display_cmd(['shell', cmd])
+        if code is None:
+            return timeout_error(display_cmd, timeout)
+        output = out.decode('utf-8', errors='replace')
+        return called_error(output, display_cmd) if code else output
+
+    def close_shell_session(self):
+        """关闭当前设备的常驻shell会话
+        """
+        ShellSession.get(self.socket_client).close()
+
     def run_shell_cmd(self, cmd, **kwds):
         """执行 adb shell 命令
         """
+        if self._persistent_shell and self._sn and is_plain_cmd([cmd]):
+            ret = self._run_session_cmd(cmd, timeout=kwds.get('timeout', 60))
+            if ret is not None:
+                return ret
         ret = self.run_adb_cmd('shell', '%s' % cmd, **kwds)
         # 当 adb 命令传入 sync=False时，ret是Poen对象
         if ret is None:
             self._log(u'adb cmd failed:%s ' % cmd)
         return ret
 
+    def run_shell_script(self, script, **kwds):
+        """执行设备端脚本, 脚本原样交给设备端 sh 解释(不经过本机shell), 返回值格式与 run_shell_cmd 一致
+        """
+        timeout = kwds.get('timeout', 60)
+        if self._persistent_shell and self._sn:
+            ret = self._run_session_cmd(script, timeout=timeout)
+            if ret is not None:
+                return ret
+        if self._socket_transport:
+            ret = self.socket_client.run_shell(script, timeout=timeout)
+            if ret is not None:
+                return ret
+        return self.run_shell_cmd(shlex.quote(script), **kwds)
+
+    def run_shell_batch(self, cmds: List[str], timeout=60) -> List[ShellResult]:
+        """一次往返批量执行多条shell命令
+
+        :param cmds: 命令列表, 每条命令由设备端 sh 解释
+        :param timeout: 整批命令的超时时间, 单位秒
+        :return: 与命令一一对应的结果列表(含退出码), 未执行完成的命令退出码为None
+        """
+        batch = ShellBatch(cmds)
+        out = self.run_shell_script(batch.script, timeout=timeout)
+        return batch.parse(out)
+
+    def query(self, props: List[str], cmds: List[str] = (), timeout=60) -> Tuple[Dict[str, str], List[ShellResult]]:
+        """一次往返读取多个属性并执行多条shell命令, 属性快照已缓存时只执行命令
+
+        :param props: 属性名列表
+        :param cmds: 额外执行的命令列表
+        :param timeout: 超时时间, 单位秒
+        :return: (属性名 -> 属性值, 命令结果列表)
+        """
+        cmds = list(cmds)
+        snapshot = self.prop.cached()
+        if snapshot is None:
+            results = self.run_shell_batch(['getprop', BOOT_ID_CMD] + cmds, timeout=timeout)
+            snapshot = self.prop.store(results[0], results[1])
+            results = results[2:]
+        else:
+            results = self.run_shell_batch(cmds, timeout=timeout) if cmds else []
+        values = {name: snapshot.get(name) if snapshot else '' for name in props}
+        return values, results
+
     def bugreport(self, save_path: str):
         """adb bugreport ~/Downloads/bugreport.zip
         """
@@ -287,15 +471,14 @@ class ADBKit(object):
     @time_cost(info='minicap截图')
     def minicap(self, filename: str = None, display: str = None, oss: bool = False):
         try:
+            if display and display != '暂无' and display != '':
+                width, height = display.replace('\n', '').replace('\r', '').split(' ')[-1].split('x')
+                screen = (width, height)
+            else:
+                screen = self.get_size()
+            screen_size = '{}x{}@{}x{}/0'.format(screen[0], screen[1], screen[0], screen[1])
             for i in range(3):
                 self._log("开始尝试第{0}次minicap截图".format(i))
-                if display and display != '暂无' and display != '':
-                    width, height = display.replace('\n', '').replace('\r', '').split(' ')[-1].split('x')
-                    screen = (width, height)
-                else:
-                    screen = self.get_size()
-
-                screen_size = '{}x{}@{}x{}/0'.format(screen[0], screen[1], screen[0], screen[1])
                 self.run_shell_cmd(
                     'LD_LIBRARY_PATH=/data/local/tmp /data/local/tmp/minicap -s -P {0} > {1}'.format(screen_size,
                                                                                                      filename))
@@ -362,7 +545,7 @@ class ADBKit(object):
     def get_current_activity(self):
         """获取当前activity名
         """
-        if int(self.get_sdk_version()) < 26:  # android8.0以下优先选择dumpsys activity top获取当前的activity
+        if self.profile.sdk < 26:  # android8.0以下优先选择dumpsys activity top获取当前的activity
             current_activity = self._get_top_activity_with_activity_top()
             if current_activity:
                 return current_activity
@@ -426,9 +609,9 @@ class ADBKit(object):
         :return: 该进程的pid
         """
         # 跟 get_process_pids 有点区别 这个返回主进程名的pid
-        pckinfo_list = self.get_pckinfo_from_ps(package_name)
-        if pckinfo_list:
-            return pckinfo_list[0]["pid"]
+        pids = self.process_table().pids(package_name)
+        if pids:
+            return pids[0]
 
     def get_pckinfo_from_ps(self, package_name: str):
         """
@@ -436,12 +619,7 @@ class ADBKit(object):
             :param package_name: 目标包名
             :return: 返回目标包名的列表信息
             """
-        ps_list = self.list_process()
-        pck_list = []
-        for item in ps_list:
-            if item["proc_name"] == package_name:
-                pck_list.append(item)
-        return pck_list
+        return [record.as_dict() for record in self.process_table().find(package_name)]
 
     def clear_data(self, package_name):
         """清除指定包的 用户数据
@@ -504,28 +682,34 @@ class ADBKit(object):
         """
         return self.prop.get('ro.product.screensize').strip()
 
-    def get_wm_size(self):
+    def get_wm_size(self, refresh=False):
         """获取屏幕分辨率  如：Physical size:1080*1920
+
+        :param refresh: 是否重新从设备读取(分辨率被修改后使用), 默认读取设备静态信息中的缓存
         """
         try:
-            self.run_shell_cmd("wm size reset")
-            res = self.run_shell_cmd("wm size | awk 'NR==1' | awk -F': ' '{print $2}'").strip()
-            if 'x' in res:
-                return res
-            else:
-                return "暂无"
+            profile = self.refresh_profile() if refresh else self.profile
+            return profile.display
         except Exception as e:
             self._log(e)
             return "暂无"
 
+    @staticmethod
+    def _parse_wm_size(result: ShellResult):
+        """从 wm size 输出的第一行中解析分辨率, 如：Physical size: 1080x1920 -> 1080x1920
+        """
+        lines = result.output.strip().splitlines()
+        res = lines[0].split(': ')[-1].strip() if lines and ': ' in lines[0] else ''
+        if 'x' in res:
+            return res
+        else:
+            return "暂无"
+
     def get_cpu_abi(self):
         """
         获取设备CPU架构，如：arm64-v8a,armeabi-v7a,armeabi
         """
-        if int(self.get_sdk_version()) >= 21:
-            return self.prop.get("ro.product.cpu.abilist").strip()
-        else:
-            return self.prop.get("ro.product.cpu.abi").strip()
+        return ','.join(self.profile.abis)
 
     def get_cpu_hardware(self):
         """
@@ -547,21 +731,12 @@ class ADBKit(object):
     def get_process_pids(self, process_name):
         """查找包含指定进程名的进程PID
         """
-        pids = []
-        process_list = self.list_process()
-        for process in process_list:
-            if process['proc_name'] == process_name:
-                pids.append(process['pid'])
-        return pids
+        return self.process_table().pids(process_name)
 
     def is_process_running(self, process_name):
         """判断进程是否存活
         """
-        process_list = self.list_process()
-        for process in process_list:
-            if process['proc_name'] == process_name:
-                return True
-        return False
+        return process_name in self.process_table()
 
     def is_app_installed(self, package):
         """
@@ -592,47 +767,30 @@ class ADBKit(object):
     def list_process(self):
         """获取进程列表
         """
-        # <= 7.0 用ps, >=8.0 用ps -A android8.0 api level 26
-        if int(self.get_sdk_version()) < 26:
-            result = self.run_shell_cmd('ps')  # 不能使用grep
-        else:
-            result = self.run_shell_cmd('ps -A')  # 不能使用grep
-        result = result.replace('\r', '')
-        lines = result.split('\n')
-        busybox = False
-        if lines[0].startswith('PID'):
-            busybox = True
-
-        result_list = []
-        for i in range(1, len(lines)):
-            items = lines[i].split()
-            if not busybox:
-                if len(items) < 9:
-                    err_msg = "ps命令返回格式错误：\n%s" % lines[i]
-                    if len(items) == 8:
-                        result_list.append({'uid': items[0], 'pid': int(items[1]), 'ppid': int(items[2]),
-                                            'proc_name': items[7], 'status': items[-2]})
-                    else:
-                        logger.error(err_msg)
-                else:
-                    result_list.append({'uid': items[0], 'pid': int(items[1]), 'ppid': int(items[2]),
-                                        'proc_name': items[8], 'status': items[-2]})
-            else:
-                idx = 4
-                cmd = items[idx]
-                if len(cmd) == 1:
-                    # 有时候发现此处会有“N”
-                    idx += 1
-                    cmd = items[idx]
-                idx += 1
-                if cmd[0] == '{' and cmd[-1] == '}':
-                    cmd = items[idx]
-                ppid = 0
-                if items[1].isdigit():
-                    ppid = int(items[1])  # 有些版本中没有ppid
-                result_list.append({'pid': int(items[0]), 'uid': items[1], 'ppid': ppid,
-                                    'proc_name': cmd, 'status': items[-2]})
-        return result_list
+        return self.process_table().as_dicts()
+
+    def process_table(self, compact=True) -> ProcessTable:
+        """获取带索引的进程表快照
+
+        :param compact: 设备支持时(Android 8.0及以上)只获取需要的列, 输出量更小
+        """
+        profile = self.profile
+        if compact and profile.ps_compact is not False:
+            result = self.run_shell_cmd(PS_COMPACT_CMD)
+            if result and result.replace('\r', '').split('\n')[0].split() == PS_COMPACT_HEADER:
+                profile.ps_compact = True
+                return ProcessTable.parse(result)
+            if profile.ps_compact is None and result and 'Error' in result and 'Timeout' not in result:
+                logger.debug('%s: ps -o not support' % self._sn)
+                profile.ps_compact = False
+        # <= 7.0 用ps, >=8.0 用ps -A, 不能使用grep
+        return ProcessTable.parse(self.run_shell_cmd(profile.ps_cmd))
+
+    @staticmethod
+    def parse_ps(result):
+        """解析 ps / ps -A 的输出为进程列表
+        """
+        return ProcessTable.parse(result).as_dicts()
 
     def kill_process(self, process_name):
         """杀死包含指定进程
@@ -660,6 +818,9 @@ class ADBKit(object):
         """重启手机
         boot_type: "bootloader", "recovery", or "None".
         """
+        PropertyCache.invalidate(self.prop.key)
+        DeviceProfile.invalidate(self.prop.key)
+        DeviceClock.invalidate(self.prop.key)
         if boot_type:
             self.run_adb_cmd('reboot ' + boot_type)
         else:
@@ -998,7 +1159,12 @@ class ADBKit(object):
             self._log(e)
 
     def get_app_cpu(self, package):
-        cpu = self._top_cpuinfo(package)
+        cpu = self.get_app_cpuinfo(package)
+        if cpu is None:
+            # /proc 不可读时回退到 top
+            cpu = self._top_cpuinfo(package)
+        if cpu is None:
+            return None
         idle_rate = cpu.idle_rate
         device_cpu_rate = cpu.device_cpu_rate
         total_pid_cpu = cpu.total_pid_cpu
@@ -1006,29 +1172,93 @@ class ADBKit(object):
         res = (float(total_pid_cpu) / (float(idle_rate) + float(device_cpu_rate))) * 100
         return str('%.2f%%' % res)
 
+    def cpu_sampler(self, package) -> JiffiesCpuSampler:
+        """应用的jiffies CPU采样器, 同一包名复用同一个采样器, 相邻两次采样之间的占用即为结果
+        """
+        key = package if isinstance(package, str) else tuple(package)
+        if key not in self._cpu_samplers:
+            self._cpu_samplers[key] = JiffiesCpuSampler(self, package, clock=self.clock)
+        return self._cpu_samplers[key]
+
+    def get_app_cpuinfo(self, package) -> JiffiesCpuinfo:
+        """
+        基于 /proc/stat 的CPU占用(字段同 PckCpuinfo), 首次调用预热 0.2s, 之后为距上次调用之间的平均占用
+        :param package: 包名或包名列表
+        :return: 采样失败返回None
+        """
+        return self.cpu_sampler(package).sample()
+
+    def get_core_cpuinfo(self) -> CoreCpuinfo:
+        """
+        每个核的CPU占用与频率, 首次调用预热 0.2s, 之后为距上次调用之间的占用
+        :return: 采样失败返回None
+        """
+        if self._core_sampler is None:
+            self._core_sampler = CoreCpuSampler(self, clock=self.clock)
+        return self._core_sampler.sample()
+
+    def get_thread_cpuinfo(self, package: str, top: int = 10) -> ThreadCpuinfo:
+        """
+        应用线程的CPU占用(按线程名汇总, 取占用最高的 top 个), 同一包名复用同一个采样器
+        :return: 应用未运行或采样失败返回None
+        """
+        sampler = self._thread_samplers.get(package)
+        if sampler is None:
+            sampler = self._thread_samplers[package] = ThreadCpuSampler(self, package, top=top, clock=self.clock)
+        sampler.top = top
+        return sampler.sample()
+
+    def get_gpu_sample(self) -> GpuSample:
+        """
+        GPU占用与频率(Adreno kgsl / Mali), 可读节点首次采集时探测并缓存在 DeviceProfile 中
+        :return: 设备没有可读的GPU节点或采样失败返回None
+        """
+        if self._gpu_sampler is None:
+            self._gpu_sampler = GpuSampler(self, clock=self.clock)
+        return self._gpu_sampler.sample()
+
+    def get_gfx_sample(self, package: str, surface_flinger: bool = False) -> GfxSample:
+        """
+        应用各窗口的帧率/卡顿(dumpsys gfxinfo framestats, 可同时采集 SurfaceFlinger 图层), 同一包名复用同一个采集器,
+        每次只解析距上次调用新增的帧
+        :param surface_flinger: 是否同时采集 SurfaceView / 游戏图层
+        :return: 首次调用(建立基线)或采集失败返回None
+        """
+        collector = self._gfx_collectors.get(package)
+        if collector is None:
+            collector = self._gfx_collectors[package] = FrameTimingCollector(self, package, clock=self.clock)
+        collector.surface_flinger = surface_flinger
+        return collector.sample()
+
     def _top_cpuinfo(self, package):
         """
         CPU占用
         :param package:
-        :return:
-        """
-        top_cmd = 'top -b -n 1 -d 1'
-        ret = self.run_shell_cmd(top_cmd)
-        if ret and 'Invalid argument "-b"' in ret:
-            logger.debug("top -b not support")
-            top_cmd = 'top -n 1 -d 1'
-        _top_pipe = self.run_shell_cmd(top_cmd, sync=False)
-        out = _top_pipe
-        out.replace('\r', '')
-        top_file = os.path.join('top_cpuinfo_%s.txt' % self._sn)
-        with open(top_file, "a+", encoding="utf-8") as writer:
-            writer.write(TimeUtils.getCurrentTime() + " top info:\n")
-            writer.write(out + "\n\n")
-        # 避免文件过大，超过100M清理
-        if FileUtils.get_FileSize(top_file) > 100:
-            os.remove(top_file)
-        sdk = int(self.get_sdk_version())
-        return PckCpuinfo(package, out, sdk)
+        :return: top 执行失败时返回None
+        """
+        profile = self.profile
+        out = None
+        if profile.top_cmd is None:
+            # 首次采集时探测 top 是否支持 -b, 支持时探测结果即为本次采样
+            out = self.run_shell_cmd(TOP_BATCH_CMD)
+            if out and 'Invalid argument "-b"' in out:
+                logger.debug("top -b not support")
+                profile.top_cmd = TOP_CMD
+                out = None
+            elif out and 'Error' not in out and '[ERROR]' not in out:
+                profile.top_cmd = TOP_BATCH_CMD
+            else:
+                # 探测失败(超时 / adb错误), 不记录结果, 重试一次
+                out = None
+        if out is None:
+            out = self.run_shell_cmd(profile.top_cmd or TOP_BATCH_CMD, sync=False)
+        if not out or 'Error' in out or '[ERROR]' in out:
+            logger.debug('top failed: %s' % out)
+            return None
+        out = out.replace('\r', '')
+        # 后台线程写入压缩分段日志, 不阻塞采样
+        RawLogWriter.get('top_cpuinfo_%s' % self._sn, directory=self.raw_log_dir).write('top info', out)
+        return PckCpuinfo(package, out, profile.sdk)
 
     def get_app_memory(self, package):
         """
@@ -1039,6 +1269,35 @@ class ADBKit(object):
         process = self.get_pid_from_pck(package)
         return self._dumpsys_process_meminfo(str(process))
 
+    def memory_sampler(self, package: str, dumpsys_interval: float = 60.0) -> ProcMemSampler:
+        """应用的轻量内存采样器, 同一包名复用同一个采样器
+
+        :param dumpsys_interval: dumpsys meminfo 的执行间隔, 单位秒, None表示不执行
+        """
+        sampler = self._mem_samplers.get(package)
+        if sampler is None:
+            sampler = self._mem_samplers[package] = ProcMemSampler(
+                self, package, dumpsys_interval=dumpsys_interval, clock=self.clock)
+        sampler.dumpsys_interval = dumpsys_interval
+        return sampler
+
+    def get_app_meminfo(self, package: str, dumpsys_interval: float = 60.0) -> MemSample:
+        """
+        基于 smaps_rollup / statm 的应用内存(字段同 MemInfoPackage), 可高频调用, dumpsys meminfo 按 dumpsys_interval 间隔执行
+        :return: 应用未运行时返回None
+        """
+        return self.memory_sampler(package, dumpsys_interval).sample()
+
+    def get_snapshot(self, package: str) -> DeviceSnapshot:
+        """
+        一次往返同时采集 CPU / 应用内存 / 电池 / 网络, 同一包名复用同一个采集器, CPU为距上次采集之间的占用
+        :return: 采集失败返回None
+        """
+        collector = self._snapshot_collectors.get(package)
+        if collector is None:
+            collector = self._snapshot_collectors[package] = SnapshotCollector(self, package, clock=self.clock)
+        return collector.capture()
+
     def _dumpsys_process_meminfo(self, process):
         """
         dump 进程详细内存 耗时 1s以内
@@ -1051,12 +1310,8 @@ class ADBKit(object):
         # if self.num % 10 == 0:
         # 避免：在windows 无法创建文件名，不能有冒号:
         process_rename = process.replace(":", "_")
-        print(process_rename)
-        meminfo_file = os.path.join('dumpsys_meminfo_%s.txt' % process_rename)
-        with open(meminfo_file, "a+", encoding="utf-8") as writer:
-            writer.write(TimeUtils.getCurrentTime() + " dumpsys meminfo package info:\n")
-            if out:
-                writer.write(out + "\n\n")
+        RawLogWriter.get('dumpsys_meminfo_%s' % process_rename, directory=self.raw_log_dir).write(
+            'dumpsys meminfo package info', out)
 
         passedtime = time.time() - time_old  # 测试meminfo这个命令的耗时，执行的时长在400多ms
         self._log("dumpsys meminfo package time consume:" + str(passedtime))
@@ -1262,36 +1517,46 @@ class ADBKit(object):
         获取WiFi连接状态
         :return:
         """
-        return 'wlan0' in self.run_shell_cmd('ip -f inet addr').strip()
+        return bool(self.probe_health(['wifi'])['wifi'])
 
     def get_battery_level(self):
         """
         返回电池电量等级
         :return:
         """
-        try:
-            res = self.run_shell_cmd("dumpsys battery | grep level | awk -F: '{print $2}'")
-            result = float(res.strip())
-            return result
-        except Exception as e:
-            self._log(e)
+        level = self.probe_health(['battery_level'])['battery_level']
+        if level is None:
+            self._log('battery level unavailable')
             return 100
+        return level
 
     def get_battery_temperature(self):
         """
         返回电池温度
         :return:
         """
-        try:
-            res = self.run_shell_cmd("dumpsys battery | grep temperature | awk -F: '{print $2}'")
-            result = float(res.strip()) / 10
-            return result
-        except Exception as e:
-            self._log(e)
+        temperature = self.probe_health(['battery_temperature'])['battery_temperature']
+        if temperature is None:
+            self._log('battery temperature unavailable')
             return 20
+        return temperature
+
+    def get_power_sample(self) -> PowerSample:
+        """
+        电池(电量/电流/电压/温度)、各 thermal_zone 温度及温控状态, 一次shell调用读取, 读取不到的节点为None
+        :return: 命令执行失败返回None
+        """
+        if self._power_monitor is None:
+            self._power_monitor = PowerMonitor(self, clock=self.clock)
+        return self._power_monitor.sample()
 
     def get_system_available_size(self):
-        res = self.run_shell_cmd("df | grep emulated | grep -v denied | head -n 1 | awk '{print $4}'")
+        size = self.probe_health(['available_size'])['available_size']
+        return 0 if size is None else size
+
+    def _parse_available_size(self, res):
+        """解析 df 中 emulated 分区可用大小, 单位GB
+        """
         try:
             if "M" in res:
                 res = res.split("M")[0]
@@ -1316,6 +1581,38 @@ class ADBKit(object):
             self._log(e)
             return 0
 
+    def probe_health(self, names: List[str] = None) -> Dict[str, object]:
+        """
+        一次往返获取设备健康状态: 是否ANR / WiFi连接状态 / 电量 / 电池温度 / 可用存储(GB)
+        get_wifi_state / get_battery_level / get_battery_temperature / get_system_available_size / check_anr
+        均基于它实现; 获取失败的指标返回None
+        :param names: 检查项(见 HEALTH_CMDS), 默认全部
+        :return: dict
+        """
+        names = list(HEALTH_CMDS) if names is None else list(names)
+        cmds = list(dict.fromkeys(HEALTH_CMDS[name] for name in names))
+        results = dict(zip(cmds, self.run_shell_batch(cmds)))
+        return {name: self._parse_health(name, results[HEALTH_CMDS[name]]) for name in names}
+
+    def _parse_health(self, name: str, result: ShellResult):
+        if result.exit_code is None:
+            return None
+        if name == 'anr':
+            return "Can't connect to window manager; is the system running?" in result.output
+        if name == 'wifi':
+            return 'wlan0' in result.output
+        if name == 'battery_level':
+            match = re.search(r'level:\s*(\d+)', result.output)
+            return float(match.group(1)) if match else None
+        if name == 'battery_temperature':
+            match = re.search(r'temperature:\s*(-?\d+)', result.output)
+            return float(match.group(1)) / 10 if match else None
+        for line in result.output.splitlines():
+            if 'emulated' in line and 'denied' not in line:
+                items = line.split()
+                return self._parse_available_size(items[3]) if len(items) > 3 else None
+        return None
+
     def reset_usb(self):
         """
         重置USB
@@ -1358,8 +1655,9 @@ class ADBKit(object):
                     pid = self.get_pid_from_pck(package_name)
                     break
             else:
-                if package_name in self.app_list_running():
-                    pid = self.get_pid_from_pck(package_name)
+                pids = self.process_table().pids(package_name)
+                if pids:
+                    pid = pids[0]
                     break
             time.sleep(1)
 
@@ -1409,22 +1707,71 @@ class ADBKit(object):
         return list(set(packages).intersection(process_names))
 
     def check_anr(self):
-        res = self.run_shell_cmd('wm size')
-        if "Can't connect to window manager; is the system running?" in res:
-            return True
-        else:
-            return False
+        return bool(self.probe_health(['anr'])['anr'])
 
 
 class Property:
+    """
+    设备属性读取: 首次读取时一次 getprop 拉取全量属性, 快照在进程内按设备共享(见 PropertyCache)
+    """
+
     def __init__(self, d: ADBKit):
         self._d = d
 
+    @property
+    def key(self) -> Tuple[str, str]:
+        return self._d.device_proxy_ip, self._d.sn
+
+    def cached(self) -> Optional[PropertySnapshot]:
+        """已缓存的有效快照, 超过 REVALIDATE_INTERVAL 未校验时比对开机标识, 设备已重启则失效并返回None
+        """
+        snapshot = PropertyCache.get(self.key)
+        if snapshot is None or time.time() - snapshot.checked_at < REVALIDATE_INTERVAL:
+            return snapshot
+        boot_id, completed = self._d.run_shell_batch([BOOT_ID_CMD, BOOT_COMPLETED_CMD])
+        if completed.ok and PropertyCache.boot_id(boot_id.output, completed.output) == snapshot.boot_id:
+            snapshot.checked_at = time.time()
+            return snapshot
+        PropertyCache.invalidate(self.key)
+        return None
+
+    def store(self, getprop: ShellResult, boot_id: ShellResult) -> Optional[PropertySnapshot]:
+        """解析 getprop 全量输出并写入缓存, 读取失败返回None
+        """
+        if not getprop.ok:
+            return None
+        props = parse_getprop(getprop.output)
+        if not props:
+            return None
+        snapshot = PropertySnapshot(props, PropertyCache.boot_id(boot_id.output if boot_id.ok else '',
+                                                                 props.get('sys.boot_completed', '')))
+        PropertyCache.put(self.key, snapshot)
+        return snapshot
+
+    def snapshot(self, refresh=False) -> Optional[PropertySnapshot]:
+        """当前设备的全量属性快照, 不存在或已失效时一次往返重新拉取
+
+        :param refresh: 是否忽略缓存强制拉取
+        """
+        snapshot = None if refresh else self.cached()
+        if snapshot is None:
+            getprop, boot_id = self._d.run_shell_batch(['getprop', BOOT_ID_CMD])
+            snapshot = self.store(getprop, boot_id)
+        return snapshot
+
     def get(self, name: str, cache=True) -> str:
+        """
+        :param name: 属性名
+        :param cache: 是否读取快照, 运行时会变化的属性(如 sys.*、persist.*)应传False
+        """
         try:
-            if cache and name in self._d._properties:
-                return self._d._properties[name]
-            value = self._d._properties[name] = self._d.run_shell_cmd('getprop {0}'.format(name)).strip()
+            snapshot = self.snapshot() if cache else None
+            if snapshot is not None:
+                return snapshot.get(name)
+            value = self._d.run_shell_cmd('getprop {0}'.format(name)).strip()
+            snapshot = PropertyCache.get(self.key)
+            if snapshot is not None and 'Error' not in value:
+                snapshot.props[name] = value
             return value
         except Exception as e:
             self._d._log(e)
@@ -1439,9 +1786,14 @@ class MNCInstaller(object):
         if not self.kit.is_connected():
             return
         try:
-            self.abi = self.kit.get_cpu_abi().split(',')[0]
-            self.sdk = self.kit.get_sdk_version()
-            if not self.is_mnc_installed():
+            # 一次往返获取CPU架构、SDK版本及minicap安装状态
+            props, (mnc, mnc_so) = self.kit.query(
+                ['ro.build.version.sdk', 'ro.product.cpu.abilist', 'ro.product.cpu.abi'],
+                ['find /data/local/tmp -name minicap', 'find /data/local/tmp -name minicap.so'])
+            self.sdk = props['ro.build.version.sdk'] or 25
+            abi = props['ro.product.cpu.abilist'] if int(self.sdk) >= 21 else props['ro.product.cpu.abi']
+            self.abi = abi.split(',')[0]
+            if not (mnc.output.strip() and mnc_so.output.strip()):
                 self.download_target_mnc()
                 self.download_target_mnc_so()
         except Exception as e:
@@ -0,0 +1,185 @@
+import time
+from typing import Dict, Iterator, List, Optional
+
+from mdevice.tools.log import LogUtils
+
+logger = LogUtils.LOGGER_DEBUG
+
+# Android 8.0(api level 26) 及以上的 toybox ps 支持 -o, 只输出需要的列
+PS_COMPACT_CMD = 'ps -A -o USER,PID,PPID,S,NAME'
+PS_COMPACT_HEADER = ['USER', 'PID', 'PPID', 'S', 'NAME']
+
+
+class ProcessRecord(object):
+    """
+    进程表中的一条记录
+    """
+    __slots__ = ('uid', 'pid', 'ppid', 'name', 'status')
+
+    def __init__(self, uid: str, pid: int, ppid: int, name: str, status: str):
+        """
+        :param uid: 进程用户, 如 u0_a123 (与 ps 输出的 USER 列一致)
+        :param pid: 进程ID
+        :param ppid: 父进程ID, 部分老版本 ps 没有该列时为0
+        :param name: 进程名
+        :param status: 进程状态, 如 S / R / Z
+        """
+        self.uid = uid
+        self.pid = pid
+        self.ppid = ppid
+        self.name = name
+        self.status = status
+
+    def as_dict(self) -> dict:
+        """转换为 ADBKit.list_process 的元素格式"""
+        return {'uid': self.uid, 'pid': self.pid, 'ppid': self.ppid, 'proc_name': self.name, 'status': self.status}
+
+    def __repr__(self):
+        return 'ProcessRecord(pid=%d, name=%r, uid=%r)' % (self.pid, self.name, self.uid)
+
+
+class ProcessDiff(object):
+    """
+    两次进程表快照之间的差异
+    """
+
+    def __init__(self, started: List[ProcessRecord], died: List[ProcessRecord], restarted: Dict[str, tuple]):
+        """
+        :param started: 新启动的进程(进程名首次出现)
+        :param died: 已退出的进程(进程名不再存在)
+        :param restarted: 进程名仍存在但pid发生变化的进程, 进程名 -> (旧pid列表, 新pid列表)
+        """
+        self.started = started
+        self.died = died
+        self.restarted = restarted
+
+    def __bool__(self):
+        return bool(self.started or self.died or self.restarted)
+
+    def __repr__(self):
+        return 'ProcessDiff(started=%r, died=%r, restarted=%r)' % (
+            [record.name for record in self.started], [record.name for record in self.died], self.restarted)
+
+
+class ProcessTable(object):
+    """
+    设备进程表快照, 按进程名 / pid / uid 建立索引, 查询无需遍历
+    """
+
+    def __init__(self, records: List[ProcessRecord], timestamp: float = None):
+        """
+        :param records: 进程记录列表, 保持 ps 输出顺序
+        :param timestamp: 快照时间戳
+        """
+        self.records = records
+        self.timestamp = timestamp or time.time()
+        self.by_pid = {}  # type: Dict[int, ProcessRecord]
+        self.by_name = {}  # type: Dict[str, List[ProcessRecord]]
+        self.by_uid = {}  # type: Dict[str, List[ProcessRecord]]
+        for record in records:
+            self.by_pid[record.pid] = record
+            self.by_name.setdefault(record.name, []).append(record)
+            self.by_uid.setdefault(record.uid, []).append(record)
+
+    @classmethod
+    def parse(cls, result: str) -> "ProcessTable":
+        """
+        解析 ps / ps -A / PS_COMPACT_CMD 的输出
+        """
+        lines = result.replace('\r', '').split('\n')
+        if lines[0].split() == PS_COMPACT_HEADER:
+            return cls(cls._parse_compact(lines))
+        return cls(cls._parse_full(lines))
+
+    @staticmethod
+    def _parse_compact(lines: List[str]) -> List[ProcessRecord]:
+        records = []
+        for line in lines[1:]:
+            items = line.split(None, 4)
+            if len(items) < 5 or not items[1].isdigit():
+                continue
+            records.append(ProcessRecord(items[0], int(items[1]), int(items[2]) if items[2].isdigit() else 0,
+                                         items[4].strip(), items[3]))
+        return records
+
+    @staticmethod
+    def _parse_full(lines: List[str]) -> List[ProcessRecord]:
+        busybox = False
+        if lines[0].startswith('PID'):
+            busybox = True
+
+        records = []
+        for i in range(1, len(lines)):
+            items = lines[i].split()
+            if not items:
+                continue
+            if not busybox:
+                if len(items) < 9:
+                    err_msg = "ps命令返回格式错误：\n%s" % lines[i]
+                    if len(items) == 8:
+                        records.append(ProcessRecord(items[0], int(items[1]), int(items[2]), items[7], items[-2]))
+                    else:
+                        logger.error(err_msg)
+                else:
+                    records.append(ProcessRecord(items[0], int(items[1]), int(items[2]), items[8], items[-2]))
+            else:
+                idx = 4
+                cmd = items[idx]
+                if len(cmd) == 1:
+                    # 有时候发现此处会有“N”
+                    idx += 1
+                    cmd = items[idx]
+                idx += 1
+                if cmd[0] == '{' and cmd[-1] == '}':
+                    cmd = items[idx]
+                ppid = 0
+                if items[1].isdigit():
+                    ppid = int(items[1])  # 有些版本中没有ppid
+                records.append(ProcessRecord(items[1], int(items[0]), ppid, cmd, items[-2]))
+        return records
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self) -> Iterator[ProcessRecord]:
+        return iter(self.records)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.by_name
+
+    def get(self, pid: int) -> Optional[ProcessRecord]:
+        return self.by_pid.get(int(pid))
+
+    def find(self, name: str) -> List[ProcessRecord]:
+        """进程名完全匹配的进程列表"""
+        return self.by_name.get(name, [])
+
+    def pids(self, name: str) -> List[int]:
+        return [record.pid for record in self.find(name)]
+
+    def find_by_uid(self, uid: str) -> List[ProcessRecord]:
+        """同一用户(同一应用)的全部进程, 包括 :push 等子进程"""
+        return self.by_uid.get(uid, [])
+
+    def as_dicts(self) -> List[dict]:
+        return [record.as_dict() for record in self.records]
+
+    def diff(self, previous: "ProcessTable") -> ProcessDiff:
+        """
+        与上一次快照比较
+        :param previous: 上一次的进程表快照
+        """
+        started = [record for name, records in self.by_name.items() if name not in previous.by_name
+                   for record in records]
+        died = [record for name, records in previous.by_name.items() if name not in self.by_name
+                for record in records]
+        restarted = {}
+        for name, records in self.by_name.items():
+            old = previous.by_name.get(name)
+            if old is None:
+                continue
+            old_pids = sorted(record.pid for record in old)
+            new_pids = sorted(record.pid for record in records)
+            if old_pids != new_pids:
+                restarted[name] = (old_pids, new_pids)
+        return ProcessDiff(started, died, restarted)
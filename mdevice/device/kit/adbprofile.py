@@ -0,0 +1,100 @@
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from mdevice.device.kit.adbprop import PropertySnapshot
+from mdevice.tools.log import LogUtils
+
+logger = LogUtils.LOGGER_DEBUG
+
+TOP_BATCH_CMD = 'top -b -n 1 -d 1'
+TOP_CMD = 'top -n 1 -d 1'
+
+
+class DeviceProfile(object):
+    """
+    设备静态信息(SDK版本、CPU架构、品牌型号、分辨率、内存页大小、ps/top 命令形式、GPU节点), 每台设备只构建一次, 进程内按
+    (设备代理IP, 序列号) 共享; 依赖的属性快照失效(设备重启/断开)后自动重建, 修改分辨率后需调用 ADBKit.refresh_profile
+    """
+    _profiles = {}  # type: Dict[Tuple[str, str], DeviceProfile]
+    _lock = threading.Lock()
+
+    def __init__(self, sdk: int = 25, abis: List[str] = None, brand: str = '', model: str = '',
+                 display: str = '暂无', density: int = None, page_size_kb: int = 4,
+                 snapshot: PropertySnapshot = None):
+        """
+        :param sdk: SDK版本, 读取失败时为25
+        :param abis: CPU架构列表, 如 ['arm64-v8a', 'armeabi-v7a']
+        :param brand: 品牌
+        :param model: 型号
+        :param display: 物理分辨率, 如 1080x1920, 获取不到为 暂无
+        :param density: 物理屏幕密度, 获取不到为None
+        :param page_size_kb: 内存页大小, 单位KB, 读取失败时为4(16K页设备为16)
+        :param snapshot: 构建时使用的属性快照, 快照被替换说明设备信息可能已变化
+        """
+        self.sdk = sdk
+        self.abis = abis or []
+        self.brand = brand
+        self.model = model
+        self.display = display
+        self.density = density
+        self.page_size_kb = page_size_kb
+        self.snapshot = snapshot
+        # top 是否支持 -b 参数, 首次采集CPU时探测
+        self.top_cmd = None  # type: Optional[str]
+        # ps 是否支持 -o 指定输出列, 首次获取进程表时探测
+        self.ps_compact = None if sdk >= 26 else False  # type: Optional[bool]
+        # 可读的GPU节点(指标 -> (路径, 格式)), 首次采集GPU时探测, 空字典表示没有可读节点
+        self.gpu_nodes = None  # type: Optional[Dict[str, Tuple[str, str]]]
+
+    @property
+    def ps_cmd(self) -> str:
+        # <= 7.0 用ps, >=8.0 用ps -A android8.0 api level 26
+        return 'ps' if self.sdk < 26 else 'ps -A'
+
+    @property
+    def size(self) -> Optional[Tuple[str, str]]:
+        """分辨率 (宽, 高), 获取不到时为None"""
+        if 'x' not in self.display:
+            return None
+        width, height = self.display.split('x')
+        return width, height
+
+    @classmethod
+    def get(cls, key: Tuple[str, str]) -> Optional["DeviceProfile"]:
+        with cls._lock:
+            return cls._profiles.get(key)
+
+    @classmethod
+    def put(cls, key: Tuple[str, str], profile: "DeviceProfile"):
+        with cls._lock:
+            cls._profiles[key] = profile
+
+    @classmethod
+    def invalidate(cls, key: Tuple[str, str]):
+        with cls._lock:
+            cls._profiles.pop(key, None)
+
+    @staticmethod
+    def parse_sdk(value: str) -> int:
+        value = value.strip()
+        return int(value) if value.isdigit() else 25
+
+    @staticmethod
+    def parse_density(output: str) -> Optional[int]:
+        """从 wm density 输出的第一行中解析屏幕密度, 如：Physical density: 440 -> 440
+        """
+        lines = output.strip().splitlines()
+        value = lines[0].split(': ')[-1].strip() if lines and ': ' in lines[0] else ''
+        return int(value) if value.isdigit() else None
+
+    @staticmethod
+    def parse_page_size(output: str) -> int:
+        """从 getconf PAGESIZE 的输出中解析页大小(KB), 如：16384 -> 16, 解析失败时为4
+        """
+        value = output.strip()
+        return int(value) // 1024 if value.isdigit() and int(value) >= 1024 else 4
+
+    def __repr__(self):
+        return ('DeviceProfile(sdk=%d, abis=%r, brand=%r, model=%r, display=%r, density=%r, page_size_kb=%d, '
+                'top_cmd=%r)' % (self.sdk, self.abis, self.brand, self.model, self.display, self.density,
+                                 self.page_size_kb, self.top_cmd))
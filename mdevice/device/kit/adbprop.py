@@ -0,0 +1,90 @@
+import re
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from mdevice.tools.log import LogUtils
+
+logger = LogUtils.LOGGER_DEBUG
+
+# 与属性快照同一批次读取, 设备重启后 boot_id 必然变化
+BOOT_ID_CMD = 'cat /proc/sys/kernel/random/boot_id'
+BOOT_COMPLETED_CMD = 'getprop sys.boot_completed'
+REVALIDATE_INTERVAL = 60
+
+RE_GETPROP = re.compile(r'^\[(.*?)\]: \[(.*?)\]$', re.M | re.S)
+
+
+def parse_getprop(output: str) -> Dict[str, str]:
+    """
+    解析 getprop 全量输出, 每行格式为 [name]: [value], 值中可能包含换行
+    :return: 属性名 -> 属性值
+    """
+    return {name: value for name, value in RE_GETPROP.findall(output.replace('\r\n', '\n'))}
+
+
+class PropertySnapshot(object):
+    """
+    一台设备某次启动期间的全量属性快照
+    """
+
+    def __init__(self, props: Dict[str, str], boot_id: str):
+        """
+        :param props: 属性名 -> 属性值
+        :param boot_id: 开机标识(boot_id 与 sys.boot_completed), 变化说明设备已重启
+        """
+        self.props = props
+        self.boot_id = boot_id
+        self.checked_at = time.time()
+
+    def get(self, name: str, default: str = '') -> str:
+        return self.props.get(name, default)
+
+
+class PropertyCache(object):
+    """
+    进程内共享的设备属性快照缓存, 以 (设备代理IP, 序列号) 为key, 多个 ADBKit 对象共用同一份快照;
+    设备重启(ADBKit.reboot)、断开连接(DeviceTracker回调)时失效, 超过 REVALIDATE_INTERVAL 未校验的快照
+    需重新比对开机标识后才能继续使用
+    """
+    _snapshots = {}  # type: Dict[Tuple[str, str], PropertySnapshot]
+    _lock = threading.Lock()
+    _watched = set()
+
+    @staticmethod
+    def boot_id(boot_id_output: str, boot_completed: str) -> str:
+        return '%s|%s' % (boot_id_output.strip(), boot_completed.strip())
+
+    @classmethod
+    def get(cls, key: Tuple[str, str]) -> Optional[PropertySnapshot]:
+        with cls._lock:
+            return cls._snapshots.get(key)
+
+    @classmethod
+    def put(cls, key: Tuple[str, str], snapshot: PropertySnapshot):
+        with cls._lock:
+            cls._snapshots[key] = snapshot
+
+    @classmethod
+    def invalidate(cls, key: Tuple[str, str]):
+        with cls._lock:
+            if cls._snapshots.pop(key, None) is not None:
+                logger.debug('%s: property snapshot invalidated' % key[1])
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._snapshots.clear()
+
+    @classmethod
+    def watch(cls, tracker, host: str = None):
+        """
+        设备断开时使对应快照失效, 同一监听器只注册一次
+        :param tracker: DeviceTracker
+        :param host: 监听器对应的设备代理IP, 本机为None
+        """
+        with cls._lock:
+            if id(tracker) in cls._watched:
+                return
+            cls._watched.add(id(tracker))
+        tracker.add_listener(on_disconnect=lambda serial: cls.invalidate((host, serial)))
@@ -0,0 +1,173 @@
+import re
+import shlex
+import socket
+import struct
+import threading
+import time
+import uuid
+from typing import Optional, Tuple
+
+from mdevice.device.kit.adbsocket import AdbConnection, AdbSocketClient, SHELL_ID_EXIT, SHELL_ID_STDERR, \
+    SHELL_ID_STDIN, SHELL_ID_STDOUT
+from mdevice.error import AdbError
+from mdevice.tools.log import LogUtils
+
+logger = LogUtils.LOGGER_DEBUG
+
+CONNECT_TIMEOUT = 10
+
+
+class ShellSessionClosed(AdbError):
+    pass
+
+
+class ShellSession(object):
+    """
+    设备常驻 shell 会话: 每个设备保持一条 adb shell 连接, 命令写入 stdin,
+    每条命令输出后追加唯一结束标记(含退出码)用于切分, 小命令只需一次往返, 无需新建进程
+
+    - 会话断开后下次执行命令时自动重连
+    - 单条命令超时不会断开会话: 记录该命令的结束标记, 下一条命令执行前先丢弃其剩余输出,
+      若在下一条命令一半的超时时间内仍未结束, 则重建会话
+    - 命令在子shell中执行, 命令内 exit / cd 或语法错误等不会影响会话本身
+    """
+    _sessions = {}
+    _sessions_lock = threading.Lock()
+
+    def __init__(self, client: AdbSocketClient):
+        self.client = client
+        self._lock = threading.Lock()
+        self._conn = None  # type: Optional[AdbConnection]
+        self._v2 = False
+        self._raw = b''  # 未解析的 shell v2 数据包
+        self._buffer = b''  # 已解析的标准输出
+        self._pending = None  # 超时命令的结束标记, 下一条命令执行前需先读完
+
+    @classmethod
+    def get(cls, client: AdbSocketClient) -> "ShellSession":
+        """按 adb server 地址 + 设备序列号复用会话"""
+        key = (client.host, client.port, client.serial)
+        with cls._sessions_lock:
+            session = cls._sessions.get(key)
+            if session is None:
+                session = cls._sessions[key] = ShellSession(client)
+            return session
+
+    @classmethod
+    def close_all(cls):
+        with cls._sessions_lock:
+            sessions = list(cls._sessions.values())
+            cls._sessions.clear()
+        for session in sessions:
+            session.close()
+
+    @property
+    def connected(self) -> bool:
+        return self._conn is not None
+
+    def _open(self):
+        # 支持 shell_v2 时使用无pty的交互shell, 否则使用 exec:sh, 均可避免pty回显和换行符转换
+        self._v2 = self.client.supports_shell_v2()
+        service = 'shell,v2,raw:' if self._v2 else 'exec:sh'
+        self._conn = self.client.open_service(service, timeout=CONNECT_TIMEOUT)
+        self._raw = b''
+        self._buffer = b''
+        self._pending = None
+        logger.debug('%s: shell session opened (%s)' % (self.client.serial, service))
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = None
+        self._raw = b''
+        self._buffer = b''
+        self._pending = None
+
+    def _write(self, data: bytes):
+        if self._v2:
+            data = struct.pack('<BI', SHELL_ID_STDIN, len(data)) + data
+        self._conn.send(data)
+
+    def _read_more(self):
+        """从连接中读取一次数据, 解析出标准输出追加到缓冲区"""
+        chunk = self._conn.recv()
+        if not chunk:
+            raise ShellSessionClosed('shell session closed by device')
+        if not self._v2:
+            self._buffer += chunk
+            return
+        self._raw += chunk
+        while len(self._raw) >= 5:
+            packet_id, length = struct.unpack('<BI', self._raw[:5])
+            if len(self._raw) < 5 + length:
+                break
+            data, self._raw = self._raw[5:5 + length], self._raw[5 + length:]
+            if packet_id in (SHELL_ID_STDOUT, SHELL_ID_STDERR):
+                self._buffer += data
+            elif packet_id == SHELL_ID_EXIT:
+                raise ShellSessionClosed('shell session exited')
+
+    def _read_until(self, pattern, deadline: float):
+        """读取到结束标记为止, 返回 (标记前的输出, 匹配对象)"""
+        self._conn.deadline = deadline
+        while True:
+            match = pattern.search(self._buffer)
+            if match:
+                output, self._buffer = self._buffer[:match.start()], self._buffer[match.end():]
+                return output, match
+            self._read_more()
+
+    def _drain(self, deadline: float):
+        """丢弃上一条超时命令的剩余输出"""
+        if self._pending is None:
+            return
+        try:
+            self._read_until(self._pending, deadline)
+            self._pending = None
+        except socket.timeout:
+            # 上一条命令仍未结束, 重建会话避免阻塞后续命令
+            logger.debug('%s: previous command still running, reopen shell session' % self.client.serial)
+            self.close()
+        except (OSError, AdbError):
+            self.close()
+
+    def execute(self, cmd: str, timeout: float = 60) -> Tuple[Optional[int], bytes]:
+        """
+        在会话中执行命令, stderr 与 stdout 合并输出
+        :param cmd: 设备端执行的命令(由设备端 sh 解释)
+        :param timeout: 超时时间, 单位秒
+        :return: (退出码, 输出); 超时返回 (None, 已读取的输出)
+        :raise ShellSessionClosed / OSError: 会话在命令执行过程中断开
+        """
+        with self._lock:
+            start = time.time()
+            deadline = start + timeout
+            if self._conn is not None:
+                # 丢弃上一条超时命令的输出最多占用一半的超时时间
+                self._drain(start + timeout / 2.0)
+            marker = '__MDEVICE_%s__' % uuid.uuid4().hex
+            # 通过 eval 在子shell中执行, 命令存在语法错误时只影响子shell, 不会导致会话退出
+            script = '(eval %s) </dev/null 2>&1\nprintf "\\n%s %%d\\n" $?\n' % (shlex.quote(cmd), marker)
+            pattern = re.compile(b'\n' + marker.encode() + rb' (\d+)\n')
+            for attempt in range(2):
+                if self._conn is None:
+                    self._open()
+                self._conn.deadline = deadline
+                try:
+                    self._write(script.encode('utf-8'))
+                    break
+                except (OSError, AdbError):
+                    # 会话已失效(设备重连/adb server重启等), 重连后重试一次
+                    self.close()
+                    if attempt:
+                        raise
+            try:
+                output, match = self._read_until(pattern, deadline)
+                return int(match.group(1)), output
+            except socket.timeout:
+                self._pending = pattern
+                output, self._buffer = self._buffer, b''
+                return None, output
+            except (OSError, AdbError):
+                self.close()
+                raise
@@ -0,0 +1,408 @@
+import os
+import socket
+import stat
+import struct
+import time
+from typing import List, Optional, Tuple
+
+from mdevice.error import AdbError
+from mdevice.tools.log import LogUtils
+
+logger = LogUtils.LOGGER_DEBUG
+
+ADB_HOST = '127.0.0.1'
+ADB_PORT = 5037
+
+# 会被本机 /bin/sh 解释的字符, 命令中出现这些字符时不能直接透传给设备端 sh
+SHELL_SPECIAL_CHARS = frozenset('|&;<>()$`\\"\'*?[]#~!{}\n')
+
+# shell v2 协议包类型
+SHELL_ID_STDIN = 0
+SHELL_ID_STDOUT = 1
+SHELL_ID_STDERR = 2
+SHELL_ID_EXIT = 3
+SHELL_ID_CLOSE_STDIN = 4
+
+SYNC_DATA_MAX = 64 * 1024
+
+
+def is_plain_cmd(args) -> bool:
+    """
+    判断命令参数是否不含本机shell元字符, 即本机 sh 只会按空白切分而不会做其它解释
+    :param args: 命令参数列表
+    :return:
+    """
+    for arg in args:
+        if not arg or SHELL_SPECIAL_CHARS.intersection(arg):
+            return False
+    return True
+
+
+def called_error(output: str, cmd: str) -> str:
+    """与 CmdKit.run_sysCmd 命令执行失败时的返回格式保持一致"""
+    return "[Error]Called Error ： " + output + "命令为：" + cmd
+
+
+def timeout_error(cmd: str, timeout) -> str:
+    """与 CmdKit.run_sysCmd 命令执行超时时的返回格式保持一致"""
+    return "[ERROR]Timeout Error : Command '" + cmd + "' timed out after " + str(timeout) + " seconds"
+
+
+class AdbConnection(object):
+    """
+    与adb server的一条socket连接, 负责 smart socket 协议的收发:
+    请求为 4位十六进制长度 + 服务名, 应答为 OKAY 或 FAIL + 4位十六进制长度 + 错误信息
+    """
+
+    def __init__(self, host: str, port: int, timeout: float = 60):
+        self.deadline = time.time() + timeout
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def _apply_deadline(self):
+        remaining = self.deadline - time.time()
+        if remaining <= 0:
+            raise socket.timeout('adb connection timed out')
+        self.sock.settimeout(remaining)
+
+    def send(self, data: bytes):
+        self._apply_deadline()
+        self.sock.sendall(data)
+
+    def send_request(self, service: str):
+        data = service.encode('utf-8')
+        self.send(b'%04x' % len(data) + data)
+
+    def recv(self, size: int = 64 * 1024) -> bytes:
+        self._apply_deadline()
+        return self.sock.recv(size)
+
+    def read_exact(self, size: int) -> bytes:
+        chunks = []
+        while size > 0:
+            chunk = self.recv(size)
+            if not chunk:
+                raise AdbError('connection closed by adb server')
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+    def read_string(self) -> str:
+        length = int(self.read_exact(4), 16)
+        return self.read_exact(length).decode('utf-8', errors='replace')
+
+    def read_all(self) -> bytes:
+        chunks = []
+        while True:
+            chunk = self.recv()
+            if not chunk:
+                return b''.join(chunks)
+            chunks.append(chunk)
+
+    def check_okay(self):
+        status = self.read_exact(4)
+        if status == b'OKAY':
+            return
+        if status == b'FAIL':
+            raise AdbError(self.read_string())
+        raise AdbError('unexpected adb response: %r' % status)
+
+
+class AdbSocketClient(object):
+    """
+    直接通过socket与adb server(默认5037端口)通信, 省去每条命令 fork /bin/sh 和 adb 客户端的开销
+    支持: host:devices / host:transport:<serial> / shell: / exec: / sync: / reboot:
+    host和port可指定, 即可以连接设备代理机上的adb server, 也可以连接本地模拟的adb server
+    """
+
+    def __init__(self, serial: str = None, host: str = None, port: int = ADB_PORT):
+        self.serial = serial
+        self.host = host or ADB_HOST
+        self.port = port
+        self._features = None
+
+    def connect(self, timeout: float = 60) -> AdbConnection:
+        return AdbConnection(self.host, self.port, timeout=timeout)
+
+    def display_cmd(self, args) -> str:
+        """拼接出与 adb 命令行等价的命令, 用于日志和错误信息"""
+        cmdlet = ['adb']
+        if self.host != ADB_HOST:
+            cmdlet += ['-H', self.host, '-P', str(self.port)]
+        if self.serial:
+            cmdlet += ['-s', self.serial]
+        return ' '.join(cmdlet + list(args))
+
+    def host_command(self, service: str, timeout: float = 10) -> str:
+        """
+        执行 host 服务, 返回长度前缀的应答内容
+        :param service: 如 host:devices / host:version
+        :return:
+        """
+        with self.connect(timeout) as conn:
+            conn.send_request(service)
+            conn.check_okay()
+            return conn.read_string()
+
+    def open_transport(self, timeout: float = 60) -> AdbConnection:
+        """建立连接并切换到目标设备的transport, 后续请求直接发送给设备端adbd"""
+        conn = self.connect(timeout)
+        try:
+            if self.serial:
+                conn.send_request('host:transport:%s' % self.serial)
+            else:
+                conn.send_request('host:transport-any')
+            conn.check_okay()
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def open_service(self, service: str, timeout: float = 60) -> AdbConnection:
+        conn = self.open_transport(timeout)
+        try:
+            conn.send_request(service)
+            conn.check_okay()
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def devices(self) -> List[Tuple[str, str]]:
+        """
+        设备列表
+        :return: [(serial, state), ...]
+        """
+        result = []
+        for line in self.host_command('host:devices').splitlines():
+            if '\t' in line:
+                serial, state = line.split('\t', 1)
+                result.append((serial, state))
+        return result
+
+    def features(self) -> set:
+        """设备与adb server共同支持的特性, 如 shell_v2"""
+        if self._features is None:
+            if self.serial:
+                service = 'host-serial:%s:features' % self.serial
+            else:
+                service = 'host:features'
+            self._features = set(self.host_command(service).split(','))
+        return self._features
+
+    def supports_shell_v2(self) -> bool:
+        try:
+            return 'shell_v2' in self.features()
+        except AdbError:
+            return False
+
+    def shell(self, cmd: str, timeout: float = 60) -> Tuple[int, bytes]:
+        """
+        执行 adb shell 命令, stderr 与 stdout 合并输出
+        :param cmd: 设备端执行的命令(由设备端 sh 解释)
+        :param timeout: 超时时间, 单位秒
+        :return: (退出码, 输出); 设备不支持 shell_v2 时无法获取退出码, 返回0
+        """
+        if not self.supports_shell_v2():
+            with self.open_service('shell:%s' % cmd, timeout) as conn:
+                return 0, conn.read_all()
+        with self.open_service('shell,v2,raw:%s' % cmd, timeout) as conn:
+            output = []
+            exit_code = 0
+            while True:
+                header = conn.recv(5)
+                if not header:
+                    break
+                if len(header) < 5:
+                    header += conn.read_exact(5 - len(header))
+                packet_id, length = struct.unpack('<BI', header)
+                data = conn.read_exact(length) if length else b''
+                if packet_id in (SHELL_ID_STDOUT, SHELL_ID_STDERR):
+                    output.append(data)
+                elif packet_id == SHELL_ID_EXIT:
+                    exit_code = data[0] if data else 0
+                    break
+            return exit_code, b''.join(output)
+
+    def exec_out(self, cmd: str, timeout: float = 60) -> bytes:
+        """adb exec-out, 原始二进制输出"""
+        with self.open_service('exec:%s' % cmd, timeout) as conn:
+            return conn.read_all()
+
+    def reboot(self, mode: str = ''):
+        with self.open_service('reboot:%s' % mode, timeout=10) as conn:
+            try:
+                conn.read_all()
+            except (OSError, AdbError):
+                pass
+
+    @staticmethod
+    def _sync_request(conn: AdbConnection, sync_id: bytes, path: str):
+        data = path.encode('utf-8')
+        conn.send(sync_id + struct.pack('<I', len(data)) + data)
+
+    def _sync_stat(self, conn: AdbConnection, path: str) -> Tuple[int, int, int]:
+        self._sync_request(conn, b'STAT', path)
+        resp = conn.read_exact(16)
+        if resp[:4] != b'STAT':
+            raise AdbError('unexpected sync response: %r' % resp[:4])
+        return struct.unpack('<III', resp[4:])
+
+    @staticmethod
+    def _sync_fail_message(conn: AdbConnection, resp: bytes) -> str:
+        length = struct.unpack('<I', resp[4:8])[0]
+        return conn.read_exact(length).decode('utf-8', errors='replace')
+
+    def push(self, src_path: str, dst_path: str, timeout: float = 300) -> int:
+        """
+        通过 sync 协议推送单个文件到设备
+        :return: 推送的字节数
+        """
+        st = os.stat(src_path)
+        with self.open_service('sync:', timeout) as conn:
+            mode = self._sync_stat(conn, dst_path)[0]
+            if stat.S_ISDIR(mode) or dst_path.endswith('/'):
+                dst_path = dst_path.rstrip('/') + '/' + os.path.basename(src_path)
+            self._sync_request(conn, b'SEND', '%s,%d' % (dst_path, st.st_mode))
+            total = 0
+            with open(src_path, 'rb') as reader:
+                while True:
+                    chunk = reader.read(SYNC_DATA_MAX)
+                    if not chunk:
+                        break
+                    conn.send(b'DATA' + struct.pack('<I', len(chunk)) + chunk)
+                    total += len(chunk)
+            conn.send(b'DONE' + struct.pack('<I', int(st.st_mtime)))
+            resp = conn.read_exact(8)
+            if resp[:4] == b'FAIL':
+                raise AdbError(self._sync_fail_message(conn, resp))
+            if resp[:4] != b'OKAY':
+                raise AdbError('unexpected sync response: %r' % resp[:4])
+            conn.send(b'QUIT' + struct.pack('<I', 0))
+            return total
+
+    def pull(self, src_path: str, dst_path: str, timeout: float = 180) -> int:
+        """
+        通过 sync 协议从设备拉取单个文件
+        :return: 拉取的字节数
+        """
+        if os.path.isdir(dst_path):
+            dst_path = os.path.join(dst_path, os.path.basename(src_path.rstrip('/')))
+        with self.open_service('sync:', timeout) as conn:
+            self._sync_request(conn, b'RECV', src_path)
+            total = 0
+            with open(dst_path, 'wb') as writer:
+                while True:
+                    resp = conn.read_exact(8)
+                    if resp[:4] == b'DATA':
+                        chunk = conn.read_exact(struct.unpack('<I', resp[4:])[0])
+                        writer.write(chunk)
+                        total += len(chunk)
+                    elif resp[:4] == b'DONE':
+                        break
+                    elif resp[:4] == b'FAIL':
+                        message = self._sync_fail_message(conn, resp)
+                        writer.close()
+                        os.remove(dst_path)
+                        raise AdbError(message)
+                    else:
+                        raise AdbError('unexpected sync response: %r' % resp[:4])
+            conn.send(b'QUIT' + struct.pack('<I', 0))
+            return total
+
+    def is_remote_dir(self, path: str, timeout: float = 10) -> bool:
+        with self.open_service('sync:', timeout) as conn:
+            mode = self._sync_stat(conn, path)[0]
+            conn.send(b'QUIT' + struct.pack('<I', 0))
+            return stat.S_ISDIR(mode)
+
+    def run_command(self, args: List[str], timeout: float = 60) -> Optional[str]:
+        """
+        以 adb 命令行的参数形式执行命令, 返回值格式与 CmdKit.run_sysCmd 一致
+        仅支持 devices / shell / exec-out / reboot / push / pull 的常规用法,
+        参数中含本机shell元字符(重定向、管道、通配符等)或不支持的命令返回 None, 由调用方回退到adb命令行
+        :param args: 如 ['shell', 'getprop', 'ro.build.version.sdk']
+        :param timeout: 超时时间, 单位秒
+        :return:
+        """
+        if not args or not is_plain_cmd(args):
+            return None
+        tokens = ' '.join(args).split()
+        name, params = tokens[0], tokens[1:]
+        cmd = self.display_cmd(tokens)
+        try:
+            if name == 'devices' and not params:
+                lines = ['%s\t%s' % item for item in self.devices()]
+                return '\n'.join(['List of devices attached'] + lines) + '\n\n'
+            if name == 'shell' and params:
+                return self.run_shell(' '.join(params), timeout=timeout)
+            if name == 'exec-out' and params:
+                return self.exec_out(' '.join(params), timeout=timeout).decode('utf-8', errors='replace')
+            if name == 'reboot' and len(params) <= 1:
+                self.reboot(params[0] if params else '')
+                return ''
+            if name == 'push' and len(params) == 2:
+                src_path, dst_path = params
+                if not os.path.exists(src_path):
+                    return called_error("adb: error: cannot stat '%s': No such file or directory\n" % src_path, cmd)
+                if not os.path.isfile(src_path):
+                    return None
+                return self._transfer(self.push, 'pushed', src_path, dst_path, cmd, timeout)
+            if name == 'pull' and len(params) == 2:
+                if self.is_remote_dir(params[0]):
+                    return None
+                return self._transfer(self.pull, 'pulled', params[0], params[1], cmd, timeout)
+        except socket.timeout:
+            msg = timeout_error(cmd, timeout)
+            logger.debug(msg)
+            return msg
+        except AdbError as e:
+            return called_error('adb: error: %s\n' % e.info, cmd)
+        except OSError as e:
+            # adb server 不可用(未启动或端口被占用等), 回退到adb命令行
+            logger.debug('adb socket unavailable: %s' % e)
+            return None
+        return None
+
+    def run_shell(self, cmd: str, timeout: float = 60) -> Optional[str]:
+        """
+        执行设备端shell命令(命令原样交给设备端 sh 解释), 返回值格式与 CmdKit.run_sysCmd 一致
+        adb server 不可用时返回 None
+        """
+        display_cmd = self.display_cmd(['shell', cmd])
+        try:
+            code, out = self.shell(cmd, timeout=timeout)
+        except socket.timeout:
+            msg = timeout_error(display_cmd, timeout)
+            logger.debug(msg)
+            return msg
+        except AdbError as e:
+            return called_error('adb: error: %s\n' % e.info, display_cmd)
+        except OSError as e:
+            logger.debug('adb socket unavailable: %s' % e)
+            return None
+        output = out.decode('utf-8', errors='replace')
+        return called_error(output, display_cmd) if code else output
+
+    @staticmethod
+    def _transfer(func, action, src_path, dst_path, cmd, timeout) -> str:
+        start = time.time()
+        try:
+            size = func(src_path, dst_path, timeout=timeout)
+        except AdbError as e:
+            return called_error("adb: error: failed to copy '%s' to '%s': %s\n" % (src_path, dst_path, e.info), cmd)
+        cost = max(time.time() - start, 0.001)
+        return '%s: 1 file %s, 0 skipped. %.1f MB/s (%d bytes in %.3fs)\n' % (
+            src_path, action, size / cost / 1024 / 1024, size, cost)
@@ -0,0 +1,168 @@
+import socket
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from mdevice.device.kit.adbsocket import ADB_HOST, ADB_PORT, AdbSocketClient
+from mdevice.error import AdbError
+from mdevice.tools.log import LogUtils
+
+logger = LogUtils.LOGGER_DEBUG
+
+SYNC_TIMEOUT = 1.0
+IDLE_RECONNECT = 600
+
+
+class DeviceTracker(object):
+    """
+    设备连接状态监听: 后台线程保持一条 host:track-devices 长连接, adb server 在设备状态变化时主动推送,
+    内存中维护 serial -> state(device / offline / unauthorized ...) 表, 并触发连接/断开回调,
+    查询设备状态无需再执行 adb devices; adb server 重启或连接断开后自动重连
+    """
+    _trackers = {}
+    _trackers_lock = threading.Lock()
+
+    def __init__(self, host: str = None, port: int = ADB_PORT, reconnect_interval: float = 1.0):
+        """
+        :param host: adb server 地址, 设备代理IP或本机
+        :param port: adb server 端口
+        :param reconnect_interval: 连接断开后的重连间隔, 单位秒
+        """
+        self.client = AdbSocketClient(host=host, port=port)
+        self.reconnect_interval = reconnect_interval
+        self._states = {}  # type: Dict[str, str]
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._synced = threading.Event()
+        self._stopped = threading.Event()
+        self._conn = None
+        self._thread = None
+
+    @classmethod
+    def get(cls, host: str = None, port: int = ADB_PORT) -> "DeviceTracker":
+        """
+        获取指定 adb server 的监听器(进程内共享), 首次获取时启动并最多等待 SYNC_TIMEOUT 秒拿到设备列表
+        """
+        key = (host or ADB_HOST, port)
+        with cls._trackers_lock:
+            tracker = cls._trackers.get(key)
+            created = tracker is None
+            if created:
+                tracker = cls._trackers[key] = DeviceTracker(host=host, port=port)
+                tracker.start()
+        if created:
+            tracker.wait_synced(SYNC_TIMEOUT)
+        return tracker
+
+    @property
+    def synced(self) -> bool:
+        """是否已与 adb server 同步设备列表, 未同步时设备状态不可信"""
+        return self._synced.is_set()
+
+    def wait_synced(self, timeout: float = None) -> bool:
+        return self._synced.wait(timeout)
+
+    def add_listener(self, on_connect: Callable[[str], None] = None, on_disconnect: Callable[[str], None] = None):
+        """
+        注册设备状态回调, 回调在监听线程中执行, 不应阻塞
+        :param on_connect: 设备变为 device 状态时回调 on_connect(serial)
+        :param on_disconnect: 设备离开 device 状态(断开/offline/unauthorized)时回调 on_disconnect(serial)
+        """
+        self._listeners.append((on_connect, on_disconnect))
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='adb-track-devices-%s' % self.client.host,
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        conn = self._conn
+        if conn is not None:
+            # 仅 close 无法唤醒阻塞在 recv 上的监听线程
+            try:
+                conn.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            conn.close()
+
+    def state(self, serial: str) -> Optional[str]:
+        with self._lock:
+            return self._states.get(serial)
+
+    def is_online(self, serial: str) -> bool:
+        return self.state(serial) == 'device'
+
+    def devices(self, state: str = 'device') -> List[str]:
+        """
+        :param state: 设备状态, None表示全部
+        :return: 设备序列号列表
+        """
+        with self._lock:
+            return [serial for serial, value in self._states.items() if state is None or value == state]
+
+    @property
+    def states(self) -> Dict[str, str]:
+        with self._lock:
+            return dict(self._states)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            idle = False
+            try:
+                self._conn = self.client.connect(timeout=SYNC_TIMEOUT * 5)
+                self._conn.send_request('host:track-devices')
+                self._conn.check_okay()
+                while not self._stopped.is_set():
+                    # 设备列表无变化时连接上不会有数据, 空闲超时后重连即可
+                    self._conn.deadline = time.time() + IDLE_RECONNECT
+                    idle = True
+                    data = self._conn.read_string()
+                    idle = False
+                    self._update(data)
+            except socket.timeout as e:
+                if not idle and not self._stopped.is_set():
+                    logger.debug('%s: track-devices timed out: %s' % (self.client.host, e))
+            except (OSError, AdbError) as e:
+                idle = False
+                if not self._stopped.is_set():
+                    logger.debug('%s: track-devices disconnected: %s' % (self.client.host, e))
+            finally:
+                if self._conn is not None:
+                    self._conn.close()
+                    self._conn = None
+            if idle:
+                # 空闲超时是计划内的重连: 保留设备表, 立即重连, 由重连后推送的设备列表与当前表比较
+                continue
+            # 连接断开期间设备状态未知, 视为全部断开, 重连后由新的设备列表恢复
+            self._synced.clear()
+            self._update('')
+            self._stopped.wait(self.reconnect_interval)
+
+    def _update(self, data: str):
+        states = {}
+        for line in data.splitlines():
+            if '\t' in line:
+                serial, state = line.split('\t', 1)
+                states[serial] = state
+        with self._lock:
+            previous, self._states = self._states, states
+        if data or self._conn is not None:
+            self._synced.set()
+        for serial in set(previous) | set(states):
+            was_online = previous.get(serial) == 'device'
+            is_online = states.get(serial) == 'device'
+            if was_online == is_online:
+                continue
+            logger.debug('%s: %s -> %s' % (serial, previous.get(serial), states.get(serial)))
+            for on_connect, on_disconnect in self._listeners:
+                callback = on_connect if is_online else on_disconnect
+                if callback is None:
+                    continue
+                try:
+                    callback(serial)
+                except Exception as e:
+                    logger.debug(e)
@@ -0,0 +1,222 @@
+import collections
+import functools
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Union
+
+from mdevice.device.kit.adbkit import ADBKit
+from mdevice.tools.log import LogUtils
+
+logger = LogUtils.LOGGER_DEBUG
+
+
+def android_kit(serial: str, proxy: str = None):
+    """默认的Android设备操作对象工厂"""
+    return ADBKit(sn=serial, device_proxy_ip=proxy, mnc=False)
+
+
+def ios_kit(serial: str, proxy: str = None):
+    """默认的iOS设备操作对象工厂"""
+    from mdevice.device.kit.ioskit import IDBKit
+    return IDBKit(sn=serial)
+
+
+class FleetResult(object):
+    """
+    单台设备的执行结果
+    """
+
+    def __init__(self, serial: str, proxy: str = None, value=None, error: Exception = None, started: float = 0,
+                 elapsed: float = 0):
+        """
+        :param serial: 设备序列号
+        :param proxy: 设备代理IP, 本机设备为None
+        :param value: 执行结果
+        :param error: 执行异常, 成功时为None
+        :param started: 开始执行的时间戳
+        :param elapsed: 执行耗时, 单位秒
+        """
+        self.serial = serial
+        self.proxy = proxy
+        self.value = value
+        self.error = error
+        self.started = started
+        self.elapsed = elapsed
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        if self.ok:
+            return 'FleetResult(%s, ok, %.2fs)' % (self.serial, self.elapsed)
+        return 'FleetResult(%s, error=%r, %.2fs)' % (self.serial, self.error, self.elapsed)
+
+
+class FleetSummary(object):
+    """
+    一次批量执行的汇总: 成功/失败设备及各设备耗时
+    """
+
+    def __init__(self, results: List[FleetResult], elapsed: float):
+        self.results = results
+        self.elapsed = elapsed
+
+    @property
+    def succeeded(self) -> List[FleetResult]:
+        return [result for result in self.results if result.ok]
+
+    @property
+    def failed(self) -> List[FleetResult]:
+        return [result for result in self.results if not result.ok]
+
+    @property
+    def values(self) -> Dict[str, object]:
+        return {result.serial: result.value for result in self.succeeded}
+
+    @property
+    def failures(self) -> Dict[str, Exception]:
+        return {result.serial: result.error for result in self.failed}
+
+    @property
+    def timings(self) -> Dict[str, float]:
+        return {result.serial: result.elapsed for result in self.results}
+
+    def __repr__(self):
+        return 'FleetSummary(total=%d, succeeded=%d, failed=%d, elapsed=%.2fs)' % (
+            len(self.results), len(self.succeeded), len(self.failed), self.elapsed)
+
+
+def _invoke(kit_factory, serial, proxy, func, args, kwargs) -> FleetResult:
+    """在工作线程/进程中创建设备操作对象并执行"""
+    started = time.time()
+    try:
+        kit = kit_factory(serial, proxy)
+        if isinstance(func, str):
+            value = getattr(kit, func)(*args, **kwargs)
+        else:
+            value = func(kit, *args, **kwargs)
+        return FleetResult(serial, proxy, value=value, started=started, elapsed=time.time() - started)
+    except Exception as e:
+        return FleetResult(serial, proxy, error=e, started=started, elapsed=time.time() - started)
+
+
+class Fleet(object):
+    """
+    多设备并发执行: 将同一操作分发到所有设备上, 按完成顺序流式返回结果, 单台设备失败不影响其它设备
+
+    并发控制: 整体并发数 max_workers, 本机连接的设备最多 per_host 台同时执行,
+    每个远程设备代理(device_proxy_ip)最多 per_proxy 台同时执行
+
+    usage:
+        fleet = Fleet.android()
+        summary = fleet.run('install_apk', apk_url)
+        for result in fleet.imap(lambda kit: kit.get_battery_level()):
+            print(result.serial, result.value)
+    """
+
+    def __init__(self, devices: Iterable[Union[str, tuple]], kit_factory: Callable = android_kit, max_workers=16,
+                 per_host=8, per_proxy=4, executor='thread'):
+        """
+        :param devices: 设备序列号列表, 远程代理设备可传 (serial, device_proxy_ip)
+        :param kit_factory: 设备操作对象工厂 factory(serial, proxy) -> ADBKit / IDBKit
+        :param max_workers: 线程池/进程池大小
+        :param per_host: 本机设备的并发上限
+        :param per_proxy: 每个远程代理的并发上限
+        :param executor: 'thread' 或 'process'(使用进程池时操作函数和工厂需可被pickle)
+        """
+        self.devices = [device if isinstance(device, tuple) else (device, None) for device in devices]
+        self.kit_factory = kit_factory
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.per_proxy = per_proxy
+        self.executor = executor
+
+    @classmethod
+    def android(cls, proxy_ips: Iterable[str] = (None,), **kwargs) -> "Fleet":
+        """
+        发现本机及各远程代理上已连接的Android设备
+        :param proxy_ips: 设备代理IP列表, None表示本机
+        """
+        devices = []
+        for proxy in proxy_ips:
+            kit = ADBKit(device_proxy_ip=proxy, mnc=False)
+            devices.extend((serial, proxy) for serial in kit.list_device())
+        return cls(devices, kit_factory=android_kit, **kwargs)
+
+    @classmethod
+    def ios(cls, **kwargs) -> "Fleet":
+        from mdevice.device.kit.ioskit import IDBKit
+        return cls(IDBKit.list_device(), kit_factory=ios_kit, **kwargs)
+
+    def _limit(self, proxy) -> int:
+        return self.per_host if proxy is None else self.per_proxy
+
+    def imap(self, func: Union[str, Callable], *args, timeout: float = None, **kwargs) -> Iterator[FleetResult]:
+        """
+        并发执行并按完成顺序返回结果
+        :param func: 设备操作对象的方法名, 或 func(kit, *args, **kwargs)
+        :param timeout: 整体超时时间, 超时后未完成的设备以 TimeoutError 返回
+        """
+        pending = collections.OrderedDict()
+        for serial, proxy in self.devices:
+            pending.setdefault(proxy, collections.deque()).append(serial)
+        running = {proxy: 0 for proxy in pending}
+        waiting = set(self.devices)
+        done = queue.Queue()
+        lock = threading.RLock()
+        pool_cls = ProcessPoolExecutor if self.executor == 'process' else ThreadPoolExecutor
+        pool = pool_cls(max_workers=self.max_workers)
+
+        def on_done(serial, proxy, future):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = FleetResult(serial, proxy, error=e)
+            done.put(result)
+            with lock:
+                running[proxy] -= 1
+                submit(proxy)
+
+        def submit(proxy):
+            # 只在该代理还有并发余量时提交, 避免工作线程阻塞在并发限制上
+            while pending[proxy] and running[proxy] < self._limit(proxy):
+                serial = pending[proxy].popleft()
+                running[proxy] += 1
+                future = pool.submit(_invoke, self.kit_factory, serial, proxy, func, args, kwargs)
+                future.add_done_callback(functools.partial(on_done, serial, proxy))
+
+        deadline = time.time() + timeout if timeout is not None else None
+        try:
+            with lock:
+                for proxy in pending:
+                    submit(proxy)
+            while waiting:
+                remaining = None if deadline is None else deadline - time.time()
+                try:
+                    if remaining is not None and remaining <= 0:
+                        raise queue.Empty
+                    result = done.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                waiting.discard((result.serial, result.proxy))
+                if not result.ok:
+                    logger.warning('%s: fleet task failed: %r' % (result.serial, result.error))
+                yield result
+            for serial, proxy in list(waiting):
+                yield FleetResult(serial, proxy, error=TimeoutError('fleet task timed out after %ss' % timeout))
+        finally:
+            with lock:
+                for queued in pending.values():
+                    queued.clear()
+            pool.shutdown(wait=False)
+
+    def run(self, func: Union[str, Callable], *args, timeout: float = None, **kwargs) -> FleetSummary:
+        """
+        并发执行并汇总结果
+        """
+        start = time.time()
+        results = list(self.imap(func, *args, timeout=timeout, **kwargs))
+        return FleetSummary(results, time.time() - start)
@@ -0,0 +1,209 @@
+import time
+from typing import Dict, List, Optional
+
+from mdevice.perf.android_jiffies import CpuTimes
+from mdevice.tools.utils import TimeUtils
+from mdevice.tools.log import LogUtils
+
+logger = LogUtils.LOGGER_DEBUG
+
+# 一次读取 /proc/stat 与每个核的当前/上限/硬件最高频率(单位kHz), 频率用 sh 内置 read 读取, 不为每个文件启动 cat;
+# 读取不到的频率输出占位符 -, 保证按位置解析时各列不错位
+CORES_SCRIPT = '''cat /proc/uptime /proc/stat
+for d in /sys/devices/system/cpu/cpu[0-9]*; do
+c=; m=; x=
+read c < $d/cpufreq/scaling_cur_freq
+read m < $d/cpufreq/scaling_max_freq
+read x < $d/cpufreq/cpuinfo_max_freq
+echo "freq ${d##*/cpu} ${c:--} ${m:--} ${x:--}"
+done 2>/dev/null
+true'''
+
+
+class CoreSample(object):
+    """
+    一次 CORES_SCRIPT 输出的解析结果
+    """
+
+    def __init__(self, output: str):
+        self.uptime = 0.0
+        self.times = {}  # type: Dict[int, CpuTimes]
+        # 核序号 -> (当前频率, 频率上限, 硬件最高频率), 单位kHz, 读取不到为None
+        self.freqs = {}  # type: Dict[int, tuple]
+        self._parse(output)
+
+    @staticmethod
+    def _int(value: str) -> Optional[int]:
+        return int(value) if value.isdigit() else None
+
+    def _parse(self, output: str):
+        lines = output.replace('\r', '').split('\n')
+        if lines and lines[0][:1].isdigit():
+            self.uptime = float(lines[0].split()[0])
+        for line in lines:
+            if line.startswith('cpu') and line[3:4].isdigit():
+                items = line.split()
+                self.times[int(items[0][3:])] = CpuTimes([int(item) for item in items[1:9]])
+            elif line.startswith('freq '):
+                # 按位置解析: 核序号 当前频率 频率上限 硬件最高频率, 缺失的列为占位符 -
+                items = (line.split() + ['-'] * 4)[1:5]
+                if items[0].isdigit():
+                    self.freqs[int(items[0])] = tuple(self._int(item) for item in items[1:])
+
+
+class CoreUsage(object):
+    """
+    单个核的占用与频率
+    """
+    __slots__ = ('index', 'online', 'usage', 'user', 'system', 'iow', 'freq', 'max_freq', 'hw_max_freq', 'cluster')
+
+    def __init__(self, index: int):
+        self.index = index
+        self.online = False
+        # 占用, 单核100%为满
+        self.usage = None  # type: Optional[float]
+        self.user = None  # type: Optional[float]
+        self.system = None  # type: Optional[float]
+        self.iow = None  # type: Optional[float]
+        # 频率, 单位MHz, 读取不到为None
+        self.freq = None  # type: Optional[float]
+        self.max_freq = None  # type: Optional[float]
+        self.hw_max_freq = None  # type: Optional[float]
+        # 按硬件最高频率从低到高编号的簇(big.LITTLE 中 0 为小核)
+        self.cluster = None  # type: Optional[int]
+
+    @property
+    def capped(self) -> bool:
+        """频率上限低于硬件最高频率(温控/省电限频)"""
+        return self.max_freq is not None and self.hw_max_freq is not None and self.max_freq < self.hw_max_freq
+
+    def __repr__(self):
+        return 'CoreUsage(cpu%d, usage=%r, freq=%r/%rMHz, cluster=%r)' % (
+            self.index, self.usage, self.freq, self.hw_max_freq, self.cluster)
+
+
+class CoreCpuinfo(object):
+    """
+    每个核的CPU占用(相邻两次采样之间)与当前频率
+    """
+
+    def __init__(self, cores: List[CoreUsage], interval: float):
+        """
+        :param cores: 各核数据, 按核序号排序
+        :param interval: 两次采样之间的设备时间间隔, 单位秒
+        """
+        self.cores = cores
+        self.interval = interval
+        self.datetime = TimeUtils.getCurrentTime()
+        # 采集时刻的设备开机时长, 以及按 DeviceClock 换算后的本机时间(采样器未指定 clock 时为None)
+        self.uptime = 0.0
+        self.capture_time = None  # type: Optional[float]
+
+    def metrics(self) -> Dict[str, float]:
+        """
+        :return: 指标名 -> 数值, 占用为%, 频率为MHz
+        """
+        metrics = {}
+        for core in self.cores:
+            prefix = 'cpu.core%d' % core.index
+            if core.usage is not None:
+                metrics[prefix + '.usage'] = core.usage
+            if core.freq is not None:
+                metrics[prefix + '.freq'] = core.freq
+            if core.max_freq is not None:
+                metrics[prefix + '.max_freq'] = core.max_freq
+        usages = [core.usage for core in self.cores if core.usage is not None]
+        if usages:
+            metrics['cpu.core.max_usage'] = max(usages)
+        metrics['cpu.core.online'] = float(sum(1 for core in self.cores if core.online))
+        return metrics
+
+    def __repr__(self):
+        return 'CoreCpuinfo(%s)' % ', '.join('cpu%d=%s%%@%sMHz' % (core.index, core.usage, core.freq)
+                                             for core in self.cores)
+
+
+class CoreCpuSampler(object):
+    """
+    每个核的CPU占用与频率采样: 一次shell调用读取 /proc/stat 中的 cpuN 行以及每个核的 scaling_cur_freq /
+    scaling_max_freq / cpuinfo_max_freq, 用相邻两次采样的jiffies差值计算各核占用; 可看出应用是否跑在小核、
+    大核是否被限频; 离线的核 online 为False
+
+    usage:
+        sampler = CoreCpuSampler(kit)
+        while True:
+            cores = sampler.sample()
+    """
+
+    def __init__(self, kit, warmup: float = 0.2, clock=None):
+        """
+        :param kit: ADBKit
+        :param warmup: 首次采样时两次读取之间的间隔, 单位秒
+        :param clock: DeviceClock, 指定时按设备开机时长换算采集时间(capture_time)
+        """
+        self.kit = kit
+        self.warmup = warmup
+        self.clock = clock
+        self._previous = None  # type: Optional[CoreSample]
+
+    def _read(self) -> Optional[CoreSample]:
+        out = self.kit.run_shell_script(CORES_SCRIPT, timeout=10)
+        if not out:
+            return None
+        sample = CoreSample(out)
+        if not sample.times:
+            logger.debug('per-core sample failed: %s' % out)
+            return None
+        return sample
+
+    def reset(self):
+        """丢弃上一次采样, 下次采样重新预热"""
+        self._previous = None
+
+    def sample(self) -> Optional[CoreCpuinfo]:
+        """
+        采样一次, 返回与上一次采样之间的各核占用; 首次采样间隔 warmup 秒读取两次, 读取失败返回None
+        """
+        current = self._read()
+        if current is None:
+            return None
+        previous = self._previous
+        if previous is None:
+            time.sleep(self.warmup)
+            previous, current = current, self._read()
+            if current is None:
+                return None
+        self._previous = current
+        cpuinfo = self._compute(previous, current)
+        cpuinfo.uptime = current.uptime
+        if self.clock is not None and current.uptime:
+            cpuinfo.capture_time = self.clock.uptime_to_host(current.uptime)
+        return cpuinfo
+
+    @staticmethod
+    def _compute(previous: CoreSample, current: CoreSample) -> CoreCpuinfo:
+        indexes = sorted(set(current.freqs) | set(current.times))
+        hw_max = sorted({freqs[2] for freqs in current.freqs.values() if freqs[2]})
+        cores = []
+        for index in indexes:
+            core = CoreUsage(index)
+            now = current.times.get(index)
+            old = previous.times.get(index)
+            core.online = now is not None
+            if now is not None and old is not None:
+                total = now.total - old.total
+                if total > 0:
+                    core.user = round(max(now.user + now.nice - old.user - old.nice, 0) * 100.0 / total, 2)
+                    core.system = round(max(now.system - old.system, 0) * 100.0 / total, 2)
+                    core.iow = round(max(now.iowait - old.iowait, 0) * 100.0 / total, 2)
+                    idle = max(now.idle + now.iowait - old.idle - old.iowait, 0)
+                    core.usage = round(max(total - idle, 0) * 100.0 / total, 2)
+            freqs = current.freqs.get(index)
+            if freqs is not None:
+                cur, limit, maximum = freqs
+                core.freq = cur / 1000.0 if cur is not None and core.online else None
+                core.max_freq = limit / 1000.0 if limit is not None else None
+                core.hw_max_freq = maximum / 1000.0 if maximum is not None else None
+                core.cluster = hw_max.index(maximum) if maximum in hw_max else None
+            cores.append(core)
+        return CoreCpuinfo(cores, current.uptime - previous.uptime)
@@ -1,4 +1,5 @@
 import re
+from typing import Dict, List, Optional
 
 from mdevice.tools.utils import TimeUtils
 from mdevice.tools.log import LogUtils
@@ -6,12 +7,69 @@ from mdevice.tools.log import LogUtils
 logger = LogUtils.LOGGER_DEBUG
 
 
+class TopLayout(object):
+    """
+    top 输出的列布局, 按表头行缓存, 同一种输出格式只解析一次表头
+    """
+    _layouts = {}  # type: Dict[str, TopLayout]
+
+    def __init__(self, header: str):
+        # 8.0及以上表头为 S[%CPU], 按 [% 切分后 CPU% 列为 CPU], 与数据行 split() 后的下标一致
+        columns = self.columns = re.split(r"\[%|\s+", header.strip())
+        self.cpu_index = self._index(columns, ["CPU]", "CPU%"], 2)
+        self.uid_index = self._index(columns, ["UID", "USER"], 8)
+        self.pcy_index = self._index(columns, ["PCY"], -1)
+        self.name_index = self._index(columns, ["ARGS"], -1)
+        self.vss_index = self._index(columns, ["VSS"], -1)
+        self.rss_index = self._index(columns, ["RSS"], -1)
+        # 老版本 top 的 PCY 列可能为空, UID 列位于 PCY 之后时从行尾倒数定位
+        self.uid_from_end = self.uid_index - len(columns) if 0 <= self.pcy_index < self.uid_index else None
+
+    @staticmethod
+    def _index(columns: List[str], names: List[str], default: int) -> int:
+        for name in names:
+            if name in columns:
+                return columns.index(name)
+        return default
+
+    def index(self, names: List[str], default: Optional[int]) -> Optional[int]:
+        """按列名(可能有多种写法)返回列标, 都不存在时返回 default"""
+        return self._index(self.columns, names, default)
+
+    @classmethod
+    def get(cls, header: str) -> "TopLayout":
+        layout = cls._layouts.get(header)
+        if layout is None:
+            layout = cls._layouts[header] = TopLayout(header)
+        return layout
+
+    @property
+    def uid_column(self) -> int:
+        """数据行中uid的下标(可能为负数)"""
+        return self.uid_from_end if self.uid_from_end is not None else self.uid_index
+
+    def uid(self, row: List[str]) -> str:
+        index = self.uid_column
+        return row[index] if -len(row) <= index < len(row) else ''
+
+    def cpu(self, row: List[str]) -> Optional[float]:
+        if len(row) <= self.cpu_index:
+            return None
+        try:
+            # CPU% 9% 有的格式会有%
+            return float(row[self.cpu_index].replace("%", ""))
+        except ValueError:
+            return None
+
+
 class PckCpuinfo(object):
     """
     存储某个包cpu的相关信息，计划存储的信息有：包名，pid，uid，给定包的jiffies(从开机开始算)来自/proc/pid/stats
     该进程的cpu占有率，现在可以通过top获取还是自己通过前后的jiffies计算，
     初步确定使用top 直接进行统计.
     注意top中的数值基本上是瞬时值，采样的数据也是来自于 /proc/pid/stat(具体进程的cpu%)
+
+    解析只遍历一次top输出, 表头布局按格式缓存; 结果对象不保留原始top输出
     """
     #  1:cpu   2:user   3:nice  4:sys  5:idle     6:iow  7:irq    8:sirq   9:host
     # 400%cpu  56%user   1%nice  46%sys 285%idle   0%iow  10%irq   2%sirq   0%host
@@ -23,20 +81,19 @@ class PckCpuinfo(object):
 
     def __init__(self, packages, source, sdkversion):
         '''
-        :param packages: 应用的包名
+        :param packages: 应用的包名, 单个包名或包名列表
         :param source: 数据源，来自于adb shell top.
         '''
-        self.source = source
         self.sdkversion = sdkversion
         self.datetime = ''
-        self.packages = packages
+        self.packages = [packages] if isinstance(packages, str) else list(packages or [])
         self.pid = 0
         self.uid = ''
         self.pck_cpu_rate = ''
         self.pck_pyc = ''
         self.uid_cpu_rate = ''
         # 同一个应用有时候有多个进程,每个进程都会出现cpu占比较大的情况，为了统计准确，针对多进程的情况，同一条top命令最好返回多条记录，以便查看详情
-        # 顺序是；[datetime, packagename, pid, uid, pid cpu, uid cpu, pcy,uid cpu]
+        # 每个包一条记录: {"package", "pid", "pid_cpu", "uid"}
         self.package_list = []
 
         self.device_cpu_rate = ''  # 整机的cpu使用率
@@ -47,76 +104,78 @@ class PckCpuinfo(object):
         self.iow_rate = ''
         self.irq_rate = ''
         self.total_pid_cpu = 0
-        self._parse_cpu_usage()
-        self._parse_package()
-        # self.sum_procs_cpurate()
+        self.layout = None  # type: Optional[TopLayout]
+        # uid -> 该uid下所有进程的cpu%之和
+        self._uid_cpu = {}  # type: Dict[str, float]
+        source = source or ''
+        self._parse_cpu_usage(source)
+        self._parse_package(source)
 
-    def _parse_package(self):
+    def _parse_package(self, source: str):
         """
-        解析top命令中的包的cpu信息
-        :return:
+        一次遍历top输出: 找到表头确定列布局, 记录目标包名对应的行(同名进程取第一行)并累计各uid的cpu%
         """
-        if self.packages is None or self.packages == "":
+        if not self.packages:
             logger.error("no process name input, please input")
 
+        targets = set(self.packages)
+        rows = {}
+        lines = source.split('\n')
+        start = next((i for i, line in enumerate(lines) if 'PID' in line and 'CPU' in line), None)
+        if start is not None:
+            layout = self.layout = TopLayout.get(lines[start].strip())
+            cpu_index = layout.cpu_index
+            uid_index = layout.uid_column
+            uid_cpu = self._uid_cpu
+            for line in lines[start + 1:]:
+                row = line.split()
+                if not row:
+                    continue
+                try:
+                    uid = row[uid_index]
+                    uid_cpu[uid] = uid_cpu.get(uid, 0) + float(row[cpu_index].replace("%", ""))
+                except (IndexError, ValueError):
+                    pass
+                name = row[-1]  # 最后一个值是包名
+                if name in targets and name not in rows:
+                    rows[name] = row
+
         for package in self.packages:
             package_dic = {"package": package,
                            "pid": "",
                            "pid_cpu": ""}
-            sp_lines = self.source.split('\n')
-            for line in sp_lines:
-                # logger.debug(line)
-                if package in line:  # 解析进程cpu信息
-                    tmp = line.split()
-                    self.pid = tmp[0]
-                    target_pck = tmp[-1]  # 从中解析出的最后一个值是包名
-                    self.datetime = TimeUtils.getCurrentTime()
-                    logger.debug(
-                        "cpuinfos, _parse top target_pck is : " + str(target_pck) + " , self.pacakgename : " + package)
-                    if package == target_pck:  # 只统计包名完全相同的进程
-                        if int(self.pid) > 0:
-                            logger.debug(
-                                "cpuinfos, into _parse_pck packege is target package, pid is :" + str(self.pid))
-                            # logger.debug("into _parse_pck packege is target package, pid is :" + str(self.pid))
-                            cpu_index = self.get_cpucol_index()
-                            uid_index = self.get_uidcol_index()
-                            if (len(tmp) > cpu_index):
-                                self.pck_cpu_rate = tmp[cpu_index]
-                                # CPU% 9% 有的格式会有%
-                                self.pck_cpu_rate = self.pck_cpu_rate.replace("%", "")
-                            if (len(tmp) > uid_index):
-                                self.uid = tmp[uid_index]
-                            package_dic = {"package": package,
-                                           "pid": self.pid,
-                                           "pid_cpu": str(self.pck_cpu_rate),
-                                           "uid": self.uid}
-                            # self.package_list.append(package_dic)
-                            # 将top中解析出来的信息保存在一个列表中，作为一条记录添加在package_list中
-                            logger.debug("package: " + package + ", cpu_rate: " + str(self.pck_cpu_rate))
-                            self.total_pid_cpu = self.total_pid_cpu + float(self.pck_cpu_rate)
-                        break
+            row = rows.get(package)
+            if row is not None and row[0].isdigit() and int(row[0]) > 0:
+                self.pid = row[0]
+                self.datetime = TimeUtils.getCurrentTime()
+                cpu = self.layout.cpu(row)
+                if cpu is not None:
+                    self.pck_cpu_rate = row[self.layout.cpu_index].replace("%", "")
+                    self.total_pid_cpu = self.total_pid_cpu + cpu
+                self.uid = self.layout.uid(row) or self.uid
+                package_dic = {"package": package,
+                               "pid": self.pid,
+                               "pid_cpu": str(self.pck_cpu_rate),
+                               "uid": self.uid}
             self.package_list.append(package_dic)
-            logger.debug(package_dic)
+        logger.debug("cpuinfos: %s" % self.package_list)
 
-    def _parse_cpu_usage(self):
+    def _parse_cpu_usage(self, source: str):
         """
         从top中解析出cpu的信息
         :return:
         """
         if self.sdkversion < 26:  # android 8.0之前的版本
-            match = self.RE_CPU.search(self.source)
+            match = self.RE_CPU.search(source)
             if (match):
                 self.user_rate = match.group(1)
                 self.system_rate = match.group(2)
                 self.iow_rate = match.group(3)
                 self.irq_rate = match.group(4)
                 self.device_cpu_rate = int(self.user_rate) + int(self.system_rate)
-                logger.debug("  cpuinfos,device system_rate: %s" % self.system_rate)
-                logger.debug("  cpuinfos, device user_rate: %s" % self.user_rate)
-                logger.debug("  cpuinfos, device device_cpu_rate: %s" % self.device_cpu_rate)
         else:  # 8.0及其以上的版本 turandot 27
             #  1:cpu   2:user   3:nice  4:sys  5:idle     6:iow  7:irq    8:sirq   9:host
-            match = self.RE_CPU_O.search(self.source)
+            match = self.RE_CPU_O.search(source)
             if (match):
                 self.user_rate = match.group(2)
                 self.nice_rate = match.group(3)
@@ -125,9 +184,8 @@ class PckCpuinfo(object):
                 self.iow_rate = match.group(6)
                 self.irq_rate = match.group(7)
                 self.device_cpu_rate = int(self.user_rate) + int(self.system_rate)
-                logger.debug("8.0 or higher, user_rate: " + str(self.user_rate) + ", sys: " + str(
-                    self.system_rate) + ",device cpu: " + str(self.device_cpu_rate))
-                logger.debug("idle_rate: %s" % self.idle_rate)
+        logger.debug("cpuinfos, user_rate: %s, sys: %s, device cpu: %s, idle_rate: %s" % (
+            self.user_rate, self.system_rate, self.device_cpu_rate, self.idle_rate))
 
     def sum_procs_cpurate(self):
         """
@@ -135,86 +193,88 @@ class PckCpuinfo(object):
         累加属于同一个UID的所有进程的cpu使用率
         :return: 所有这些进程cpu%的和
         """
-        summ = 0
-        if self.source:
-            sp_lines = self.source.split("\n")
-            for line in sp_lines:
-                if self.uid != "" and self.uid in line:  # 先过滤出有相同uid的行
-                    tmp = line.split()
-                    cpu_index = self.get_cpucol_index()
-                    print(tmp)
-                    print(cpu_index)
-                    summ = summ + int(tmp[cpu_index].replace("%", ""))
-            self.uid_cpu_rate = str(summ) + "%"
-            print(self.uid_cpu_rate)
-            for i in range(len(self.package_list)):
-                self.package_list[i].append(self.uid_cpu_rate)
-                logger.debug("cpuinfos, sum_procs_cpurate , afer append uid cpu rate, the package list is : " + str(
-                    self.package_list))
+        summ = self._uid_cpu.get(self.uid, 0) if self.uid != "" else 0
+        self.uid_cpu_rate = str(summ) + "%"
+        for package_dic in self.package_list:
+            package_dic["uid_cpu"] = self.uid_cpu_rate
+        return summ
+
+    @property
+    def app_cpu_rate(self) -> Optional[float]:
+        """应用进程占整机CPU的百分比, 与 ADBKit.get_app_cpu / JiffiesCpuinfo.app_cpu_rate 的计算方式一致"""
+        if self.idle_rate == '' or self.device_cpu_rate == '':
+            return None
+        total = float(self.idle_rate) + float(self.device_cpu_rate)
+        return float(self.total_pid_cpu) / total * 100 if total else 0.0
+
+    def metrics(self) -> Dict[str, float]:
+        """
+        字符串字段转换为数值, 解析不到的指标不输出; cpu.app 与 JiffiesCpuinfo 相同, 为占整机CPU的百分比,
+        cpu.app_uid 为应用uid下所有进程的 top cpu% 之和(单核100%, 可超过100)
+        :return: 指标名 -> 数值(%)
+        """
+        metrics = {}
+        for name, value in (('cpu.device', self.device_cpu_rate), ('cpu.user', self.user_rate),
+                            ('cpu.system', self.system_rate), ('cpu.idle', self.idle_rate),
+                            ('cpu.iow', self.iow_rate), ('cpu.irq', self.irq_rate)):
+            if value != '':
+                metrics[name] = float(value)
+        for package_dic in self.package_list:
+            if package_dic["pid_cpu"] != "":
+                metrics['cpu.pid.%s' % package_dic["package"]] = float(package_dic["pid_cpu"])
+        if self.package_list and any(package_dic["pid"] for package_dic in self.package_list):
+            metrics['cpu.app_total'] = float(self.total_pid_cpu)
+            if self.app_cpu_rate is not None:
+                metrics['cpu.app'] = self.app_cpu_rate
+        if self.uid:
+            metrics['cpu.app_uid'] = float(self._uid_cpu.get(self.uid, 0))
+        return metrics
 
     def get_cpucol_index(self):
         """
         实际测试中发现不同的机型top命令中的cpu使用率不一定在第三列，所以需要获取到这个值在第几列。
         :return: cpu%所在的列标
         """
-
-        return self.get_col_index(self.source, ["CPU]", "CPU%"], 2)
+        return self.layout.cpu_index if self.layout else 2
 
     def get_pcycol_index(self):
         """
         :return: top中pyc的列标
         """
-        return self.get_col_index(self.source, ["PCY"], -1)
+        return self.layout.pcy_index if self.layout else -1
 
     def get_packagenamecol_index(self):
         """
         :return: top中的packagename的列标
         """
-        return self.get_col_index(self.source, ["ARGS"], -1)
+        return self.layout.name_index if self.layout else -1
 
     def get_vsscol_index(self):
-        return self.get_col_index(self.source, ["VSS"], -1)
+        return self.layout.vss_index if self.layout else -1
 
     def get_rss_col_index(self):
-        return self.get_col_index(self.source, ["RSS"], -1)
+        return self.layout.rss_index if self.layout else -1
 
     def get_uidcol_index(self):
         """
         由于uid的列名在不同机器上会有差别，这里单独区分
         :return: adb shell top中uid列的列标
         """
-        if self.source:
-            sp_lines = self.source.split("\n")
-            for line in sp_lines:
-                if 'UID' in line:
-                    line_sp = line.split()
-                    for key, item in enumerate(line_sp):
-                        if item == "UID":
-                            return key
-                elif 'USER' in line:
-                    line_sp = line.split()
-                    for key, item in enumerate(line_sp):
-                        if item == "USER":
-                            return key
-        return 8
+        return self.layout.uid_index if self.layout else 8
 
     def get_col_index(self, s, col_name_list, default):
         """
         返回top中列标的通用的方法
         :param s: 一条top命令的值
-        :param col_name: 列名列表 可能会有不同格式
+        :param col_name_list: 列名列表 可能会有不同格式
         :param default:默认返回的列标
         :return:
         """
-        s = s.split("\n")
-        if s:
-            for line in s:
-                line = line.strip()
-                for col_name in col_name_list:
-                    if col_name in line:
-                        line_sp = re.split(r"\[%|\s+", line)
-                        for key, item in enumerate(line_sp):
-                            if item == col_name:
-                                logger.debug('=========== item == col_name: ' + col_name + " index : " + str(key))
-                                return key
+        for line in (s or '').split('\n'):
+            line = line.strip()
+            if any(col_name in line for col_name in col_name_list):
+                # 只用于查找列标, 不放入表头缓存
+                index = TopLayout(line).index(col_name_list, None)
+                if index is not None:
+                    return index
         return default
@@ -0,0 +1,372 @@
+import collections
+import math
+import re
+import shlex
+import time
+from typing import Deque, Dict, List, Optional, Tuple
+
+from mdevice.tools.utils import TimeUtils
+from mdevice.tools.log import LogUtils
+
+logger = LogUtils.LOGGER_DEBUG
+
+PROFILE_MARKER = '---PROFILEDATA---'
+# SurfaceFlinger 中尚未完成的帧时间戳为 INT64_MAX
+PENDING_FENCE = (1 << 63) - 1
+DEFAULT_REFRESH_PERIOD = 1000.0 / 60
+# Jank: 帧耗时 > 前三帧平均耗时的2倍 且 > 两帧电影帧耗时(1000/24*2 ms); BigJank: 且 > 三帧电影帧耗时
+MOVIE_FRAME = 1000.0 / 24
+JANK_THRESHOLD = MOVIE_FRAME * 2
+BIG_JANK_THRESHOLD = MOVIE_FRAME * 3
+PERCENTILES = (50, 90, 95, 99)
+# dumpsys gfxinfo 头部的 SystemClock.uptimeMillis(), 与 IntendedVsync 同为 CLOCK_MONOTONIC
+RE_UPTIME = re.compile(r'^Uptime: (\d+)', re.M)
+RE_WINDOW = re.compile(r'^\s*(?:Window: )?(\S+?/[^/\s]+)(?:/android\.view\.ViewRootImpl@\w+)?(?: \(visibility=\d+\))?\s*$')
+
+
+def percentile(ordered: List[float], p: float) -> float:
+    """线性插值百分位数, ordered 需已排序"""
+    rank = (len(ordered) - 1) * p / 100.0
+    low = int(math.floor(rank))
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+class FrameStats(object):
+    """
+    一个窗口(或 SurfaceFlinger 图层)在一次轮询区间内的帧统计
+    """
+
+    def __init__(self, window: str, source: str, frame_times: List[float], interval: float,
+                 refresh_period: float, history: List[float] = (), overflow: bool = False):
+        """
+        :param window: 窗口名(gfxinfo)或图层名(SurfaceFlinger)
+        :param source: gfxinfo / surfaceflinger
+        :param frame_times: 新增各帧的耗时, 单位ms; gfxinfo 为 IntendedVsync -> FrameCompleted,
+                            SurfaceFlinger 为相邻两帧上屏的间隔
+        :param interval: 轮询区间(设备时间), 单位秒; overflow 时为读到的帧覆盖的时间
+        :param refresh_period: 屏幕刷新周期, 单位ms
+        :param history: 区间之前的最后几帧耗时, 用于判断区间开头的帧是否卡顿
+        :param overflow: 轮询间隔超过设备端帧缓冲(framestats 约120帧 / SurfaceFlinger 128帧), 有帧未读到,
+                         frames 偏小, fps 按读到的帧估算
+        """
+        self.window = window
+        self.source = source
+        self.frame_times = frame_times
+        self.interval = interval
+        self.refresh_period = refresh_period
+        self.overflow = overflow
+        self.datetime = TimeUtils.getCurrentTime()
+        self.jank, self.big_jank = self._count_jank(list(history), frame_times)
+
+    @staticmethod
+    def _count_jank(history: List[float], frame_times: List[float]) -> Tuple[int, int]:
+        jank = big_jank = 0
+        recent = collections.deque(history[-3:], maxlen=3)
+        for frame_time in frame_times:
+            if len(recent) == 3 and frame_time > sum(recent) / 3 * 2:
+                if frame_time > BIG_JANK_THRESHOLD:
+                    big_jank += 1
+                elif frame_time > JANK_THRESHOLD:
+                    jank += 1
+            recent.append(frame_time)
+        return jank, big_jank
+
+    @property
+    def frames(self) -> int:
+        return len(self.frame_times)
+
+    @property
+    def fps(self) -> float:
+        return round(self.frames / self.interval, 2) if self.interval > 0 else 0.0
+
+    @property
+    def slow_frames(self) -> int:
+        """超过一个刷新周期的帧(错过vsync)"""
+        return sum(1 for frame_time in self.frame_times if frame_time > self.refresh_period)
+
+    def percentiles(self, percentiles=PERCENTILES) -> Dict[str, float]:
+        if not self.frame_times:
+            return {}
+        ordered = sorted(self.frame_times)
+        return {'p%d' % p: round(percentile(ordered, p), 2) for p in percentiles}
+
+    def metrics(self, prefix: str = 'gfx') -> Dict[str, float]:
+        """
+        :return: 指标名 -> 数值, 帧耗时单位ms
+        """
+        metrics = {'%s.fps' % prefix: self.fps, '%s.jank' % prefix: float(self.jank),
+                   '%s.big_jank' % prefix: float(self.big_jank), '%s.slow_frames' % prefix: float(self.slow_frames),
+                   '%s.overflow' % prefix: 1.0 if self.overflow else 0.0}
+        for name, value in self.percentiles().items():
+            metrics['%s.frame_time.%s' % (prefix, name)] = value
+        if self.frame_times:
+            metrics['%s.frame_time.max' % prefix] = round(max(self.frame_times), 2)
+        return metrics
+
+    def __repr__(self):
+        return 'FrameStats(%s, %s, fps=%.2f, frames=%d, jank=%d, big_jank=%d%s)' % (
+            self.window, self.source, self.fps, self.frames, self.jank, self.big_jank,
+            ', overflow' if self.overflow else '')
+
+
+class GfxSample(object):
+    """
+    一次轮询的帧统计, 每个窗口/图层一个 FrameStats; metrics() 输出帧数最多的窗口(前台界面)
+    """
+
+    def __init__(self, package: str, windows: Dict[str, FrameStats]):
+        self.package = package
+        self.windows = windows
+        self.datetime = TimeUtils.getCurrentTime()
+        # 采集时刻的设备开机时长, 以及按 DeviceClock 换算后的本机时间(采集器未指定 clock 时为None)
+        self.uptime = 0.0
+        self.capture_time = None  # type: Optional[float]
+
+    @property
+    def primary(self) -> Optional[FrameStats]:
+        if not self.windows:
+            return None
+        # surfaceflinger 图层(SurfaceView / 游戏)有帧时优先
+        return max(self.windows.values(), key=lambda stats: (stats.frames, stats.source == 'surfaceflinger'))
+
+    def metrics(self) -> Dict[str, float]:
+        primary = self.primary
+        return primary.metrics() if primary is not None else {}
+
+    def __repr__(self):
+        return 'GfxSample(%s, %r)' % (self.package, list(self.windows.values()))
+
+
+class _WindowState(object):
+    """单个窗口/图层的增量解析状态"""
+    __slots__ = ('last', 'history', 'overflow', 'span')
+
+    def __init__(self):
+        # 已解析的最后一帧的时间戳(ns)
+        self.last = 0
+        # 本次解析是否发生缓冲溢出: 最早的一帧仍比 last 新, 两次轮询之间有帧已被设备端覆盖
+        self.overflow = False
+        # 溢出时读到的新帧覆盖的设备时间, 单位秒, 用于估算FPS
+        self.span = 0.0
+        # 最后三帧的耗时, 用于跨轮询判断卡顿
+        self.history = collections.deque(maxlen=3)  # type: Deque[float]
+
+
+def _check_overflow(name: str, state: _WindowState, oldest: Optional[int]):
+    """反向扫描到缓冲开头仍未遇到已解析的帧: 两次轮询之间的帧超过了设备端缓冲, 中间的帧已丢失"""
+    state.overflow = bool(state.last) and oldest is not None and oldest > state.last
+    if state.overflow:
+        logger.warning('%s: frame buffer overflowed, %.0fms of frames were not read, poll more often'
+                       % (name, (oldest - state.last) / 1e6))
+
+
+def parse_framestats(output: str, states: Dict[str, _WindowState]) -> Dict[str, List[float]]:
+    """
+    增量解析 dumpsys gfxinfo <package> framestats: 每个 PROFILEDATA 块从最后一行向前扫描,
+    遇到 IntendedVsync 不大于上次已解析时间戳的行即停止, 只解析新帧
+    :param output: dumpsys 输出
+    :param states: 窗口名 -> 解析状态, 会被更新
+    :return: 窗口名 -> 新帧耗时(ms, 按时间顺序)
+    """
+    result = {}
+    lines = output.replace('\r', '').split('\n')
+    window = 'default'
+    index = 0
+    count = len(lines)
+    while index < count:
+        line = lines[index]
+        if line.strip() != PROFILE_MARKER:
+            match = RE_WINDOW.match(line)
+            if match:
+                window = match.group(1)
+            index += 1
+            continue
+        end = index + 1
+        while end < count and lines[end].strip() != PROFILE_MARKER:
+            end += 1
+        block = lines[index + 1:end]
+        index = end + 1
+        if not block or not block[0].startswith('Flags'):
+            continue
+        header = block[0].split(',')
+        try:
+            vsync_col = header.index('IntendedVsync')
+            done_col = header.index('FrameCompleted')
+        except ValueError:
+            continue
+        state = states.setdefault(window, _WindowState())
+        frames = []
+        newest = state.last
+        oldest = None
+        state.overflow = False
+        for row in reversed(block[1:]):
+            items = row.split(',')
+            if len(items) <= done_col or not items[vsync_col].isdigit():
+                continue
+            vsync = int(items[vsync_col])
+            if vsync <= state.last:
+                break
+            newest = max(newest, vsync)
+            oldest = vsync
+            # Flags 非0为非正常帧(如窗口大小变化后的首帧), 不计入
+            if items[0] != '0' or not items[done_col].isdigit():
+                continue
+            frames.append((int(items[done_col]) - vsync) / 1e6)
+        else:
+            _check_overflow(window, state, oldest)
+        frames.reverse()
+        state.span = (newest - oldest) / 1e9 if state.overflow else 0.0
+        if not state.last:
+            # 首次出现的窗口, 已有的帧只作为基线(用于判断之后的卡顿), 不计入本次区间
+            state.history.extend(frames)
+            frames = []
+        state.last = newest
+        result.setdefault(window, []).extend(frames)
+    return result
+
+
+def parse_latency(layer: str, output: str, state: _WindowState) -> Tuple[Optional[float], List[float]]:
+    """
+    增量解析 dumpsys SurfaceFlinger --latency <图层>: 第一行为刷新周期(ns), 之后每行为
+    desiredPresent actualPresent frameReady(ns), 从最后一行向前扫描到已解析的上屏时间为止
+    :return: (刷新周期ms, 新帧的上屏间隔ms)
+    """
+    lines = [line.split() for line in output.replace('\r', '').split('\n') if line.strip()]
+    if not lines or not lines[0][0].isdigit():
+        return None, []
+    period = int(lines[0][0]) / 1e6 or None
+    presents = []
+    state.overflow = False
+    for items in reversed(lines[1:]):
+        if len(items) < 3 or not items[1].isdigit():
+            continue
+        present = int(items[1])
+        if present == 0 or present == PENDING_FENCE:
+            continue
+        if present <= state.last:
+            break
+        presents.append(present)
+    else:
+        _check_overflow(layer, state, presents[-1] if presents else None)
+    presents.reverse()
+    if not presents:
+        return period, []
+    # 首次解析或溢出时, 与上一次最后一帧之间的间隔不是一帧的耗时, 第一帧只作为起点
+    state.span = (presents[-1] - presents[0]) / 1e9 if state.overflow else 0.0
+    fresh = not state.last
+    skip_first = fresh or state.overflow
+    previous = presents[0] if skip_first else state.last
+    state.last = presents[-1]
+    intervals = []
+    for present in presents[1:] if skip_first else presents:
+        intervals.append((present - previous) / 1e6)
+        previous = present
+    if fresh:
+        # 首次解析的图层, 已有的帧只作为基线, 不计入本次区间
+        state.history.extend(intervals)
+        return period, []
+    return period, intervals
+
+
+class FrameTimingCollector(object):
+    """
+    帧率/卡顿采集: 轮询 dumpsys gfxinfo <package> framestats(普通View界面), 可同时轮询
+    SurfaceFlinger --latency <图层>(SurfaceView / 游戏界面), 与 gfxinfo 在一次shell往返中执行;
+    每个窗口/图层记录已解析的最后一帧时间戳, 只解析更新的帧, 输出 FPS、Jank / BigJank 次数、
+    超过刷新周期的帧数以及帧耗时百分位数; 首次轮询只建立基线, 返回None
+    FPS 的区间取 gfxinfo 头部的设备 Uptime 之差, 不受adb往返抖动影响; 设备端只保留最近约120帧,
+    轮询间隔需小于缓冲时长(60Hz约2秒, 120Hz约1秒), 否则该窗口标记 overflow
+
+    usage:
+        collector = FrameTimingCollector(kit, 'com.example', surface_flinger=True)
+        while True:
+            gfx = collector.sample()
+            time.sleep(1)
+    """
+
+    def __init__(self, kit, package: str, surface_flinger: bool = False, refresh_period: float = None,
+                 layer_refresh_interval: float = 10.0, clock=None):
+        """
+        :param kit: ADBKit
+        :param package: 应用包名
+        :param surface_flinger: 是否同时采集 SurfaceFlinger 图层(游戏 / SurfaceView)
+        :param refresh_period: 屏幕刷新周期, 单位ms, 默认从 SurfaceFlinger 读取, 读取不到时为60Hz
+        :param layer_refresh_interval: 重新查找应用图层的间隔, 单位秒
+        :param clock: DeviceClock, 指定时按设备开机时长换算采集时间(capture_time)
+        """
+        self.kit = kit
+        self.clock = clock
+        self.package = package
+        self.surface_flinger = surface_flinger
+        self.refresh_period = refresh_period
+        self.layer_refresh_interval = layer_refresh_interval
+        self._windows = {}  # type: Dict[str, _WindowState]
+        self._layers = {}  # type: Dict[str, _WindowState]
+        self._layers_at = 0.0
+        # 上一次轮询时的设备 uptime, 单位秒
+        self._polled_at = None  # type: Optional[float]
+
+    def _refresh_layers(self):
+        out = self.kit.run_shell_cmd('dumpsys SurfaceFlinger --list') or ''
+        names = [line.strip() for line in out.replace('\r', '').split('\n')
+                 if self.package in line and 'SurfaceView' in line and 'Background' not in line]
+        self._layers = {name: self._layers.get(name) or _WindowState() for name in names}
+        self._layers_at = time.time()
+
+    def sample(self) -> Optional[GfxSample]:
+        """
+        轮询一次, 返回与上一次轮询之间新增帧的统计; 首次轮询、应用未运行或命令执行失败返回None
+        """
+        # 没有 SurfaceView 图层的普通应用同样按间隔查找, 不为每次轮询多一次往返
+        if self.surface_flinger and time.time() - self._layers_at > self.layer_refresh_interval:
+            self._refresh_layers()
+        layers = list(self._layers)
+        # gfxinfo 头部的 Uptime 不含深度睡眠时间, 采集时间另外读取 /proc/uptime
+        cmds = ['dumpsys gfxinfo %s framestats' % self.package, 'cat /proc/uptime'] + [
+            'dumpsys SurfaceFlinger --latency %s' % shlex.quote(layer) for layer in layers]
+        results = self.kit.run_shell_batch(cmds, timeout=30)
+        if results[0].exit_code is None:
+            return None
+        match = RE_UPTIME.search(results[0].output)
+        if match is None:
+            # 应用未运行时输出 No process found, 没有头部
+            return None
+        now = int(match.group(1)) / 1000.0
+        baseline = self._polled_at is None
+        interval = now - self._polled_at if not baseline else 0.0
+        self._polled_at = now
+
+        refresh_period = self.refresh_period
+        layer_frames = {}
+        for layer, result in zip(layers, results[2:]):
+            period, intervals = parse_latency(layer, result.output, self._layers[layer])
+            refresh_period = refresh_period or period
+            layer_frames[layer] = intervals
+        window_frames = parse_framestats(results[0].output, self._windows)
+        # 不再出现的窗口丢弃状态, 长时间运行不累积
+        for window in [window for window in self._windows if window not in window_frames]:
+            del self._windows[window]
+        if baseline:
+            return None
+
+        refresh_period = refresh_period or DEFAULT_REFRESH_PERIOD
+        windows = {}
+        for source, frames, states in (('gfxinfo', window_frames, self._windows),
+                                       ('surfaceflinger', layer_frames, self._layers)):
+            for name, frame_times in frames.items():
+                state = states[name]
+                span = interval
+                if state.overflow:
+                    # 丢失的帧无法计数, FPS 改用读到的帧覆盖的时间估算; gfxinfo 的每一帧各占一个刷新周期
+                    span = state.span + (refresh_period / 1000 if source == 'gfxinfo' else 0)
+                windows[name] = FrameStats(name, source, frame_times, span, refresh_period, list(state.history),
+                                           state.overflow)
+                state.history.extend(frame_times)
+        sample = GfxSample(self.package, windows)
+        uptime = results[1].output.split()
+        if results[1].ok and uptime:
+            sample.uptime = float(uptime[0])
+            if self.clock is not None:
+                sample.capture_time = self.clock.uptime_to_host(sample.uptime)
+        return sample
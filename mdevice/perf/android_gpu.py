@@ -0,0 +1,194 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+from mdevice.tools.utils import TimeUtils
+from mdevice.tools.log import LogUtils
+
+logger = LogUtils.LOGGER_DEBUG
+
+# 候选节点: 指标 -> [(路径, 格式)], 按优先级排列, 每个指标使用第一个可读的节点
+# 格式: percent 占用百分比 / ratio "busy total" 周期数 / hz / khz / mhz / auto 按数值大小判断频率单位
+GPU_NODES = {
+    'load': [
+        ('/sys/class/kgsl/kgsl-3d0/gpu_busy_percentage', 'percent'),  # Adreno(新内核)
+        ('/sys/class/kgsl/kgsl-3d0/gpubusy', 'ratio'),  # Adreno
+        ('/sys/kernel/gpu/gpu_busy', 'percent'),  # Mali(Exynos / 部分麒麟)
+        ('/sys/class/misc/mali0/device/utilization', 'percent'),  # Mali
+        ('/sys/kernel/ged/hal/gpu_utilization', 'percent'),  # Mali(联发科)
+    ],
+    'freq': [
+        ('/sys/class/kgsl/kgsl-3d0/gpuclk', 'hz'),
+        ('/sys/class/kgsl/kgsl-3d0/devfreq/cur_freq', 'hz'),
+        ('/sys/kernel/gpu/gpu_clock', 'mhz'),
+        ('/sys/class/misc/mali0/device/clock', 'auto'),
+        ('/sys/kernel/ged/hal/current_freqency', 'auto'),
+    ],
+    'max_freq': [
+        ('/sys/class/kgsl/kgsl-3d0/max_gpuclk', 'hz'),
+        ('/sys/class/kgsl/kgsl-3d0/devfreq/max_freq', 'hz'),
+        ('/sys/kernel/gpu/gpu_max_clock', 'mhz'),
+    ],
+}
+UPTIME_PATH = '/proc/uptime'
+RE_NUMBER = re.compile(r'-?\d+(?:\.\d+)?')
+# 探测脚本执行完成的标记, 用于区分"没有可读节点"和"命令执行失败"
+PROBE_DONE = 'gpu-probe-done'
+
+
+def read_script(paths: List[str]) -> str:
+    """用 sh 内置 read 读取多个节点, 每个可读节点输出一行 "<路径> <内容>" """
+    return 'for f in %s; do read -r v < $f && echo "$f $v"; done 2>/dev/null; true' % ' '.join(paths)
+
+
+def parse_nodes(output: str) -> Dict[str, str]:
+    """
+    :return: 路径 -> 内容
+    """
+    values = {}
+    for line in (output or '').replace('\r', '').split('\n'):
+        path, _, value = line.partition(' ')
+        if path.startswith('/'):
+            values[path] = value.strip()
+    return values
+
+
+def parse_value(value: str, kind: str) -> Optional[float]:
+    """
+    按节点格式解析数值, 占用为%, 频率为MHz, 解析失败返回None
+    """
+    numbers = [float(item) for item in RE_NUMBER.findall(value or '')]
+    if not numbers:
+        return None
+    if kind == 'ratio':
+        if len(numbers) < 2:
+            return None
+        busy, total = numbers[:2]
+        # GPU空闲(休眠)时 total 为0
+        return round(busy * 100.0 / total, 2) if total > 0 else 0.0
+    number = numbers[-1] if kind == 'auto' else numbers[0]
+    if kind == 'percent':
+        return number
+    if kind == 'hz':
+        return number / 1e6
+    if kind == 'khz':
+        return number / 1e3
+    if kind == 'mhz':
+        return number
+    # auto: 不同内核的单位不同, 按数值大小判断
+    if number >= 1e6:
+        return number / 1e6
+    if number >= 1e4:
+        return number / 1e3
+    return number
+
+
+class GpuSample(object):
+    """
+    一次GPU采样, 读取不到的指标为None
+    """
+
+    def __init__(self, vendor: Optional[str], load: Optional[float], freq: Optional[float],
+                 max_freq: Optional[float]):
+        """
+        :param vendor: adreno / mali
+        :param load: GPU占用, %
+        :param freq: 当前频率, MHz
+        :param max_freq: 最高频率, MHz
+        """
+        self.vendor = vendor
+        self.load = load
+        self.freq = freq
+        self.max_freq = max_freq
+        self.datetime = TimeUtils.getCurrentTime()
+        # 采集时刻的设备开机时长, 以及按 DeviceClock 换算后的本机时间(采样器未指定 clock 时为None)
+        self.uptime = 0.0
+        self.capture_time = None  # type: Optional[float]
+
+    def metrics(self) -> Dict[str, float]:
+        """
+        :return: 指标名 -> 数值, 读取不到的指标不输出
+        """
+        metrics = {}
+        for name in ('load', 'freq', 'max_freq'):
+            value = getattr(self, name)
+            if value is not None:
+                metrics['gpu.%s' % name] = value
+        return metrics
+
+    def __repr__(self):
+        return 'GpuSample(%s, load=%r, freq=%r/%rMHz)' % (self.vendor, self.load, self.freq, self.max_freq)
+
+
+class GpuSampler(object):
+    """
+    GPU占用与频率采样: 首次采样时一次shell调用探测所有候选节点(Adreno kgsl / Mali), 可读的节点记录在设备的
+    DeviceProfile.gpu_nodes 中(进程内按设备共享), 之后每次采样只读取这几个节点; 没有可读节点的设备返回None
+
+    usage:
+        sampler = GpuSampler(kit)
+        while True:
+            gpu = sampler.sample()
+    """
+
+    def __init__(self, kit, clock=None):
+        """
+        :param kit: ADBKit
+        :param clock: DeviceClock, 指定时按设备开机时长换算采集时间(capture_time)
+        """
+        self.kit = kit
+        self.clock = clock
+
+    def probe(self) -> Dict[str, Tuple[str, str]]:
+        """
+        探测可读的GPU节点并写入 DeviceProfile; 命令执行失败(超时 / adb错误)时不写入, 下次采样重新探测
+        :return: 指标 -> (路径, 格式)
+        """
+        profile = self.kit.profile
+        candidates = [path for nodes in GPU_NODES.values() for path, _ in nodes]
+        out = self.kit.run_shell_script('%s\necho %s' % (read_script(candidates), PROBE_DONE), timeout=10)
+        # 失败时的返回值(超时 / adb错误)包含完整命令, 其中也有标记文本, 需要标记独占一行才算执行完成
+        if not out or out.startswith(('[ERROR]', '[Error]')) or PROBE_DONE not in out.replace('\r', '').split('\n'):
+            logger.debug('%s: gpu probe failed: %s' % (self.kit.sn, out))
+            return {}
+        values = parse_nodes(out)
+        found = {}
+        for metric, nodes in GPU_NODES.items():
+            for path, kind in nodes:
+                if parse_value(values.get(path), kind) is not None:
+                    found[metric] = (path, kind)
+                    break
+        profile.gpu_nodes = found
+        if not found:
+            logger.info('%s: no readable gpu nodes' % self.kit.sn)
+        return found
+
+    @staticmethod
+    def vendor(nodes: Dict[str, Tuple[str, str]]) -> Optional[str]:
+        paths = ' '.join(path for path, _ in nodes.values())
+        if 'kgsl' in paths:
+            return 'adreno'
+        if paths:
+            return 'mali'
+        return None
+
+    def sample(self) -> Optional[GpuSample]:
+        """
+        采样一次, 设备没有可读的GPU节点或读取失败时返回None
+        """
+        nodes = self.kit.profile.gpu_nodes
+        if nodes is None:
+            nodes = self.probe()
+        if not nodes:
+            return None
+        paths = [path for path, _ in nodes.values()]
+        values = parse_nodes(self.kit.run_shell_script(read_script(paths + [UPTIME_PATH]), timeout=10))
+        if not any(path in values for path in paths):
+            return None
+        readings = {metric: parse_value(values.get(path), kind) for metric, (path, kind) in nodes.items()}
+        sample = GpuSample(self.vendor(nodes), readings.get('load'), readings.get('freq'), readings.get('max_freq'))
+        numbers = RE_NUMBER.findall(values.get(UPTIME_PATH, ''))
+        if numbers:
+            sample.uptime = float(numbers[0])
+            if self.clock is not None:
+                sample.capture_time = self.clock.uptime_to_host(sample.uptime)
+        return sample
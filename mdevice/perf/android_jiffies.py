@@ -0,0 +1,292 @@
+import re
+import time
+from typing import Dict, List, Optional
+
+from mdevice.tools.utils import TimeUtils
+from mdevice.tools.log import LogUtils
+
+logger = LogUtils.LOGGER_DEBUG
+
+# 用户态时钟频率(USER_HZ), Linux 对用户态固定为100
+CLK_TCK = 100
+RE_PID_STAT = re.compile(r'^(\d+) \(')
+
+
+class CpuTimes(object):
+    """
+    /proc/stat 中整机CPU的累计jiffies
+    """
+    __slots__ = ('user', 'nice', 'system', 'idle', 'iowait', 'irq', 'softirq', 'steal')
+
+    def __init__(self, values: List[int]):
+        values = (values + [0] * 8)[:8]
+        self.user, self.nice, self.system, self.idle, self.iowait, self.irq, self.softirq, self.steal = values
+
+    @property
+    def total(self) -> int:
+        return (self.user + self.nice + self.system + self.idle + self.iowait + self.irq + self.softirq +
+                self.steal)
+
+
+class ProcStat(object):
+    """
+    /proc/<pid>/stat 中进程的累计jiffies
+    """
+    __slots__ = ('pid', 'name', 'jiffies', 'starttime')
+
+    def __init__(self, pid: int, name: str, jiffies: int, starttime: int):
+        """
+        :param pid: 进程ID
+        :param name: 进程名(comm, 最长15个字符)
+        :param jiffies: utime + stime
+        :param starttime: 进程启动时间(开机后的jiffies), 用于识别pid复用
+        """
+        self.pid = pid
+        self.name = name
+        self.jiffies = jiffies
+        self.starttime = starttime
+
+
+class StatSample(object):
+    """
+    一次 cat /proc/uptime /proc/stat /proc/<pid>/stat 的解析结果
+    """
+
+    def __init__(self, output: str):
+        self.uptime = 0.0
+        self.cpu = None  # type: Optional[CpuTimes]
+        self.cpu_count = 0
+        self.procs = {}  # type: Dict[int, ProcStat]
+        self._parse(output)
+
+    def _parse(self, output: str):
+        lines = output.replace('\r', '').split('\n')
+        if lines and lines[0][:1].isdigit() and not RE_PID_STAT.match(lines[0]):
+            self.uptime = float(lines[0].split()[0])
+        for line in lines:
+            if line.startswith('cpu'):
+                items = line.split()
+                if items[0] == 'cpu':
+                    self.cpu = CpuTimes([int(item) for item in items[1:9]])
+                else:
+                    self.cpu_count += 1
+            elif RE_PID_STAT.match(line):
+                # comm 中可能含空格和括号, 以最后一个右括号为界
+                head, _, tail = line.rpartition(')')
+                pid, _, name = head.partition(' (')
+                fields = tail.split()
+                # tail 从第3个字段(state)开始: utime/stime/starttime 分别是第14/15/22个字段
+                if len(fields) < 20:
+                    continue
+                self.procs[int(pid)] = ProcStat(int(pid), name, int(fields[11]) + int(fields[12]), int(fields[19]))
+
+
+class JiffiesCpuinfo(object):
+    """
+    基于相邻两次采样的jiffies差值计算的CPU占用, 字段与 PckCpuinfo 保持一致;
+    与Android 8.0及以上的 top 相同, 整机数值以 核数*100% 为满, 进程数值以单核100%为满
+    """
+
+    def __init__(self, packages: List[str], interval: float, cpu_count: int):
+        """
+        :param packages: 应用的包名(进程名)列表
+        :param interval: 两次采样之间的设备时间间隔, 单位秒
+        :param cpu_count: 在线CPU核数
+        """
+        self.packages = packages
+        self.interval = interval
+        self.cpu_count = cpu_count
+        self.datetime = TimeUtils.getCurrentTime()
+        # 采集时刻的设备开机时长, 以及按 DeviceClock 换算后的本机时间(采样器未指定 clock 时为None)
+        self.uptime = 0.0
+        self.capture_time = None  # type: Optional[float]
+        self.pid = 0
+        self.uid = ''
+        self.pck_cpu_rate = ''
+        # 与 PckCpuinfo 一致, 每个包一条记录: {"package", "pid", "pid_cpu", "uid"}
+        self.package_list = []
+
+        self.device_cpu_rate = 0.0  # 整机的cpu使用率(user + sys)
+        self.system_rate = 0.0
+        self.user_rate = 0.0
+        self.nice_rate = 0.0
+        self.idle_rate = 0.0
+        self.iow_rate = 0.0
+        self.irq_rate = 0.0
+        self.total_pid_cpu = 0.0
+
+    @property
+    def app_cpu_rate(self) -> float:
+        """应用进程占整机CPU的百分比, 与 ADBKit.get_app_cpu 的计算方式一致"""
+        total = self.idle_rate + self.device_cpu_rate
+        return self.total_pid_cpu / total * 100 if total else 0.0
+
+    def metrics(self) -> Dict[str, float]:
+        """
+        :return: 指标名 -> 数值
+        """
+        metrics = {'cpu.device': self.device_cpu_rate, 'cpu.user': self.user_rate, 'cpu.system': self.system_rate,
+                   'cpu.idle': self.idle_rate, 'cpu.iow': self.iow_rate, 'cpu.irq': self.irq_rate,
+                   'cpu.app': self.app_cpu_rate, 'cpu.app_total': self.total_pid_cpu}
+        for item in self.package_list:
+            if item['pid_cpu'] != '':
+                metrics['cpu.pid.%s' % item['package']] = float(item['pid_cpu'])
+        return metrics
+
+    def __repr__(self):
+        return 'JiffiesCpuinfo(device=%.2f, idle=%.2f, app=%.2f, interval=%.3fs)' % (
+            self.device_cpu_rate, self.idle_rate, self.total_pid_cpu, self.interval)
+
+
+class JiffiesCpuSampler(object):
+    """
+    读取 /proc/stat 与应用所有进程的 /proc/<pid>/stat(一次shell调用), 用相邻两次采样的jiffies差值计算CPU占用,
+    不依赖 top, 设备端几乎无额外负载, 配合 ADBKit(persistent_shell=True) 可支持10Hz以上的采样频率;
+    进程重启(pid变化或pid复用)时自动刷新进程列表, 新进程在采样区间内的占用按启动时间计入
+
+    usage:
+        sampler = JiffiesCpuSampler(kit, 'com.example')
+        while True:
+            cpuinfo = sampler.sample()
+    """
+
+    def __init__(self, kit, packages, refresh_interval: float = 5.0, warmup: float = 0.2, clock=None):
+        """
+        :param kit: ADBKit
+        :param packages: 应用包名(进程名), 单个包名或包名列表
+        :param refresh_interval: 定期刷新进程列表的间隔(发现新启动的进程), 单位秒
+        :param warmup: 首次采样时两次读取之间的间隔, 单位秒
+        :param clock: DeviceClock, 指定时按设备开机时长换算采集时间(capture_time)
+        """
+        self.kit = kit
+        self.clock = clock
+        self.packages = [packages] if isinstance(packages, str) else list(packages)
+        self.refresh_interval = refresh_interval
+        self.warmup = warmup
+        self._pids = {}  # type: Dict[str, List[int]]
+        self._uids = {}  # type: Dict[str, str]
+        self._refreshed_at = 0.0
+        self._previous = None  # type: Optional[StatSample]
+
+    def _refresh_pids(self, table=None):
+        table = table or self.kit.process_table()
+        self._pids = {package: table.pids(package) for package in self.packages}
+        self._uids = {package: records[0].uid for package, records in
+                      ((package, table.find(package)) for package in self.packages) if records}
+        self._refreshed_at = time.time()
+
+    @property
+    def script(self) -> str:
+        """读取 /proc/uptime、/proc/stat 及应用所有进程 /proc/<pid>/stat 的设备端命令"""
+        pids = sorted({pid for pids in self._pids.values() for pid in pids})
+        paths = ' '.join(['/proc/uptime', '/proc/stat'] + ['/proc/%d/stat' % pid for pid in pids])
+        return 'cat %s 2>/dev/null; true' % paths
+
+    def _read(self) -> Optional[StatSample]:
+        out = self.kit.run_shell_script(self.script, timeout=10)
+        if not out or 'Error' in out:
+            logger.debug('jiffies sample failed: %s' % out)
+            return None
+        sample = StatSample(out)
+        if sample.cpu is None:
+            return None
+        return sample
+
+    def _pids_changed(self, sample: StatSample) -> bool:
+        for pids in self._pids.values():
+            for pid in pids:
+                if pid not in sample.procs:
+                    return True
+        return False
+
+    def reset(self):
+        """丢弃上一次采样, 下次采样重新预热"""
+        self._previous = None
+
+    def sample(self) -> Optional[JiffiesCpuinfo]:
+        """
+        采样一次, 返回与上一次采样之间的CPU占用; 首次采样间隔 warmup 秒读取两次, 读取失败返回None
+        """
+        if not self._pids or time.time() - self._refreshed_at > self.refresh_interval:
+            self._refresh_pids()
+        current = self._read()
+        if current is not None and self._pids_changed(current):
+            # 有进程退出(可能已重启), 刷新进程列表后重新读取
+            self._refresh_pids()
+            current = self._read()
+        if current is None:
+            return None
+        previous = self._previous
+        if previous is None:
+            time.sleep(self.warmup)
+            previous, current = current, self._read()
+            if current is None:
+                return None
+        self._previous = current
+        return self._compute(previous, current)
+
+    def feed(self, sample: StatSample) -> Optional[JiffiesCpuinfo]:
+        """
+        使用外部读取的 script 输出(如一次批量采集中的一部分)计算与上一次之间的CPU占用, 不做预热
+        :return: 首次调用或读取失败时返回None
+        """
+        if sample is None or sample.cpu is None:
+            return None
+        previous, self._previous = self._previous, sample
+        if self._pids_changed(sample):
+            # 进程退出(可能已重启), 下次读取前刷新进程列表
+            self._refreshed_at = 0.0
+        if previous is None:
+            return None
+        return self._compute(previous, sample)
+
+    def _proc_delta(self, previous: StatSample, current: StatSample, pid: int) -> Optional[int]:
+        proc = current.procs.get(pid)
+        if proc is None:
+            return None
+        old = previous.procs.get(pid)
+        if old is not None and old.starttime == proc.starttime:
+            return max(proc.jiffies - old.jiffies, 0)
+        if proc.starttime >= previous.uptime * CLK_TCK:
+            # 上次采样之后启动的进程, 全部占用都发生在本次区间内
+            return proc.jiffies
+        # 无法确定区间起点(首次出现的已有进程), 本次不计入
+        return 0
+
+    def _compute(self, previous: StatSample, current: StatSample) -> JiffiesCpuinfo:
+        cpu_count = current.cpu_count or 1
+        interval = current.uptime - previous.uptime
+        info = JiffiesCpuinfo(self.packages, interval, cpu_count)
+        info.uptime = current.uptime
+        if self.clock is not None and current.uptime:
+            info.capture_time = self.clock.uptime_to_host(current.uptime)
+        total = current.cpu.total - previous.cpu.total
+        if total <= 0:
+            return info
+        scale = cpu_count * 100.0 / total
+
+        def rate(name):
+            return round(max(getattr(current.cpu, name) - getattr(previous.cpu, name), 0) * scale, 2)
+
+        info.user_rate = rate('user')
+        info.nice_rate = rate('nice')
+        info.system_rate = rate('system')
+        info.idle_rate = rate('idle')
+        info.iow_rate = rate('iowait')
+        info.irq_rate = round(rate('irq') + rate('softirq'), 2)
+        info.device_cpu_rate = round(info.user_rate + info.system_rate, 2)
+
+        for package in self.packages:
+            package_dic = {"package": package, "pid": "", "pid_cpu": ""}
+            deltas = [(pid, self._proc_delta(previous, current, pid)) for pid in self._pids.get(package, [])]
+            deltas = [(pid, delta) for pid, delta in deltas if delta is not None]
+            if deltas:
+                pck_cpu_rate = round(sum(delta for _, delta in deltas) * scale, 2)
+                info.pid = deltas[0][0]
+                info.uid = self._uids.get(package, '')
+                info.pck_cpu_rate = str(pck_cpu_rate)
+                info.total_pid_cpu = round(info.total_pid_cpu + pck_cpu_rate, 2)
+                package_dic = {"package": package, "pid": info.pid, "pid_cpu": info.pck_cpu_rate,
+                               "uid": info.uid}
+            info.package_list.append(package_dic)
+        return info
@@ -2,11 +2,153 @@
 import os
 import re
 import sys
+import time
+from typing import Dict, List, Optional
 
 BaseDir = os.path.dirname(__file__)
 sys.path.append(os.path.join(BaseDir, '..'))
 
 
+RE_SECTION_VALUE = re.compile(r'(\S[^:]*?):\s+(\d+)(?:\s+(\d+))?(?=\s|$)')
+
+
+class MemInfoDetail(object):
+    """
+    dumpsys meminfo <pid> 的完整解析结果(单位KB), 一次遍历解析:
+    分类表(Native Heap / Dalvik Heap / .so mmap / Gfx dev / GL mtrack ... / TOTAL)、App Summary、Objects、SQL
+    """
+
+    def __init__(self):
+        self.pid = 0
+        self.process_name = ''
+        # 分类表的列名, 如 Pss Total / Private Dirty / Heap Alloc, 不同系统版本列不同
+        self.columns = []  # type: List[str]
+        # 分类名 -> 列名 -> 数值, 如 categories['Native Heap']['Heap Alloc']
+        self.categories = {}  # type: Dict[str, Dict[str, int]]
+        # App Summary: Java Heap / Native Heap / Code / Stack / Graphics / Private Other / System / TOTAL
+        self.summary = {}  # type: Dict[str, int]
+        # Android 10及以上 App Summary 还有 Rss 列
+        self.summary_rss = {}  # type: Dict[str, int]
+        # Objects: Views / Activities / AppContexts / Local Binders / Proxy Binders ...
+        self.objects = {}  # type: Dict[str, int]
+        self.sql = {}  # type: Dict[str, int]
+
+    @classmethod
+    def parse(cls, dump: str) -> "MemInfoDetail":
+        detail = cls()
+        section = None
+        header = []
+        for line in dump.replace('\r', '').split('\n'):
+            stripped = line.strip()
+            if not stripped:
+                continue
+            match = MemInfoPackage.RE_PROCESS.search(stripped)
+            if match:
+                detail.pid = int(match.group(1))
+                detail.process_name = match.group(2)
+                section = 'header'
+                header = []
+                continue
+            if section == 'header':
+                if stripped.startswith('-'):
+                    detail.columns = cls._columns(header)
+                    section = 'table'
+                else:
+                    header.append(stripped.split())
+                continue
+            if stripped in ('App Summary', 'Objects', 'SQL', 'DATABASES', 'Asset Allocations',
+                            'Unreachable memory'):
+                section = stripped
+                continue
+            if section == 'table':
+                detail._parse_row(stripped)
+            elif section in ('App Summary', 'Objects', 'SQL'):
+                for name, value, rss in RE_SECTION_VALUE.findall(stripped):
+                    if section == 'App Summary':
+                        detail.summary[name] = int(value)
+                        if rss:
+                            detail.summary_rss[name] = int(rss)
+                    elif section == 'Objects':
+                        detail.objects[name] = int(value)
+                    else:
+                        detail.sql[name] = int(value)
+        return detail
+
+    @staticmethod
+    def _columns(header: List[List[str]]) -> List[str]:
+        """
+        多行表头按列拼接: Pss + Total -> Pss Total; 各行列数不同时按右对齐(老版本第一行首列为空)
+        """
+        if not header:
+            return []
+        width = max(len(names) for names in header)
+        rows = [[''] * (width - len(names)) + names for names in header]
+        return [' '.join(name for name in names if name) for names in zip(*rows)]
+
+    def _parse_row(self, line: str):
+        items = line.split()
+        index = len(items)
+        while index > 0 and items[index - 1].isdigit():
+            index -= 1
+        if index == 0 or index == len(items):
+            return
+        name = ' '.join(items[:index])
+        # 没有 Heap 列的分类只有前几列数值
+        self.categories[name] = {column: int(value) for column, value in zip(self.columns, items[index:])}
+
+    def value(self, category: str, column: str = 'Pss Total', default: int = 0) -> int:
+        """分类表中的数值, 如 value('Native Heap', 'Heap Alloc')"""
+        return self.categories.get(category, {}).get(column, default)
+
+    @property
+    def total_pss(self) -> int:
+        if 'TOTAL' in self.categories:
+            return next(iter(self.categories['TOTAL'].values()), 0)
+        return self.summary.get('TOTAL', 0)
+
+    @property
+    def heap_alloc(self) -> int:
+        """Native Heap 与 Dalvik Heap 已分配内存之和(TOTAL 行 Heap Alloc 列)"""
+        return self.value('TOTAL', 'Heap Alloc')
+
+    @property
+    def java_heap(self) -> int:
+        return self.summary.get('Java Heap', 0)
+
+    @property
+    def native_heap(self) -> int:
+        return self.summary.get('Native Heap', 0)
+
+    @property
+    def graphics(self) -> int:
+        return self.summary.get('Graphics', 0)
+
+    @property
+    def system(self) -> int:
+        return self.summary.get('System', 0)
+
+    @property
+    def activities(self) -> int:
+        return self.objects.get('Activities', 0)
+
+    @property
+    def views(self) -> int:
+        return self.objects.get('Views', 0)
+
+    def metrics(self) -> Dict[str, float]:
+        """
+        :return: 指标名 -> 数值, 内存单位MB, 对象为个数
+        """
+        metrics = {'mem.pss': self.total_pss / 1024, 'mem.alloc_heap': self.heap_alloc / 1024,
+                   'mem.java_heap': self.java_heap / 1024, 'mem.native_heap': self.native_heap / 1024,
+                   'mem.graphics': self.graphics / 1024, 'mem.system': self.system / 1024}
+        metrics = {name: round(value, 2) for name, value in metrics.items()}
+        for name in ('Views', 'Activities', 'AppContexts', 'Local Binders', 'Proxy Binders'):
+            if name in self.objects:
+                metrics['mem.objects.%s' % name.lower().replace(' ', '_')] = float(self.objects[name])
+        return metrics
+
+
 class MemInfoPackage(object):
     RE_PROCESS = re.compile(r'\*\* MEMINFO in pid (\d+) \[(\S+)] \*\*')
     RE_TOTAL_PSS = re.compile(r'TOTAL\s+(\d+)')
@@ -25,6 +167,7 @@ class MemInfoPackage(object):
 
     def __init__(self, dump):
         self.dump = dump
+        self.detail = MemInfoDetail.parse(dump or '')
         self._parse()
 
     def _parse(self):
@@ -32,8 +175,20 @@ class MemInfoPackage(object):
         dumpsys meminfo package 中解析出需要的数据，由于版本变迁，这个数据的结构变化较多，
         比较了不同版本发现这两列数据total pss和Heap Alloc是都有的，而且这两个指标对于展示
         应用性能指标还是比较有代表性的。
+        基于 MemInfoDetail 的解析结果, 解析不到时(老版本格式)回退到正则匹配
         :return:
         '''
+        detail = self.detail
+        if detail.categories:
+            if detail.pid:
+                self.pid = str(detail.pid)
+                self.processName = detail.process_name
+            self.totalPSS = round(float(detail.total_pss) / 1024, 2)
+            self.totalAllocHeap = round(float(detail.heap_alloc) / 1024, 2)
+            self.javaHeap = round(float(detail.java_heap) / 1024, 2)
+            self.nativeHeap = round(float(detail.native_heap) / 1024, 2)
+            self.system = round(float(detail.system) / 1024, 2)
+            return
         match = self.RE_PROCESS.search(self.dump)
         if match:
             self.pid = match.group(1)
@@ -60,3 +215,144 @@ class MemInfoPackage(object):
             if "TOTAL" in line and ":" not in line:
                 tmp = line.split()
                 self.totalAllocHeap = round(float(tmp[-2]) / 1024, 2)
+
+    def metrics(self) -> Dict[str, float]:
+        """
+        :return: 指标名 -> 数值(MB), 能完整解析时为 MemInfoDetail 的全部指标
+        """
+        if self.detail.categories:
+            return self.detail.metrics()
+        return {'mem.pss': float(self.totalPSS), 'mem.alloc_heap': float(self.totalAllocHeap),
+                'mem.java_heap': float(self.javaHeap), 'mem.native_heap': float(self.nativeHeap),
+                'mem.system': float(self.system)}
+
+
+class MemTrend(object):
+    """
+    单个指标的趋势拟合结果
+    """
+
+    def __init__(self, metric: str, count: int, slope: float, r2: float, monotonic: float, first: float,
+                 last: float, leaking: bool):
+        """
+        :param metric: 指标名
+        :param count: 样本数
+        :param slope: 最小二乘拟合斜率, 单位 指标单位/分钟
+        :param r2: 拟合优度, 越接近1越接近线性增长
+        :param monotonic: 相邻样本不下降的比例
+        :param first: 第一个样本值
+        :param last: 最后一个样本值
+        :param leaking: 是否判定为持续增长(疑似泄漏)
+        """
+        self.metric = metric
+        self.count = count
+        self.slope = slope
+        self.r2 = r2
+        self.monotonic = monotonic
+        self.first = first
+        self.last = last
+        self.leaking = leaking
+
+    def __repr__(self):
+        return 'MemTrend(%s, slope=%.2f/min, r2=%.2f, monotonic=%.2f, %s -> %s%s)' % (
+            self.metric, self.slope, self.r2, self.monotonic, self.first, self.last,
+            ', LEAKING' if self.leaking else '')
+
+
+class MemLeakAnalyzer(object):
+    """
+    长时间运行(Soak)测试的内存泄漏检测: 按时间序列收集 MemInfoDetail, 对各指标做线性拟合,
+    斜率超过阈值、拟合优度足够且大部分相邻样本不下降的指标判定为持续增长
+
+    usage:
+        analyzer = MemLeakAnalyzer()
+        for ...:
+            analyzer.add(MemInfoPackage(dump).detail)
+        leaks = analyzer.leaks()
+    """
+    # 指标 -> 判定为泄漏的最小增长斜率(每分钟), 内存单位KB, 对象为个数
+    DEFAULT_THRESHOLDS = {
+        'java_heap': 256,
+        'native_heap': 256,
+        'heap_alloc': 256,
+        'total_pss': 512,
+        'graphics': 512,
+        'activities': 0.1,
+        'views': 20,
+    }
+
+    def __init__(self, thresholds: Dict[str, float] = None, min_samples: int = 10, min_r2: float = 0.6,
+                 min_monotonic: float = 0.7, max_samples: int = 10000):
+        """
+        :param thresholds: 指标 -> 最小增长斜率(每分钟), 默认 DEFAULT_THRESHOLDS
+        :param min_samples: 参与判定的最少样本数
+        :param min_r2: 最小拟合优度
+        :param min_monotonic: 相邻样本不下降的最小比例
+        :param max_samples: 最多保留的样本数, 超过后丢弃最早的样本
+        """
+        self.thresholds = dict(thresholds or self.DEFAULT_THRESHOLDS)
+        self.min_samples = min_samples
+        self.min_r2 = min_r2
+        self.min_monotonic = min_monotonic
+        self.max_samples = max_samples
+        self.timestamps = []  # type: List[float]
+        self.series = {metric: [] for metric in self.thresholds}  # type: Dict[str, List[float]]
+
+    def add(self, detail: MemInfoDetail, timestamp: float = None):
+        """
+        :param detail: 一次 dumpsys meminfo 的解析结果
+        :param timestamp: 采集时间戳, 默认当前时间
+        """
+        self.timestamps.append(timestamp if timestamp is not None else time.time())
+        for metric, values in self.series.items():
+            values.append(float(getattr(detail, metric)))
+        if len(self.timestamps) > self.max_samples:
+            del self.timestamps[0]
+            for values in self.series.values():
+                del values[0]
+
+    @staticmethod
+    def fit(xs: List[float], ys: List[float]):
+        """
+        最小二乘线性拟合
+        :return: (斜率, 拟合优度)
+        """
+        n = len(xs)
+        mean_x = sum(xs) / n
+        mean_y = sum(ys) / n
+        sxx = sum((x - mean_x) ** 2 for x in xs)
+        syy = sum((y - mean_y) ** 2 for y in ys)
+        sxy = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+        if sxx == 0:
+            return 0.0, 0.0
+        slope = sxy / sxx
+        r2 = sxy * sxy / (sxx * syy) if syy else 0.0
+        return slope, r2
+
+    def trend(self, metric: str) -> Optional[MemTrend]:
+        values = self.series.get(metric)
+        if not values or len(values) < 2:
+            return None
+        start = self.timestamps[0]
+        minutes = [(timestamp - start) / 60 for timestamp in self.timestamps]
+        slope, r2 = self.fit(minutes, values)
+        steps = [b >= a for a, b in zip(values, values[1:])]
+        monotonic = sum(steps) / len(steps)
+        leaking = (len(values) >= self.min_samples and slope >= self.thresholds[metric] and r2 >= self.min_r2
+                   and monotonic >= self.min_monotonic and values[-1] > values[0])
+        return MemTrend(metric, len(values), slope, r2, monotonic, values[0], values[-1], leaking)
+
+    def analyze(self) -> Dict[str, MemTrend]:
+        """
+        :return: 指标 -> 趋势, 样本不足2个的指标不返回
+        """
+        trends = {}
+        for metric in self.series:
+            trend = self.trend(metric)
+            if trend is not None:
+                trends[metric] = trend
+        return trends
+
+    def leaks(self) -> List[MemTrend]:
+        """判定为持续增长的指标"""
+        return [trend for trend in self.analyze().values() if trend.leaking]
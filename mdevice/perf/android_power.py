@@ -0,0 +1,262 @@
+import re
+import time
+from typing import Dict, List, Optional
+
+from mdevice.tools.utils import TimeUtils
+from mdevice.tools.log import LogUtils
+
+logger = LogUtils.LOGGER_DEBUG
+
+# 一次读取开机时长及所有 power_supply、thermal_zone 与 cooling_device 节点, 节点不存在或无权限时该值为空
+POWER_SCRIPT = '''read u < /proc/uptime && echo "uptime $u"
+for d in /sys/class/power_supply/*; do
+for f in type capacity current_now voltage_now temp status; do
+v=; read v < $d/$f && echo "psu ${d##*/} $f $v"
+done
+done 2>/dev/null
+for z in /sys/class/thermal/thermal_zone*; do
+y=; t=; read y < $z/type; read t < $z/temp; echo "zone ${z##*/thermal_zone} $y $t"
+done 2>/dev/null
+for c in /sys/class/thermal/cooling_device*; do
+y=; s=; m=; read y < $c/type; read s < $c/cur_state; read m < $c/max_state
+echo "cool ${c##*/cooling_device} $y $s $m"
+done 2>/dev/null
+true'''
+# 与CPU/GPU性能相关的 cooling_device 类型(thermal-cpufreq-0 / cpufreq-cpu4 / thermal-devfreq-0 / gpu ...)
+RE_PERF_COOLING = re.compile(r'cpu|gpu|devfreq|kgsl|mali', re.I)
+# 合理的温度范围, 超出的读数(未接传感器时常见 -273 / 0)视为无效
+TEMP_RANGE = (-40.0, 150.0)
+
+
+def _number(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class SupplyState(object):
+    """
+    /sys/class/power_supply/<name> 的状态, 节点不存在的字段为None
+    """
+
+    def __init__(self, name: str, values: Dict[str, str]):
+        """
+        :param name: 电源名, 如 battery / usb / ac
+        :param values: 节点名 -> 原始值
+        """
+        self.name = name
+        self.type = values.get('type')
+        self.status = values.get('status')
+        # 电量 %
+        self.capacity = _number(values.get('capacity'))
+        # 电流 mA, 电压 mV(节点单位为 uA / uV)
+        current = _number(values.get('current_now'))
+        self.current = current / 1000 if current is not None else None
+        voltage = _number(values.get('voltage_now'))
+        self.voltage = voltage / 1000 if voltage is not None else None
+        # 温度 ℃(节点单位为 0.1℃)
+        temp = _number(values.get('temp'))
+        self.temperature = temp / 10 if temp is not None else None
+
+    @property
+    def power(self) -> Optional[float]:
+        """功率, 单位mW"""
+        if self.current is None or self.voltage is None:
+            return None
+        return abs(self.current * self.voltage) / 1000
+
+    def __repr__(self):
+        return 'SupplyState(%s, capacity=%r, current=%r, voltage=%r, temperature=%r)' % (
+            self.name, self.capacity, self.current, self.voltage, self.temperature)
+
+
+class ThermalZone(object):
+    """
+    /sys/class/thermal/thermal_zone<N>
+    """
+    __slots__ = ('index', 'type', 'temperature')
+
+    def __init__(self, index: int, type: Optional[str], temperature: Optional[float]):
+        """
+        :param index: 序号
+        :param type: 类型, 如 cpu-0-0-usr / battery / skin-therm, 读取不到为None
+        :param temperature: 温度 ℃, 读取不到或超出合理范围为None
+        """
+        self.index = index
+        self.type = type
+        self.temperature = temperature
+
+    def __repr__(self):
+        return 'ThermalZone(%d, %s, %r)' % (self.index, self.type, self.temperature)
+
+
+class CoolingDevice(object):
+    """
+    /sys/class/thermal/cooling_device<N>, cur_state > 0 表示温控正在生效
+    """
+    __slots__ = ('index', 'type', 'cur_state', 'max_state')
+
+    def __init__(self, index: int, type: Optional[str], cur_state: Optional[int], max_state: Optional[int]):
+        self.index = index
+        self.type = type
+        self.cur_state = cur_state
+        self.max_state = max_state
+
+    @property
+    def active(self) -> bool:
+        return bool(self.cur_state)
+
+    @property
+    def affects_performance(self) -> bool:
+        """作用于CPU/GPU频率的温控设备"""
+        return bool(self.type and RE_PERF_COOLING.search(self.type))
+
+    def __repr__(self):
+        return 'CoolingDevice(%d, %s, %r/%r)' % (self.index, self.type, self.cur_state, self.max_state)
+
+
+class PowerSample(object):
+    """
+    一次电源与温度采样, 读取不到的节点为None(不填默认值)
+    """
+
+    def __init__(self, supplies: Dict[str, SupplyState], zones: List[ThermalZone], cooling: List[CoolingDevice]):
+        self.supplies = supplies
+        self.zones = zones
+        self.cooling = cooling
+        self.datetime = TimeUtils.getCurrentTime()
+        self.timestamp = time.time()
+        # 采集时刻的设备开机时长, 以及按 DeviceClock 换算后的本机时间(采样器未指定 clock 时为None)
+        self.uptime = 0.0
+        self.capture_time = None  # type: Optional[float]
+        # 是否有作用于CPU/GPU的温控正在生效
+        self.throttling = any(device.active and device.affects_performance for device in cooling)
+        # 本次采样是否为温控开始生效的时刻(上一次未生效)
+        self.throttle_started = False
+
+    @classmethod
+    def parse(cls, output: str) -> "PowerSample":
+        supplies = {}  # type: Dict[str, Dict[str, str]]
+        zones = []
+        cooling = []
+        uptime = 0.0
+        for line in output.replace('\r', '').split('\n'):
+            items = line.split()
+            if len(items) >= 2 and items[0] == 'uptime':
+                uptime = _number(items[1]) or 0.0
+            elif len(items) >= 4 and items[0] == 'psu':
+                supplies.setdefault(items[1], {})[items[2]] = ' '.join(items[3:])
+            elif len(items) >= 2 and items[0] == 'zone' and items[1].isdigit():
+                zones.append(ThermalZone(int(items[1]), *cls._zone(items[2:])))
+            elif len(items) >= 2 and items[0] == 'cool' and items[1].isdigit():
+                values = items[2:] + [None] * 3
+                name = values[0]
+                cur, limit = (int(value) if value and value.isdigit() else None for value in values[1:3])
+                cooling.append(CoolingDevice(int(items[1]), name, cur, limit))
+        sample = cls({name: SupplyState(name, values) for name, values in supplies.items()}, zones, cooling)
+        sample.uptime = uptime
+        return sample
+
+    @staticmethod
+    def _zone(items: List[str]):
+        """zone 行为 "<类型> <温度>", 类型节点读取失败时只有温度"""
+        name = items[0] if items and not items[0].lstrip('-').isdigit() else None
+        value = _number(items[-1]) if items and items[-1].lstrip('-').isdigit() else None
+        if value is not None:
+            # 多数设备单位为 0.001℃, 少数直接为 ℃
+            value = value / 1000 if abs(value) >= 1000 else value
+            if not TEMP_RANGE[0] <= value <= TEMP_RANGE[1]:
+                value = None
+        return name, value
+
+    @property
+    def battery(self) -> Optional[SupplyState]:
+        supply = self.supplies.get('battery')
+        if supply is None:
+            supply = next((supply for supply in self.supplies.values() if supply.type == 'Battery'), None)
+        return supply
+
+    @property
+    def max_temperature(self) -> Optional[float]:
+        temps = [zone.temperature for zone in self.zones if zone.temperature is not None]
+        return max(temps) if temps else None
+
+    def metrics(self) -> Dict[str, float]:
+        """
+        :return: 指标名 -> 数值, 读取不到的指标不输出
+        """
+        metrics = {}
+        battery = self.battery
+        if battery is not None:
+            for name in ('capacity', 'current', 'voltage', 'temperature', 'power'):
+                value = getattr(battery, name)
+                if value is not None:
+                    metrics['power.battery.%s' % name] = value
+        seen = set()
+        for zone in self.zones:
+            if zone.temperature is None:
+                continue
+            name = zone.type or 'zone%d' % zone.index
+            if name in seen:
+                name = '%s.%d' % (name, zone.index)
+            seen.add(name)
+            metrics['thermal.%s' % name] = zone.temperature
+        if self.max_temperature is not None:
+            metrics['thermal.max'] = self.max_temperature
+        if self.cooling:
+            metrics['thermal.throttling'] = 1.0 if self.throttling else 0.0
+        return metrics
+
+    def __repr__(self):
+        return 'PowerSample(battery=%r, max_temperature=%r, throttling=%r)' % (
+            self.battery, self.max_temperature, self.throttling)
+
+
+class PowerMonitor(object):
+    """
+    电源与温控监控: 一次shell调用读取 /sys/class/power_supply/* (电量/电流/电压/温度)、
+    /sys/class/thermal/thermal_zone*/temp 与 cooling_device 状态, 作用于CPU/GPU的 cooling_device 生效时
+    标记为温控限频, 并在开始生效的那次采样上置 throttle_started; 读取不到的节点为None, 不使用默认值
+
+    usage:
+        monitor = PowerMonitor(kit)
+        while True:
+            sample = monitor.sample()
+    """
+
+    def __init__(self, kit, clock=None):
+        """
+        :param kit: ADBKit
+        :param clock: DeviceClock, 指定时按设备开机时长换算采集时间(capture_time)
+        """
+        self.kit = kit
+        self.clock = clock
+        self.throttling = False
+        self.throttle_since = None  # type: Optional[float]
+
+    def sample(self) -> Optional[PowerSample]:
+        """
+        采样一次, 命令执行失败返回None
+        """
+        out = self.kit.run_shell_script(POWER_SCRIPT, timeout=10)
+        if not out or '[ERROR]' in out:
+            logger.debug('power sample failed: %s' % out)
+            return None
+        sample = PowerSample.parse(out)
+        if not sample.supplies and not sample.zones and not sample.cooling:
+            # 没有解析出任何节点视为读取失败, 不更新温控状态, 避免一次失败被当作温控结束
+            logger.debug('power sample failed: %s' % out)
+            return None
+        if self.clock is not None and sample.uptime:
+            sample.capture_time = self.clock.uptime_to_host(sample.uptime)
+        if sample.throttling and not self.throttling:
+            sample.throttle_started = True
+            self.throttle_since = sample.timestamp
+            logger.info('thermal throttling started: max temperature %r, %s' % (
+                sample.max_temperature, [device for device in sample.cooling if device.active]))
+        elif not sample.throttling and self.throttling:
+            logger.info('thermal throttling stopped after %.1fs' % (sample.timestamp - self.throttle_since))
+            self.throttle_since = None
+        self.throttling = sample.throttling
+        return sample
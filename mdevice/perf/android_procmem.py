@@ -0,0 +1,216 @@
+import re
+import time
+from typing import Dict, List, Optional
+
+from mdevice.perf.android_mem import MemInfoPackage
+from mdevice.tools.utils import TimeUtils
+from mdevice.tools.log import LogUtils
+
+logger = LogUtils.LOGGER_DEBUG
+
+# statm 以页为单位, 默认页大小4K, 实际页大小见 DeviceProfile.page_size_kb(16K页设备为16)
+PAGE_SIZE_KB = 4
+RE_ROLLUP = re.compile(r'^(\w+):\s+(\d+) kB$', re.M)
+
+
+class ProcMem(object):
+    """
+    单个进程的内存, 来自 /proc/<pid>/smaps_rollup, 内核不支持或无权限读取时来自 /proc/<pid>/statm(只有RSS)
+    """
+    __slots__ = ('pid', 'name', 'rss', 'pss', 'swap_pss', 'private_dirty', 'source')
+
+    def __init__(self, pid: int, name: str, rss: int = 0, pss: int = None, swap_pss: int = None,
+                 private_dirty: int = None, source: str = 'statm'):
+        """
+        :param pid: 进程ID
+        :param name: 进程名
+        :param rss: RSS, 单位KB
+        :param pss: PSS, 单位KB, 只能读取 statm 时为None
+        :param swap_pss: SwapPss, 单位KB
+        :param private_dirty: Private_Dirty, 单位KB
+        :param source: smaps_rollup / statm
+        """
+        self.pid = pid
+        self.name = name
+        self.rss = rss
+        self.pss = pss
+        self.swap_pss = swap_pss
+        self.private_dirty = private_dirty
+        self.source = source
+
+    @classmethod
+    def parse(cls, pid: int, name: str, output: str, page_size_kb: int = PAGE_SIZE_KB) -> Optional["ProcMem"]:
+        """
+        :param pid: 进程ID
+        :param name: 进程名
+        :param output: smaps_rollup 或 statm 的内容
+        :param page_size_kb: 设备内存页大小, 单位KB, 用于换算 statm
+        """
+        output = output.replace('\r', '')
+        values = {key: int(value) for key, value in RE_ROLLUP.findall(output)}
+        if 'Rss' in values:
+            return cls(pid, name, rss=values['Rss'], pss=values.get('Pss'), swap_pss=values.get('SwapPss'),
+                       private_dirty=values.get('Private_Dirty'), source='smaps_rollup')
+        items = output.split()
+        if len(items) >= 2 and items[1].isdigit():
+            return cls(pid, name, rss=int(items[1]) * page_size_kb)
+        return None
+
+    def __repr__(self):
+        return 'ProcMem(pid=%d, name=%r, rss=%d, pss=%r, source=%s)' % (
+            self.pid, self.name, self.rss, self.pss, self.source)
+
+
+class MemSample(object):
+    """
+    一次内存采样, 字段与 MemInfoPackage 一致(单位MB):
+    totalPSS / totalRSS 为应用所有进程之和; javaHeap / nativeHeap / system / totalAllocHeap
+    来自最近一次 dumpsys meminfo(detail), 未执行过 dumpsys 时为0
+    """
+
+    def __init__(self, package: str, procs: List[ProcMem], detail: MemInfoPackage = None, detail_time: float = 0,
+                 fresh_detail=False):
+        """
+        :param package: 包名
+        :param procs: 应用各进程的内存
+        :param detail: 最近一次 dumpsys meminfo 的解析结果
+        :param detail_time: detail 的采集时间戳
+        :param fresh_detail: detail 是否为本次采样时执行的 dumpsys
+        """
+        self.package = package
+        self.procs = procs
+        self.detail = detail
+        self.detail_time = detail_time
+        self.fresh_detail = fresh_detail
+        self.datetime = TimeUtils.getCurrentTime()
+        self.timestamp = time.time()
+        # 采集时刻的设备开机时长, 以及按 DeviceClock 换算后的本机时间(采样器未指定 clock 时为None)
+        self.uptime = 0.0
+        self.capture_time = None  # type: Optional[float]
+        main = [proc for proc in procs if proc.name == package]
+        self.pid = main[0].pid if main else 0
+        self.processName = package
+        self.totalRSS = round(sum(proc.rss for proc in procs) / 1024, 2)
+        pss = [proc.pss for proc in procs if proc.pss is not None]
+        if pss and len(pss) == len(procs):
+            self.totalPSS = round(sum(pss) / 1024, 2)
+            self.pss_source = 'smaps_rollup'
+        else:
+            # 无权限读取 smaps_rollup 时 PSS 只能来自 dumpsys
+            self.totalPSS = detail.totalPSS if detail else 0
+            self.pss_source = 'dumpsys'
+        self.totalAllocHeap = detail.totalAllocHeap if detail else 0
+        self.javaHeap = detail.javaHeap if detail else 0
+        self.nativeHeap = detail.nativeHeap if detail else 0
+        self.system = detail.system if detail else 0
+
+    def metrics(self) -> Dict[str, float]:
+        """
+        :return: 指标名 -> 数值(MB)
+        """
+        metrics = {'mem.rss': self.totalRSS, 'mem.pss': self.totalPSS}
+        if self.detail is not None:
+            metrics.update({'mem.java_heap': self.javaHeap, 'mem.native_heap': self.nativeHeap,
+                            'mem.system': self.system, 'mem.alloc_heap': self.totalAllocHeap})
+        return metrics
+
+    def __repr__(self):
+        return 'MemSample(%s, pss=%.2fMB(%s), rss=%.2fMB, procs=%d)' % (
+            self.package, self.totalPSS, self.pss_source, self.totalRSS, len(self.procs))
+
+
+class ProcMemSampler(object):
+    """
+    轻量内存采样: 一次shell往返读取应用所有进程(包名及 包名:xxx 子进程)的 smaps_rollup / statm, 可高频采样 PSS/RSS 趋势;
+    dumpsys meminfo(约400ms)只按 dumpsys_interval 间隔执行, 提供 Java/Native Heap 等详细数据
+
+    usage:
+        sampler = ProcMemSampler(kit, 'com.example', dumpsys_interval=30)
+        while True:
+            sample = sampler.sample()
+    """
+
+    def __init__(self, kit, package: str, dumpsys_interval: Optional[float] = 60.0, refresh_interval: float = 5.0,
+                 clock=None):
+        """
+        :param kit: ADBKit
+        :param package: 应用包名
+        :param dumpsys_interval: dumpsys meminfo 的执行间隔, 单位秒, None表示不执行
+        :param refresh_interval: 定期刷新进程列表的间隔, 单位秒
+        :param clock: DeviceClock, 指定时按设备开机时长换算采集时间(capture_time)
+        """
+        self.kit = kit
+        self.clock = clock
+        self.package = package
+        self.dumpsys_interval = dumpsys_interval
+        self.refresh_interval = refresh_interval
+        self._procs = {}  # type: Dict[int, str]
+        self._refreshed_at = 0.0
+        self._detail = None  # type: Optional[MemInfoPackage]
+        self._detail_time = 0.0
+        self._fresh_detail = False
+        self._uptime = 0.0
+
+    def _refresh_pids(self):
+        prefix = self.package + ':'
+        self._procs = {record.pid: record.name for record in self.kit.process_table()
+                       if record.name == self.package or record.name.startswith(prefix)}
+        self._refreshed_at = time.time()
+
+    @property
+    def _main_pid(self) -> Optional[int]:
+        for pid, name in self._procs.items():
+            if name == self.package:
+                return pid
+        return None
+
+    def _dumpsys_due(self) -> bool:
+        if self.dumpsys_interval is None or self._main_pid is None:
+            return False
+        return time.time() - self._detail_time >= self.dumpsys_interval
+
+    def sample(self) -> Optional[MemSample]:
+        """
+        采样一次, 应用未运行时返回None
+        """
+        self._fresh_detail = False
+        if not self._procs or time.time() - self._refreshed_at > self.refresh_interval:
+            self._refresh_pids()
+        procs = self._read()
+        if procs is not None and len(procs) < len(self._procs):
+            # 有进程退出(可能已重启), 刷新进程列表后重新读取
+            self._refresh_pids()
+            procs = self._read()
+        if not procs:
+            return None
+        sample = MemSample(self.package, procs, self._detail, self._detail_time, self._fresh_detail)
+        sample.uptime = self._uptime
+        if self.clock is not None and self._uptime:
+            sample.capture_time = self.clock.uptime_to_host(self._uptime)
+        return sample
+
+    def _read(self) -> Optional[List[ProcMem]]:
+        pids = sorted(self._procs)
+        if not pids:
+            return None
+        cmds = ['cat /proc/uptime'] + [
+            'cat /proc/%d/smaps_rollup 2>/dev/null || cat /proc/%d/statm' % (pid, pid) for pid in pids]
+        dumpsys = self._dumpsys_due()
+        if dumpsys:
+            cmds.append('dumpsys meminfo %d' % self._main_pid)
+        results = self.kit.run_shell_batch(cmds, timeout=30)
+        uptime = results[0].output.split() if results[0].ok else []
+        self._uptime = float(uptime[0]) if uptime and uptime[0].replace('.', '', 1).isdigit() else 0.0
+        page_size_kb = self.kit.profile.page_size_kb
+        procs = []
+        for pid, result in zip(pids, results[1:]):
+            if not result.ok:
+                continue
+            proc = ProcMem.parse(pid, self._procs[pid], result.output, page_size_kb)
+            if proc is not None:
+                procs.append(proc)
+        if dumpsys and results[-1].ok and 'MEMINFO in pid' in results[-1].output:
+            self._detail = MemInfoPackage(dump=results[-1].output.replace('\r', ''))
+            self._detail_time = time.time()
+            self._fresh_detail = True
+        return procs
@@ -0,0 +1,234 @@
+import time
+from typing import Dict, Optional
+
+from mdevice.perf.android_jiffies import JiffiesCpuinfo, JiffiesCpuSampler, StatSample
+from mdevice.perf.android_procmem import MemSample, ProcMem
+from mdevice.tools.utils import TimeUtils
+from mdevice.tools.log import LogUtils
+
+logger = LogUtils.LOGGER_DEBUG
+
+# 优先读取 sysfs(无需 binder 调用), 不存在时回退到 dumpsys battery
+BATTERY_CMD = ('cd /sys/class/power_supply/battery 2>/dev/null && '
+               'for f in capacity temp current_now voltage_now status; do echo "$f=$(cat $f 2>/dev/null)"; done '
+               '|| dumpsys battery')
+NET_DEV_CMD = 'cat /proc/net/dev'
+WIFI_CMD = 'ip -f inet addr'
+
+
+class BatteryState(object):
+    """
+    电池状态, 读取不到的字段为None
+    """
+
+    def __init__(self, level: float = None, temperature: float = None, current: float = None,
+                 voltage: float = None, status: str = None):
+        """
+        :param level: 电量, 0-100
+        :param temperature: 温度, 单位摄氏度
+        :param current: 电流, 单位mA(sysfs 原始值为uA, 正负号含义因设备而异)
+        :param voltage: 电压, 单位mV
+        :param status: 充电状态, 如 Charging / Discharging, dumpsys 时为状态码
+        """
+        self.level = level
+        self.temperature = temperature
+        self.current = current
+        self.voltage = voltage
+        self.status = status
+
+    @classmethod
+    def parse(cls, output: str) -> "BatteryState":
+        values = {}
+        for line in output.replace('\r', '').split('\n'):
+            key, sep, value = line.partition('=') if '=' in line else line.partition(':')
+            if sep:
+                values[key.strip()] = value.strip()
+        state = cls()
+        if 'capacity' in values:
+            # sysfs
+            state.level = cls._number(values.get('capacity'))
+            state.temperature = cls._number(values.get('temp'), 10)
+            state.current = cls._number(values.get('current_now'), 1000)
+            state.voltage = cls._number(values.get('voltage_now'), 1000)
+            state.status = values.get('status') or None
+        else:
+            state.level = cls._number(values.get('level'))
+            state.temperature = cls._number(values.get('temperature'), 10)
+            state.voltage = cls._number(values.get('voltage'))
+            state.status = values.get('status') or None
+        return state
+
+    @staticmethod
+    def _number(value: Optional[str], divisor: float = 1) -> Optional[float]:
+        try:
+            return float(value) / divisor
+        except (TypeError, ValueError):
+            return None
+
+    def __repr__(self):
+        return 'BatteryState(level=%r, temperature=%r, current=%r, voltage=%r, status=%r)' % (
+            self.level, self.temperature, self.current, self.voltage, self.status)
+
+
+class NetworkState(object):
+    """
+    网络状态: WiFi是否连接, 以及除 lo 外所有网卡的累计收发字节数
+    """
+
+    def __init__(self, wifi: bool = False, rx_bytes: int = 0, tx_bytes: int = 0):
+        self.wifi = wifi
+        self.rx_bytes = rx_bytes
+        self.tx_bytes = tx_bytes
+        # 与上一次快照之间的速率, 单位 字节/秒
+        self.rx_rate = None  # type: Optional[float]
+        self.tx_rate = None  # type: Optional[float]
+
+    @classmethod
+    def parse(cls, net_dev: str, addr: str) -> "NetworkState":
+        state = cls(wifi='wlan0' in addr)
+        for line in net_dev.replace('\r', '').split('\n'):
+            name, sep, data = line.partition(':')
+            fields = data.split()
+            if not sep or name.strip() == 'lo' or len(fields) < 9 or not fields[0].isdigit():
+                continue
+            state.rx_bytes += int(fields[0])
+            state.tx_bytes += int(fields[8])
+        return state
+
+    def __repr__(self):
+        return 'NetworkState(wifi=%r, rx=%d, tx=%d)' % (self.wifi, self.rx_bytes, self.tx_bytes)
+
+
+class DeviceSnapshot(object):
+    """
+    同一时刻采集的设备性能数据: CPU(与上一次快照之间的占用)、应用内存、电池、网络
+    """
+
+    def __init__(self, package: str, timestamp: float, elapsed: float, uptime: float,
+                 cpu: Optional[JiffiesCpuinfo], memory: Optional[MemSample], battery: BatteryState,
+                 network: NetworkState):
+        """
+        :param package: 应用包名
+        :param timestamp: 采集时间戳(本机时间, 取命令往返的中点), 更精确的时间见 capture_time
+        :param elapsed: 命令往返耗时, 单位秒
+        :param uptime: 设备开机时长(/proc/uptime), 单位秒
+        :param cpu: CPU占用, 首次采集时为None
+        :param memory: 应用内存, 应用未运行时为None
+        :param battery: 电池状态
+        :param network: 网络状态
+        """
+        self.package = package
+        self.timestamp = timestamp
+        # 按设备时钟换算的采集时间(DeviceClock), 未使用设备时钟时为None
+        self.capture_time = None  # type: Optional[float]
+        self.datetime = TimeUtils.formatTimeStamp(timestamp)
+        self.elapsed = elapsed
+        self.uptime = uptime
+        self.cpu = cpu
+        self.memory = memory
+        self.battery = battery
+        self.network = network
+
+    def metrics(self) -> Dict[str, float]:
+        """
+        :return: 指标名 -> 数值
+        """
+        metrics = {}
+        if self.cpu is not None:
+            metrics.update(self.cpu.metrics())
+        if self.memory is not None:
+            metrics.update(self.memory.metrics())
+        for name in ('level', 'temperature', 'current', 'voltage'):
+            value = getattr(self.battery, name)
+            if value is not None:
+                metrics['battery.%s' % name] = value
+        metrics['net.wifi'] = 1.0 if self.network.wifi else 0.0
+        if self.network.rx_rate is not None:
+            metrics['net.rx_rate'] = self.network.rx_rate
+            metrics['net.tx_rate'] = self.network.tx_rate
+        return metrics
+
+    def __repr__(self):
+        return 'DeviceSnapshot(%s, %s, cpu=%r, memory=%r, %r, %r)' % (
+            self.package, self.datetime, self.cpu, self.memory, self.battery, self.network)
+
+
+class SnapshotCollector(object):
+    """
+    一次shell往返(ShellBatch)采集 CPU jiffies、应用各进程内存(smaps_rollup / statm)、电池(电量/温度/电流)、
+    网络状态, 各项数据来自同一时刻, 代替分别调用 get_app_cpu / get_app_memory / get_battery_level /
+    get_battery_temperature / get_wifi_state
+
+    usage:
+        collector = SnapshotCollector(kit, 'com.example')
+        while True:
+            snapshot = collector.capture()
+    """
+
+    def __init__(self, kit, package: str, refresh_interval: float = 5.0, clock=None):
+        """
+        :param kit: ADBKit
+        :param package: 应用包名
+        :param refresh_interval: 定期刷新进程列表的间隔, 单位秒
+        :param clock: DeviceClock, 指定时按设备开机时长换算采集时间(capture_time)
+        """
+        self.kit = kit
+        self.package = package
+        self.clock = clock
+        self.refresh_interval = refresh_interval
+        self._cpu = JiffiesCpuSampler(kit, package, refresh_interval=refresh_interval)
+        self._procs = {}  # type: Dict[int, str]
+        self._refreshed_at = 0.0
+        self._previous = None  # type: Optional[DeviceSnapshot]
+
+    def _refresh_pids(self):
+        table = self.kit.process_table()
+        prefix = self.package + ':'
+        self._procs = {record.pid: record.name for record in table
+                       if record.name == self.package or record.name.startswith(prefix)}
+        self._cpu._refresh_pids(table)
+        self._refreshed_at = time.time()
+
+    def capture(self) -> Optional[DeviceSnapshot]:
+        """
+        采集一次, 命令执行失败时返回None
+        """
+        if (not self._procs or time.time() - self._refreshed_at > self.refresh_interval or
+                time.time() - self._cpu._refreshed_at > self.refresh_interval):
+            self._refresh_pids()
+        pids = sorted(self._procs)
+        cmds = [self._cpu.script, BATTERY_CMD, NET_DEV_CMD, WIFI_CMD] + [
+            'cat /proc/%d/smaps_rollup 2>/dev/null || cat /proc/%d/statm' % (pid, pid) for pid in pids]
+        begin = time.time()
+        results = self.kit.run_shell_batch(cmds, timeout=30)
+        end = time.time()
+        if results[0].exit_code is None:
+            logger.debug('snapshot failed: %r' % results[0])
+            return None
+
+        stat = StatSample(results[0].output)
+        cpu = self._cpu.feed(stat)
+        page_size_kb = self.kit.profile.page_size_kb
+        procs = []
+        for pid, result in zip(pids, results[4:]):
+            proc = ProcMem.parse(pid, self._procs[pid], result.output, page_size_kb) if result.ok else None
+            if proc is not None:
+                procs.append(proc)
+        if len(procs) < len(pids):
+            # 有进程退出, 下次采集前刷新进程列表
+            self._refreshed_at = 0.0
+        memory = MemSample(self.package, procs) if procs else None
+        snapshot = DeviceSnapshot(self.package, (begin + end) / 2, end - begin, stat.uptime, cpu, memory,
+                                  BatteryState.parse(results[1].output),
+                                  NetworkState.parse(results[2].output, results[3].output))
+        if self.clock is not None and stat.uptime:
+            snapshot.capture_time = self.clock.uptime_to_host(stat.uptime)
+        if memory is not None:
+            memory.uptime, memory.capture_time = stat.uptime, snapshot.capture_time
+        previous = self._previous
+        if previous is not None and snapshot.uptime > previous.uptime:
+            interval = snapshot.uptime - previous.uptime
+            snapshot.network.rx_rate = max(snapshot.network.rx_bytes - previous.network.rx_bytes, 0) / interval
+            snapshot.network.tx_rate = max(snapshot.network.tx_bytes - previous.network.tx_bytes, 0) / interval
+        self._previous = snapshot
+        return snapshot
@@ -0,0 +1,237 @@
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+from mdevice.perf.android_jiffies import CLK_TCK
+from mdevice.tools.utils import TimeUtils
+from mdevice.tools.log import LogUtils
+
+logger = LogUtils.LOGGER_DEBUG
+
+# 线程名中的数字(pid / 序号)统一替换, pool-3-thread-7 / binder:1234_5 / Thread-123 等按类别汇总,
+# 避免长时间运行时线程名不断变化导致序列数量无限增长
+RE_DIGITS = re.compile(r'\d+')
+
+
+def normalize_name(name: str) -> str:
+    return RE_DIGITS.sub('#', name)
+
+
+class ThreadStat(object):
+    """
+    /proc/<pid>/task/<tid>/stat 中线程的累计jiffies
+    """
+    __slots__ = ('pid', 'tid', 'name', 'jiffies', 'starttime')
+
+    def __init__(self, pid: int, tid: int, name: str, jiffies: int, starttime: int):
+        """
+        :param pid: 所属进程ID
+        :param tid: 线程ID
+        :param name: 线程名(comm, 最长15个字符)
+        :param jiffies: utime + stime
+        :param starttime: 线程启动时间(开机后的jiffies), 用于识别tid复用
+        """
+        self.pid = pid
+        self.tid = tid
+        self.name = name
+        self.jiffies = jiffies
+        self.starttime = starttime
+
+
+class ThreadSample(object):
+    """
+    一次线程stat读取的解析结果, 每行格式为 "<pid> <stat内容>"
+    """
+
+    def __init__(self, output: str):
+        self.uptime = 0.0
+        self.threads = {}  # type: Dict[int, ThreadStat]
+        self._parse(output)
+
+    def _parse(self, output: str):
+        lines = output.replace('\r', '').split('\n')
+        if lines and '(' not in lines[0] and lines[0][:1].isdigit():
+            self.uptime = float(lines[0].split()[0])
+        for line in lines:
+            # comm 中可能含空格和括号, 以最后一个右括号为界
+            head, sep, tail = line.rpartition(')')
+            if not sep:
+                continue
+            pid, _, rest = head.partition(' ')
+            tid, _, name = rest.partition(' (')
+            fields = tail.split()
+            if len(fields) < 20 or not pid.isdigit() or not tid.isdigit():
+                continue
+            self.threads[int(tid)] = ThreadStat(int(pid), int(tid), name, int(fields[11]) + int(fields[12]),
+                                                int(fields[19]))
+
+
+class ThreadUsage(object):
+    """
+    线程(或归一化后同名的线程之和)在采样区间内的CPU占用
+    """
+    __slots__ = ('name', 'cpu', 'tids', 'pids')
+
+    def __init__(self, name: str, cpu: float, tids: List[int], pids: List[int]):
+        """
+        :param name: 归一化后的线程名(数字替换为#)
+        :param cpu: CPU占用, 单核100%为满
+        :param tids: 线程ID列表
+        :param pids: 所属进程ID列表
+        """
+        self.name = name
+        self.cpu = cpu
+        self.tids = tids
+        self.pids = pids
+
+    def __repr__(self):
+        return 'ThreadUsage(%s, cpu=%.2f, threads=%d)' % (self.name, self.cpu, len(self.tids))
+
+
+class ThreadCpuinfo(object):
+    """
+    应用线程的CPU占用, 按归一化后的线程名汇总后取占用最高的 top 个
+    """
+
+    def __init__(self, package: str, threads: List[ThreadUsage], interval: float, thread_count: int):
+        """
+        :param package: 应用包名
+        :param threads: 按占用降序排列的线程(同名线程已合并)
+        :param interval: 两次采样之间的设备时间间隔, 单位秒
+        :param thread_count: 应用的线程总数
+        """
+        self.package = package
+        self.threads = threads
+        self.interval = interval
+        self.thread_count = thread_count
+        self.datetime = TimeUtils.getCurrentTime()
+        # 采集时刻的设备开机时长, 以及按 DeviceClock 换算后的本机时间(采样器未指定 clock 时为None)
+        self.uptime = 0.0
+        self.capture_time = None  # type: Optional[float]
+
+    def metrics(self) -> Dict[str, float]:
+        """
+        :return: 指标名 -> 数值, thread.<归一化线程名>.cpu 单位为%
+        """
+        metrics = {'thread.count': float(self.thread_count)}
+        for thread in self.threads:
+            metrics['thread.%s.cpu' % thread.name.replace(' ', '_')] = thread.cpu
+        return metrics
+
+    def __repr__(self):
+        return 'ThreadCpuinfo(%s, %s)' % (self.package, ', '.join('%s=%.2f' % (thread.name, thread.cpu)
+                                                                  for thread in self.threads))
+
+
+class ThreadCpuSampler(object):
+    """
+    线程级CPU采样: 一次shell调用读取应用所有进程(包名及 包名:xxx 子进程)的 /proc/<pid>/task/*/stat,
+    用相邻两次采样的jiffies差值计算每个线程的占用, 按线程名(stat 中的 comm, 数字替换为#)汇总后返回占用最高的 top 个;
+    每次只保留本次读到的线程, 已退出的线程不会累积
+
+    usage:
+        sampler = ThreadCpuSampler(kit, 'com.example', top=10)
+        while True:
+            threads = sampler.sample()
+    """
+
+    def __init__(self, kit, package: str, top: int = 10, refresh_interval: float = 5.0, warmup: float = 0.2,
+                 clock=None):
+        """
+        :param kit: ADBKit
+        :param package: 应用包名
+        :param top: 返回的线程数
+        :param refresh_interval: 定期刷新进程列表的间隔, 单位秒
+        :param warmup: 首次采样时两次读取之间的间隔, 单位秒
+        :param clock: DeviceClock, 指定时按设备开机时长换算采集时间(capture_time)
+        """
+        self.kit = kit
+        self.clock = clock
+        self.package = package
+        self.top = top
+        self.refresh_interval = refresh_interval
+        self.warmup = warmup
+        self._pids = []  # type: List[int]
+        self._refreshed_at = 0.0
+        self._previous = None  # type: Optional[ThreadSample]
+
+    def _refresh_pids(self):
+        prefix = self.package + ':'
+        self._pids = sorted(record.pid for record in self.kit.process_table()
+                            if record.name == self.package or record.name.startswith(prefix))
+        self._refreshed_at = time.time()
+
+    @property
+    def script(self) -> str:
+        """读取 /proc/uptime 及应用所有线程 stat 的设备端脚本, stat 用 sh 内置 read 读取"""
+        return ('cat /proc/uptime\n'
+                'for p in %s; do for t in /proc/$p/task/*; do read -r s < $t/stat && echo "$p $s"; done; done '
+                '2>/dev/null\ntrue' % ' '.join(str(pid) for pid in self._pids))
+
+    def _read(self) -> Optional[ThreadSample]:
+        out = self.kit.run_shell_script(self.script, timeout=10)
+        if not out:
+            return None
+        sample = ThreadSample(out)
+        if not sample.uptime:
+            logger.debug('thread sample failed: %s' % out)
+            return None
+        return sample
+
+    def reset(self):
+        """丢弃上一次采样, 下次采样重新预热"""
+        self._previous = None
+
+    def sample(self) -> Optional[ThreadCpuinfo]:
+        """
+        采样一次, 返回与上一次采样之间的线程占用; 首次采样间隔 warmup 秒读取两次; 应用未运行或读取失败返回None
+        """
+        if not self._pids or time.time() - self._refreshed_at > self.refresh_interval:
+            self._refresh_pids()
+        if not self._pids:
+            return None
+        current = self._read()
+        if current is not None and not {thread.pid for thread in current.threads.values()} >= set(self._pids):
+            # 有进程退出(可能已重启), 刷新进程列表后重新读取
+            self._refresh_pids()
+            current = self._read() if self._pids else None
+        if current is None:
+            return None
+        previous = self._previous
+        if previous is None:
+            time.sleep(self.warmup)
+            previous, current = current, self._read()
+            if current is None:
+                return None
+        # 只保留最近一次采样, 已退出的线程随上一次采样一起释放
+        self._previous = current
+        cpuinfo = self._compute(previous, current)
+        cpuinfo.uptime = current.uptime
+        if self.clock is not None and current.uptime:
+            cpuinfo.capture_time = self.clock.uptime_to_host(current.uptime)
+        return cpuinfo
+
+    def _compute(self, previous: ThreadSample, current: ThreadSample) -> ThreadCpuinfo:
+        interval = current.uptime - previous.uptime
+        scale = 100.0 / (interval * CLK_TCK) if interval > 0 else 0.0
+        started = previous.uptime * CLK_TCK
+        by_name = {}  # type: Dict[str, Tuple[int, List[int], List[int]]]
+        for tid, thread in current.threads.items():
+            old = previous.threads.get(tid)
+            if old is not None and old.starttime == thread.starttime:
+                delta = max(thread.jiffies - old.jiffies, 0)
+            elif thread.starttime >= started:
+                # 上次采样之后启动的线程, 全部占用都发生在本次区间内
+                delta = thread.jiffies
+            else:
+                delta = 0
+            name = normalize_name(thread.name)
+            jiffies, tids, pids = by_name.setdefault(name, (0, [], []))
+            tids.append(tid)
+            if thread.pid not in pids:
+                pids.append(thread.pid)
+            by_name[name] = (jiffies + delta, tids, pids)
+        threads = [ThreadUsage(name, round(jiffies * scale, 2), tids, pids)
+                   for name, (jiffies, tids, pids) in by_name.items()]
+        threads.sort(key=lambda thread: thread.cpu, reverse=True)
+        return ThreadCpuinfo(self.package, threads[:self.top], interval, len(current.threads))
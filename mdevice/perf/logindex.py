@@ -0,0 +1,278 @@
+import gzip
+import mmap
+import os
+import re
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from mdevice.perf.android_cpu import PckCpuinfo
+from mdevice.perf.android_mem import MemInfoPackage
+from mdevice.perf.timeseries import TimeSeriesStore
+from mdevice.tools.utils import TimeUtils
+from mdevice.tools.log import LogUtils
+
+logger = LogUtils.LOGGER_DEBUG
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+TOP_TITLE = b'top info'
+MEMINFO_TITLE = b'dumpsys meminfo package info'
+# <时间> top info: / <时间> dumpsys meminfo package info:, 时间为 TimeUtils.NormalFormatter(兼容冒号分隔)
+RE_HEADER = re.compile(rb'^(\d{4}-\d{2}-\d{2} \d{2}[-:]\d{2}[-:]\d{2}) (top info|dumpsys meminfo package info):\r?$',
+                       re.M)
+RE_TOP_O = re.compile(r'\d+%cpu\s+\d+%user')
+
+
+class LogRecord(object):
+    """
+    日志中一条采样记录的位置
+    """
+    __slots__ = ('offset', 'length', 'timestamp', 'kind')
+
+    def __init__(self, offset: int, length: int, timestamp: float, kind: str):
+        """
+        :param offset: 记录内容(标题行之后)的起始偏移
+        :param length: 记录内容的字节数
+        :param timestamp: 标题行中的时间戳
+        :param kind: top / meminfo
+        """
+        self.offset = offset
+        self.length = length
+        self.timestamp = timestamp
+        self.kind = kind
+
+
+class LogSample(object):
+    """
+    一条记录解析后的指标, 带 metrics() 方法, 可直接写入 TimeSeriesStore / PerfRun
+    """
+    __slots__ = ('timestamp', 'kind', 'values')
+
+    def __init__(self, timestamp: float, kind: str, values: Dict[str, float]):
+        self.timestamp = timestamp
+        self.kind = kind
+        self.values = values
+
+    def metrics(self) -> Dict[str, float]:
+        return self.values
+
+
+def parse_record(kind: str, text: str, packages=None, sdkversion: int = None):
+    """
+    用原有解析器解析一条记录
+    :param kind: top / meminfo
+    :param text: 记录内容
+    :param packages: top 记录需要统计的包名
+    :param sdkversion: 系统SDK版本, None时根据 top 输出格式判断(8.0及以上为26)
+    :return: PckCpuinfo / MemInfoPackage
+    """
+    text = text.replace('\r', '')
+    if kind == 'meminfo':
+        return MemInfoPackage(dump=text)
+    if sdkversion is None:
+        sdkversion = 26 if RE_TOP_O.search(text) else 25
+    cpuinfo = PckCpuinfo(packages, text, sdkversion)
+    cpuinfo.sum_procs_cpurate()
+    return cpuinfo
+
+
+class LogIndex(object):
+    """
+    top_cpuinfo_<sn>.txt / dumpsys_meminfo_<进程名>.txt 历史日志的索引: 文本日志通过 mmap 映射,
+    只扫描标题行建立每条记录的偏移索引, 记录内容在访问时才读取和解析, 内存占用与日志大小无关;
+    RawLogWriter 写入的 .log.gz / .log.zst 分段(单个分段有大小上限)解压后同样建立索引
+
+    usage:
+        index = LogIndex('top_cpuinfo_abc123.txt')
+        for cpuinfo in index.samples('com.example', start=begin, end=end):
+            ...
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records = []  # type: List[LogRecord]
+        self._file = None
+        self._data = None
+        self._open()
+        self._build()
+
+    def _open(self):
+        if self.path.endswith('.gz'):
+            with gzip.open(self.path, 'rb') as reader:
+                self._data = reader.read()
+        elif self.path.endswith('.zst'):
+            if zstandard is None:
+                raise ImportError('reading %s requires zstandard' % self.path)
+            with open(self.path, 'rb') as reader:
+                self._data = zstandard.ZstdDecompressor().stream_reader(reader).read()
+        else:
+            self._file = open(self.path, 'rb')
+            if os.fstat(self._file.fileno()).st_size == 0:
+                self._data = b''
+            else:
+                self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _build(self):
+        previous = None
+        times = {}
+        for match in RE_HEADER.finditer(self._data):
+            if previous is not None:
+                previous.length = match.start() - previous.offset
+            stamp = match.group(1)
+            timestamp = times.get(stamp)
+            if timestamp is None:
+                text = stamp.decode('ascii').replace(':', '-')
+                timestamp = times[stamp] = TimeUtils.getTimeStamp(text, TimeUtils.NormalFormatter)
+            kind = 'top' if match.group(2) == TOP_TITLE else 'meminfo'
+            offset = match.end() + 1
+            previous = LogRecord(offset, 0, timestamp, kind)
+            self.records.append(previous)
+        if previous is not None:
+            previous.length = len(self._data) - previous.offset
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        if self._file is not None:
+            self._file.close()
+        self._data = self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return len(self.records)
+
+    def text(self, index: int) -> str:
+        record = self.records[index]
+        return self._data[record.offset:record.offset + record.length].decode('utf-8', errors='replace')
+
+    def select(self, start: float = None, end: float = None, kind: str = None) -> List[int]:
+        """
+        :return: 时间窗口内(且类型匹配)的记录下标
+        """
+        return [i for i, record in enumerate(self.records)
+                if (start is None or record.timestamp >= start) and (end is None or record.timestamp <= end)
+                and (kind is None or record.kind == kind)]
+
+    def parse(self, index: int, packages=None, sdkversion: int = None):
+        """
+        解析第 index 条记录
+        :return: PckCpuinfo / MemInfoPackage
+        """
+        record = self.records[index]
+        return parse_record(record.kind, self.text(index), packages, sdkversion)
+
+    def samples(self, packages=None, start: float = None, end: float = None,
+                sdkversion: int = None) -> Iterator[Tuple[float, object]]:
+        """
+        逐条解析时间窗口内的记录
+        :return: (时间戳, PckCpuinfo / MemInfoPackage) 迭代器
+        """
+        for index in self.select(start, end):
+            yield self.records[index].timestamp, self.parse(index, packages, sdkversion)
+
+
+def _compressed(path: str) -> bool:
+    return path.endswith(('.gz', '.zst'))
+
+
+def _iter_local(path: str, packages, start: Optional[float], end: Optional[float],
+                sdkversion: Optional[int]) -> Iterator[LogSample]:
+    with LogIndex(path) as index:
+        for i in index.select(start, end):
+            record = index.records[i]
+            yield LogSample(record.timestamp, record.kind, index.parse(i, packages, sdkversion).metrics())
+
+
+def _parse_file(path: str, packages, start: Optional[float], end: Optional[float],
+                sdkversion: Optional[int]) -> List[LogSample]:
+    """进程池中执行: 压缩分段在任务内解压一次并解析时间窗口内的记录, 只返回指标以减少进程间传输"""
+    return list(_iter_local(path, packages, start, end, sdkversion))
+
+
+def _parse_slices(path: str, slices: List[Tuple[int, int, float, str]], packages,
+                  sdkversion: Optional[int]) -> List[LogSample]:
+    """进程池中执行: 只读取父进程索引给出的 (offset, length) 字节区间并解析, 不重新扫描文件"""
+    samples = []
+    with open(path, 'rb') as reader:
+        for offset, length, timestamp, kind in slices:
+            reader.seek(offset)
+            text = reader.read(length).decode('utf-8', errors='replace')
+            samples.append(LogSample(timestamp, kind, parse_record(kind, text, packages, sdkversion).metrics()))
+    return samples
+
+
+def _submit(executor: ProcessPoolExecutor, path: str, packages, start: Optional[float], end: Optional[float],
+            sdkversion: Optional[int], chunk: int) -> List[Future]:
+    """
+    提交一个日志的解析任务: 文本日志在当前进程用 mmap 建立索引, 每 chunk 条记录一个任务, 任务只读取各自的字节区间;
+    压缩分段无法按偏移读取, 每个文件一个任务, 只解压一次
+    """
+    if _compressed(path):
+        return [executor.submit(_parse_file, path, packages, start, end, sdkversion)]
+    with LogIndex(path) as index:
+        slices = [(record.offset, record.length, record.timestamp, record.kind)
+                  for record in (index.records[i] for i in index.select(start, end))]
+    return [executor.submit(_parse_slices, path, slices[i:i + chunk], packages, sdkversion)
+            for i in range(0, len(slices), chunk)]
+
+
+def iter_samples(path: str, packages=None, start: float = None, end: float = None, sdkversion: int = None,
+                 processes: int = 0, chunk: int = 500) -> Iterator[LogSample]:
+    """
+    解析日志中时间窗口内的所有记录, 按时间顺序返回指标
+    :param path: 日志文件
+    :param packages: top 记录需要统计的包名
+    :param processes: 进程池大小, 0表示在当前进程中逐条解析
+    :param chunk: 进程池中每个任务解析的记录数(文本日志)
+    """
+    if not processes:
+        for sample in _iter_local(path, packages, start, end, sdkversion):
+            yield sample
+        return
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for future in _submit(executor, path, packages, start, end, sdkversion, chunk):
+            for sample in future.result():
+                yield sample
+
+
+def backfill(paths: List[str], target, packages=None, prefix: str = '', start: float = None, end: float = None,
+             sdkversion: int = None, processes: int = 0) -> int:
+    """
+    把历史日志导入 TimeSeriesStore 或 PerfDB 的 PerfRun
+    :param paths: 日志文件列表
+    :param target: TimeSeriesStore / PerfRun
+    :param packages: top 记录需要统计的包名
+    :param prefix: 写入 TimeSeriesStore 时的序列名前缀, 如 <sn>/<package>
+    :param processes: 进程池大小, 0表示在当前进程中解析; 多个压缩分段在进程池中并行解压
+    :return: 导入的记录数
+    """
+    count = 0
+    begin = time.time()
+    executor = ProcessPoolExecutor(max_workers=processes) if processes else None
+    try:
+        if executor is not None:
+            futures = [future for path in paths
+                       for future in _submit(executor, path, packages, start, end, sdkversion, 500)]
+            samples = (sample for future in futures for sample in future.result())
+        else:
+            samples = (sample for path in paths for sample in _iter_local(path, packages, start, end, sdkversion))
+        for sample in samples:
+            if isinstance(target, TimeSeriesStore):
+                target.add_sample(prefix, sample, sample.timestamp)
+            else:
+                target.add_sample(sample, sample.timestamp)
+            count += 1
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    logger.info('backfill %d records from %d logs in %.2fs' % (count, len(paths), time.time() - begin))
+    return count
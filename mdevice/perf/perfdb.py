@@ -0,0 +1,348 @@
+import csv
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, Iterator, List, Tuple
+
+from mdevice.tools.log import LogUtils
+
+logger = LogUtils.LOGGER_DEBUG
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    run_id TEXT NOT NULL,
+    serial TEXT NOT NULL,
+    package TEXT NOT NULL,
+    app_version TEXT NOT NULL DEFAULT '',
+    brand TEXT NOT NULL DEFAULT '',
+    model TEXT NOT NULL DEFAULT '',
+    sdk INTEGER NOT NULL DEFAULT 0,
+    started_at REAL NOT NULL,
+    UNIQUE (run_id, serial, package)
+);
+CREATE INDEX IF NOT EXISTS idx_runs_app ON runs (package, app_version, model);
+CREATE INDEX IF NOT EXISTS idx_runs_model ON runs (model, package, app_version);
+CREATE INDEX IF NOT EXISTS idx_runs_serial ON runs (serial, started_at);
+CREATE TABLE IF NOT EXISTS metrics (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS samples (
+    run INTEGER NOT NULL,
+    metric INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    value REAL,
+    PRIMARY KEY (run, metric, ts)
+) WITHOUT ROWID;
+'''
+
+COLUMNS = ('run_id', 'serial', 'package', 'app_version', 'brand', 'model', 'sdk', 'metric', 'ts', 'value')
+_FLUSH = object()
+_STOP = object()
+
+
+class PerfRun(object):
+    """
+    一次测试(某台设备上的某个应用)的写入句柄, 由 PerfDB.open_run 创建, 可在多个采样线程中共享
+    """
+
+    def __init__(self, db: "PerfDB", ref: int, run_id: str, serial: str, package: str, app_version: str,
+                 model: str):
+        self.db = db
+        self.ref = ref
+        self.run_id = run_id
+        self.serial = serial
+        self.package = package
+        self.app_version = app_version
+        self.model = model
+
+    def add(self, metric: str, value: float, timestamp: float = None):
+        """
+        :param metric: 指标名, 如 cpu.app / mem.pss
+        :param value: 数值
+        :param timestamp: 时间戳, 默认当前时间
+        """
+        self.db.put([(self.ref, metric, time.time() if timestamp is None else timestamp, value)])
+
+    def add_sample(self, sample, timestamp: float = None):
+        """
+        写入一次采样结果的全部指标
+        :param sample: 带 metrics() 方法的采样结果(PckCpuinfo / JiffiesCpuinfo / MemSample ...), None时忽略
+        :param timestamp: 时间戳, 默认当前时间
+        """
+        if sample is None:
+            return
+        timestamp = time.time() if timestamp is None else timestamp
+        self.db.put([(self.ref, metric, timestamp, value) for metric, value in sample.metrics().items()
+                     if value is not None])
+
+    def __repr__(self):
+        return 'PerfRun(%s, %s, %s %s)' % (self.run_id, self.serial, self.package, self.app_version)
+
+
+class PerfDB(object):
+    """
+    性能数据的持久化存储(SQLite, WAL模式): 按 设备 / 应用 / 应用版本 / 测试ID / 指标 / 时间戳 存储,
+    多个采样线程的写入放入队列, 由后台线程按批次在一个事务中写入; runs 表按 应用+版本+机型 建索引,
+    支持"应用X的版本Y在机型Z上的所有测试"一类查询, 可导出 CSV / Parquet(需安装 pyarrow)
+
+    同一 (run, metric, ts) 重复写入时覆盖, 历史日志可重复导入
+
+    usage:
+        db = PerfDB('perf.db')
+        run = db.open_run_for(kit, 'com.example')
+        run.add_sample(kit.get_app_cpuinfo('com.example'))
+        db.query(package='com.example', app_version='1.2.0', model='Pixel 6', metric='cpu.app')
+    """
+
+    def __init__(self, path: str = 'perf.db', batch_size: int = 1000, flush_interval: float = 1.0,
+                 queue_size: int = 100000):
+        """
+        :param path: 数据库文件路径
+        :param batch_size: 每个写入事务的最大行数
+        :param flush_interval: 队列中数据的最长等待时间, 单位秒
+        :param queue_size: 写入队列的长度, 队列满时写入方阻塞
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+        self._metrics = {}  # type: Dict[str, int]
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        conn.commit()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='perf-db-writer', daemon=True)
+        self._thread.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """当前线程的连接(用于查询)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def open_run(self, serial: str, package: str, app_version: str = '', run_id: str = None, brand: str = '',
+                 model: str = '', sdk: int = 0, started_at: float = None) -> PerfRun:
+        """
+        创建(或打开已有的)一次测试
+        :param serial: 设备序列号
+        :param package: 应用包名
+        :param app_version: 应用版本号
+        :param run_id: 测试ID, 默认随机生成; 同一次测试的多台设备可使用相同的run_id
+        :param brand: 设备品牌
+        :param model: 设备型号
+        :param sdk: 系统SDK版本
+        :param started_at: 开始时间戳, 默认当前时间
+        """
+        run_id = run_id or uuid.uuid4().hex
+        conn = self.conn
+        with conn:
+            conn.execute('INSERT OR IGNORE INTO runs (run_id, serial, package, app_version, brand, model, sdk, '
+                         'started_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                         (run_id, serial, package, app_version or '', brand or '', model or '', sdk or 0,
+                          started_at or time.time()))
+        ref, app_version, model = conn.execute(
+            'SELECT id, app_version, model FROM runs WHERE run_id = ? AND serial = ? AND package = ?',
+            (run_id, serial, package)).fetchone()
+        return PerfRun(self, ref, run_id, serial, package, app_version, model)
+
+    def open_run_for(self, kit, package: str, run_id: str = None) -> PerfRun:
+        """
+        从设备读取型号 / SDK版本 / 应用版本号后创建一次测试
+        :param kit: ADBKit
+        :param package: 应用包名
+        :param run_id: 测试ID
+        """
+        profile = kit.profile
+        return self.open_run(kit.sn, package, app_version=kit.get_app_version(package) or '', run_id=run_id,
+                             brand=profile.brand, model=profile.model, sdk=profile.sdk)
+
+    def put(self, rows: List[Tuple[int, str, float, float]]):
+        """
+        放入待写入的数据, close 之后写入抛出 ValueError
+        :param rows: [(run.ref, 指标名, 时间戳, 数值)]
+        """
+        if self._closed:
+            raise ValueError('perf db %s is closed' % self.path)
+        if rows:
+            self._queue.put(rows)
+
+    def flush(self, timeout: float = None):
+        """等待队列中已有的数据写入数据库, 后台线程已停止(close 之后)时直接返回"""
+        if not self._thread.is_alive():
+            return
+        event = threading.Event()
+        self._queue.put((_FLUSH, event))
+        deadline = None if timeout is None else time.time() + timeout
+        # 分段等待, 等待期间后台线程退出(并发 close)时不会一直阻塞
+        while not event.wait(0.5 if deadline is None else max(min(deadline - time.time(), 0.5), 0)):
+            if not self._thread.is_alive() or (deadline is not None and time.time() >= deadline):
+                return
+
+    def close(self, timeout: float = 30):
+        """写完队列中的数据并停止后台线程, 之后不能再写入"""
+        self._closed = True
+        if self._thread.is_alive():
+            self._queue.put((_STOP, None))
+            self._thread.join(timeout)
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _run(self):
+        conn = self._connect()
+        pending = []
+        events = []
+        stop = False
+        while not stop:
+            try:
+                item = self._queue.get(timeout=self.flush_interval if pending else None)
+            except queue.Empty:
+                item = None
+            while item is not None:
+                if isinstance(item, tuple) and item[0] is _STOP:
+                    stop = True
+                elif isinstance(item, tuple) and item[0] is _FLUSH:
+                    events.append(item[1])
+                else:
+                    pending.extend(item)
+                if len(pending) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    item = None
+            if pending:
+                try:
+                    self._write(conn, pending)
+                except sqlite3.Error as e:
+                    logger.error('perf db write failed, %d rows dropped: %s' % (len(pending), e))
+                pending = []
+            for event in events:
+                event.set()
+            events = []
+        conn.close()
+
+    def _metric_id(self, conn: sqlite3.Connection, name: str) -> int:
+        metric = self._metrics.get(name)
+        if metric is None:
+            conn.execute('INSERT OR IGNORE INTO metrics (name) VALUES (?)', (name,))
+            metric = self._metrics[name] = conn.execute('SELECT id FROM metrics WHERE name = ?',
+                                                        (name,)).fetchone()[0]
+        return metric
+
+    def _write(self, conn: sqlite3.Connection, rows: List[Tuple[int, str, float, float]]):
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO samples (run, metric, ts, value) VALUES (?, ?, ?, ?)',
+                             [(ref, self._metric_id(conn, metric), ts, value) for ref, metric, ts, value in rows])
+
+    @staticmethod
+    def _where(filters: Dict[str, object]) -> Tuple[str, list]:
+        clauses = []
+        params = []
+        for column in ('run_id', 'serial', 'package', 'app_version', 'brand', 'model', 'sdk'):
+            value = filters.get(column)
+            if value is not None:
+                clauses.append('r.%s = ?' % column)
+                params.append(value)
+        if filters.get('metric') is not None:
+            clauses.append('m.name = ?')
+            params.append(filters['metric'])
+        if filters.get('start') is not None:
+            clauses.append('s.ts >= ?')
+            params.append(filters['start'])
+        if filters.get('end') is not None:
+            clauses.append('s.ts <= ?')
+            params.append(filters['end'])
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def runs(self, package: str = None, app_version: str = None, model: str = None,
+             serial: str = None) -> List[Dict[str, object]]:
+        """
+        :return: 满足条件的测试列表, 按开始时间排序
+        """
+        where, params = self._where({'package': package, 'app_version': app_version, 'model': model,
+                                     'serial': serial})
+        cursor = self.conn.execute('SELECT r.run_id, r.serial, r.package, r.app_version, r.brand, r.model, r.sdk, '
+                                   'r.started_at FROM runs r%s ORDER BY r.started_at' % where, params)
+        names = [item[0] for item in cursor.description]
+        return [dict(zip(names, row)) for row in cursor]
+
+    def iter_query(self, **filters) -> Iterator[tuple]:
+        """
+        按条件查询数据, 逐行返回, 每行字段见 COLUMNS
+        :param filters: run_id / serial / package / app_version / brand / model / sdk / metric / start / end
+        """
+        where, params = self._where(filters)
+        return self.conn.execute(
+            'SELECT r.run_id, r.serial, r.package, r.app_version, r.brand, r.model, r.sdk, m.name, s.ts, s.value '
+            'FROM runs r JOIN samples s ON s.run = r.id JOIN metrics m ON m.id = s.metric%s '
+            'ORDER BY r.id, m.name, s.ts' % where, params)
+
+    def query(self, **filters) -> List[tuple]:
+        return list(self.iter_query(**filters))
+
+    def export_csv(self, path: str, **filters) -> int:
+        """
+        导出为CSV
+        :return: 导出的行数
+        """
+        count = 0
+        with open(path, 'w', newline='', encoding='utf-8') as writer:
+            out = csv.writer(writer)
+            out.writerow(COLUMNS)
+            for row in self.iter_query(**filters):
+                out.writerow(row)
+                count += 1
+        return count
+
+    def export_parquet(self, path: str, batch_rows: int = 100000, **filters) -> int:
+        """
+        导出为Parquet, 需安装 pyarrow, 按 batch_rows 分批写入
+        :return: 导出的行数
+        """
+        if pyarrow is None:
+            raise ImportError('export_parquet requires pyarrow, please pip install pyarrow')
+        schema = pyarrow.schema([('run_id', pyarrow.string()), ('serial', pyarrow.string()),
+                                 ('package', pyarrow.string()), ('app_version', pyarrow.string()),
+                                 ('brand', pyarrow.string()), ('model', pyarrow.string()),
+                                 ('sdk', pyarrow.int32()), ('metric', pyarrow.string()),
+                                 ('ts', pyarrow.float64()), ('value', pyarrow.float64())])
+        count = 0
+        cursor = self.iter_query(**filters)
+        with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+            while True:
+                rows = cursor.fetchmany(batch_rows)
+                if not rows:
+                    break
+                columns = list(zip(*rows))
+                writer.write_table(pyarrow.Table.from_arrays(
+                    [pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)],
+                    schema=schema))
+                count += len(rows)
+        return count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,256 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from mdevice.perf.timeseries import TimeSeriesStore
+from mdevice.tools.log import LogUtils
+
+logger = LogUtils.LOGGER_DEBUG
+
+# add_device 支持的采集项: 名称 -> (kit, package) 的采集函数
+COLLECTORS = {
+    'cpu': lambda kit, package: kit.get_app_cpuinfo(package),
+    'memory': lambda kit, package: kit.get_app_meminfo(package),
+    'snapshot': lambda kit, package: kit.get_snapshot(package),
+    'cores': lambda kit, package: kit.get_core_cpuinfo(),
+    'threads': lambda kit, package: kit.get_thread_cpuinfo(package),
+    'power': lambda kit, package: kit.get_power_sample(),
+    'gpu': lambda kit, package: kit.get_gpu_sample(),
+    'gfx': lambda kit, package: kit.get_gfx_sample(package, surface_flinger=True),
+}
+# 指标名相同的采集项(snapshot 同时输出 cpu.* 与 mem.*), 写入没有序列名前缀的 sink(PerfRun)时不能同时使用
+OVERLAPPING = {'snapshot': ('cpu', 'memory')}
+
+
+class SamplingTask(object):
+    """
+    按固定频率执行的采集任务, 第 n 次采集的计划时间为 起始时间 + n * interval, 不受单次采集耗时影响(无漂移);
+    上一次采集尚未结束或已错过的计划时间直接跳过并计入 missed, 不排队补采;
+    采样结果带 capture_time(按 DeviceClock 换算的设备采集时间, 如 DeviceSnapshot)时以它为时间戳, 否则取往返中点
+    """
+
+    def __init__(self, name: str, collect: Callable[[], object], interval: float,
+                 on_sample: Callable[["SamplingTask", object, float], None] = None, sink=None, prefix: str = None):
+        """
+        :param name: 任务名, 如 <sn>/<package>/cpu
+        :param collect: 采集函数, 返回采样结果, 返回None表示本次无数据
+        :param interval: 采集间隔, 单位秒
+        :param on_sample: 回调 on_sample(task, 采样结果, 采集时间戳)
+        :param sink: 采样结果(带 metrics())的写入目标, TimeSeriesStore / PerfRun
+        :param prefix: 写入 TimeSeriesStore 时的序列名前缀, 默认为任务名
+        """
+        self.name = name
+        self.collect = collect
+        self.interval = interval
+        self.on_sample = on_sample
+        self.sink = sink
+        self.prefix = name if prefix is None else prefix
+        self.samples = 0
+        self.empty = 0
+        self.missed = 0
+        self.errors = 0
+        self.last_timestamp = None  # type: Optional[float]
+        self.last_elapsed = 0.0
+        self.total_lateness = 0.0
+        self.max_lateness = 0.0
+        self.running = False
+        self.removed = False
+        self._anchor = 0.0
+        self._tick = 0
+
+    @property
+    def next_due(self) -> float:
+        """下一次计划执行的时间(time.monotonic)"""
+        return self._anchor + self._tick * self.interval
+
+    def stats(self) -> Dict[str, float]:
+        executed = self.samples + self.empty + self.errors
+        return {'samples': self.samples, 'empty': self.empty, 'missed': self.missed, 'errors': self.errors,
+                'last_elapsed': round(self.last_elapsed, 4),
+                'mean_lateness': round(self.total_lateness / executed, 4) if executed else 0.0,
+                'max_lateness': round(self.max_lateness, 4)}
+
+    def __repr__(self):
+        return 'SamplingTask(%s, interval=%.3fs, samples=%d, missed=%d)' % (
+            self.name, self.interval, self.samples, self.missed)
+
+
+class SamplingScheduler(object):
+    """
+    多设备、多频率的采集调度: 所有任务的计划时间放在一个最小堆中, 由一个调度线程按时间顺序派发到线程池执行,
+    各任务频率相互独立(如 CPU 5Hz / 内存 1Hz / 电池 0.1Hz); 采样时间戳取采集命令往返的中点(或结果的 capture_time), 而不是返回时间
+
+    usage:
+        scheduler = SamplingScheduler()
+        scheduler.add_device(kit, 'com.example', {'cpu': 5, 'memory': 1}, sink=store)
+        scheduler.start()
+        ...
+        scheduler.stop()
+        scheduler.stats()
+    """
+
+    def __init__(self, max_workers: int = 32):
+        """
+        :param max_workers: 执行采集的线程数, 同时采集的任务数上限
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='sampler')
+        self._tasks = {}  # type: Dict[str, SamplingTask]
+        self._heap = []  # type: List[tuple]
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None  # type: Optional[threading.Thread]
+        self._running = False
+
+    def add(self, name: str, collect: Callable[[], object], rate: float = None, interval: float = None,
+            on_sample=None, sink=None, prefix: str = None) -> SamplingTask:
+        """
+        添加采集任务, 同名任务会被替换
+        :param name: 任务名
+        :param collect: 采集函数
+        :param rate: 采集频率, 单位Hz, 与 interval 二选一
+        :param interval: 采集间隔, 单位秒
+        :param on_sample: 回调 on_sample(task, 采样结果, 采集时间戳)
+        :param sink: TimeSeriesStore / PerfRun
+        :param prefix: 写入 TimeSeriesStore 时的序列名前缀, 默认为任务名
+        """
+        if interval is None:
+            interval = 1.0 / rate
+        if interval <= 0:
+            raise ValueError('sampling interval must be positive: %r' % interval)
+        task = SamplingTask(name, collect, interval, on_sample, sink, prefix)
+        with self._cond:
+            old = self._tasks.get(name)
+            if old is not None:
+                old.removed = True
+            self._tasks[name] = task
+            task._anchor = time.monotonic()
+            heapq.heappush(self._heap, (task.next_due, next(self._seq), task))
+            self._cond.notify()
+        return task
+
+    def add_device(self, kit, package: str, rates: Dict[str, float], sink=None) -> List[SamplingTask]:
+        """
+        为一台设备添加多个采集项, 任务名为 <sn>/<package>/<采集项>
+        :param kit: ADBKit
+        :param package: 应用包名
+        :param rates: 采集项 -> 频率(Hz), 采集项见 COLLECTORS
+        :param sink: TimeSeriesStore(序列名前缀为任务名 <sn>/<package>/<采集项>, 不同采集项的同名指标互不混合) /
+                     PerfRun(指标名不带前缀, 不能同时使用 OVERLAPPING 中指标名相同的采集项)
+        """
+        if sink is not None and not isinstance(sink, TimeSeriesStore):
+            for kind, others in OVERLAPPING.items():
+                conflicts = [other for other in others if kind in rates and other in rates]
+                if conflicts:
+                    raise ValueError('collector %r writes the same metrics as %s' % (kind, conflicts))
+        tasks = []
+        for kind, rate in rates.items():
+            collector = COLLECTORS[kind]
+            tasks.append(self.add('%s/%s/%s' % (kit.sn, package, kind), lambda c=collector: c(kit, package),
+                                  rate=rate, sink=sink))
+        return tasks
+
+    def remove(self, name_or_prefix: str) -> int:
+        """
+        移除任务名等于或以 <name_or_prefix>/ 开头的任务(如移除一台设备的所有任务)
+        :return: 移除的任务数
+        """
+        with self._cond:
+            names = [name for name in self._tasks
+                     if name == name_or_prefix or name.startswith(name_or_prefix + '/')]
+            for name in names:
+                self._tasks.pop(name).removed = True
+        return len(names)
+
+    @property
+    def tasks(self) -> List[SamplingTask]:
+        return list(self._tasks.values())
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        :return: 任务名 -> 采集数 / 无数据次数 / 跳过次数 / 失败次数 / 耗时 / 延迟
+        """
+        return {name: task.stats() for name, task in list(self._tasks.items())}
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='sampling-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self, wait: bool = True):
+        """停止调度, wait为True时等待正在执行的采集结束"""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._executor.shutdown(wait=wait)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                due, _, task = self._heap[0]
+                now = time.monotonic()
+                if due > now:
+                    self._cond.wait(due - now)
+                    continue
+                heapq.heappop(self._heap)
+                if task.removed:
+                    continue
+                task._tick += 1
+                if task.next_due <= now:
+                    # 调度被阻塞超过一个间隔, 跳过已错过的计划时间
+                    skipped = int((now - task.next_due) // task.interval) + 1
+                    task._tick += skipped
+                    task.missed += skipped
+                heapq.heappush(self._heap, (task.next_due, next(self._seq), task))
+                if task.running:
+                    # 上一次采集尚未结束
+                    task.missed += 1
+                    continue
+                task.running = True
+            self._executor.submit(self._execute, task, due)
+
+    @staticmethod
+    def _execute(task: SamplingTask, due: float):
+        lateness = time.monotonic() - due
+        begin = time.time()
+        try:
+            result = task.collect()
+        except Exception as e:
+            task.errors += 1
+            logger.error('%s: sampling failed: %s' % (task.name, e))
+            result = None
+        else:
+            if result is None:
+                task.empty += 1
+        end = time.time()
+        task.last_elapsed = end - begin
+        task.total_lateness += lateness
+        task.max_lateness = max(task.max_lateness, lateness)
+        try:
+            if result is not None:
+                timestamp = getattr(result, 'capture_time', None) or (begin + end) / 2
+                task.samples += 1
+                task.last_timestamp = timestamp
+                if task.sink is not None:
+                    if isinstance(task.sink, TimeSeriesStore):
+                        task.sink.add_sample(task.prefix, result, timestamp)
+                    else:
+                        task.sink.add_sample(result, timestamp)
+                if task.on_sample is not None:
+                    task.on_sample(task, result, timestamp)
+        except Exception as e:
+            logger.error('%s: sample handler failed: %s' % (task.name, e))
+        finally:
+            task.running = False
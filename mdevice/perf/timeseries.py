@@ -0,0 +1,423 @@
+import bisect
+import math
+import struct
+import threading
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+CHUNK_SIZE = 1024
+PERCENTILES = (50, 90, 99)
+# 每个冷数据块保存的分位数草图点数
+SKETCH_SIZE = 64
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _unzigzag(value: int) -> int:
+    return (value >> 1) ^ -(value & 1)
+
+
+def _write_varint(out: bytearray, value: int):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def encode_timestamps(timestamps: Iterable[float]) -> bytes:
+    """
+    时间戳按毫秒取整后做二阶差分(delta-of-delta) + zigzag + varint 编码, 等间隔采样时每个点约1字节
+    """
+    out = bytearray()
+    prev = prev_delta = 0
+    for index, timestamp in enumerate(timestamps):
+        value = int(round(timestamp * 1000))
+        if index == 0:
+            _write_varint(out, _zigzag(value))
+        else:
+            delta = value - prev
+            _write_varint(out, _zigzag(delta - prev_delta))
+            prev_delta = delta
+        prev = value
+    return bytes(out)
+
+
+def decode_timestamps(data: bytes, count: int) -> array:
+    result = array('d')
+    pos = 0
+    prev = prev_delta = 0
+    for index in range(count):
+        raw, pos = _read_varint(data, pos)
+        if index == 0:
+            prev = _unzigzag(raw)
+        else:
+            prev_delta += _unzigzag(raw)
+            prev += prev_delta
+        result.append(prev / 1000.0)
+    return result
+
+
+def encode_values(values: Iterable[float]) -> bytes:
+    """
+    数值与前一个值的64位表示做异或(XOR), 去掉末尾的0后以 varint 编码, 值不变时每个点1字节
+    """
+    out = bytearray()
+    prev = 0
+    for value in values:
+        bits = struct.unpack('<Q', struct.pack('<d', value))[0]
+        xor = bits ^ prev
+        prev = bits
+        if xor == 0:
+            out.append(0)
+            continue
+        trailing = (xor & -xor).bit_length() - 1
+        # 首字节为 末尾0的个数 + 1, 0 表示与前值相同
+        out.append(trailing + 1)
+        _write_varint(out, xor >> trailing)
+    return bytes(out)
+
+
+def decode_values(data: bytes, count: int) -> array:
+    result = array('d')
+    pos = 0
+    prev = 0
+    for _ in range(count):
+        trailing = data[pos]
+        pos += 1
+        if trailing:
+            xor, pos = _read_varint(data, pos)
+            prev ^= xor << (trailing - 1)
+        result.append(struct.unpack('<d', struct.pack('<Q', prev))[0])
+    return result
+
+
+def _interpolate(ordered, rank: float) -> float:
+    """按排名线性插值, 与 numpy.percentile 默认方式一致"""
+    low = int(math.floor(rank))
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def weighted_percentiles(items: List[Tuple[float, float]], percentiles: Iterable[int]) -> Dict[str, float]:
+    """
+    带权重的百分位数, 权重均为1时与 numpy.percentile 的线性插值结果相同
+    :param items: (数值, 权重) 列表, 草图点的权重为其代表的点数
+    """
+    items = sorted(items)
+    positions = []
+    cumulative = 0.0
+    for _, weight in items:
+        # 每个点位于其代表的排名区间的中点
+        positions.append(cumulative + (weight - 1) / 2.0)
+        cumulative += weight
+    result = {}
+    for p in percentiles:
+        rank = (cumulative - 1) * p / 100.0
+        index = bisect.bisect_right(positions, rank)
+        if index == 0:
+            value = items[0][0]
+        elif index == len(items):
+            value = items[-1][0]
+        else:
+            low, high = positions[index - 1], positions[index]
+            value = items[index - 1][0] + (items[index][0] - items[index - 1][0]) * (rank - low) / (high - low)
+        result['p%d' % p] = value
+    return result
+
+
+class ColdChunk(object):
+    """
+    压缩后的冷数据块, 压缩时预先计算 count / sum / min / max / 首尾值与分位数草图,
+    完全落在聚合窗口内的块无需解码
+    """
+    __slots__ = ('start', 'end', 'count', 'timestamps', 'values', 'total', 'low', 'high', 'first', 'last', 'sketch')
+
+    def __init__(self, timestamps: array, values: array):
+        self.start = timestamps[0]
+        self.end = timestamps[-1]
+        self.count = len(timestamps)
+        self.timestamps = encode_timestamps(timestamps)
+        self.values = encode_values(values)
+        self.total = math.fsum(values)
+        ordered = sorted(values)
+        self.low = ordered[0]
+        self.high = ordered[-1]
+        self.first = values[0]
+        self.last = values[-1]
+        # 草图第j个点为排名 (j + 0.5) * count / size - 0.5 处的值, 代表 count / size 个点
+        size = min(SKETCH_SIZE, self.count)
+        self.sketch = array('f', (_interpolate(ordered, min(max((j + 0.5) * self.count / size - 0.5, 0),
+                                                            self.count - 1))
+                                  for j in range(size)))
+
+    def decode(self) -> Tuple[array, array]:
+        return decode_timestamps(self.timestamps, self.count), decode_values(self.values, self.count)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.timestamps) + len(self.values) + len(self.sketch) * self.sketch.itemsize
+
+
+class Series(object):
+    """
+    单个指标的时间序列: 热数据为 array('d') 列(时间戳 + 数值), O(1) 追加;
+    写满 chunk_size 个点后压缩为冷数据块; 超过保留点数或保留时长的最老数据块被丢弃(环形保留)
+    """
+
+    def __init__(self, name: str, chunk_size: int = CHUNK_SIZE, max_points: int = None, max_age: float = None):
+        """
+        :param name: 序列名
+        :param chunk_size: 每个数据块的点数
+        :param max_points: 最多保留的点数(按数据块丢弃), None表示不限制
+        :param max_age: 最长保留时间, 单位秒, None表示不限制
+        """
+        self.name = name
+        self.chunk_size = chunk_size
+        self.max_points = max_points
+        self.max_age = max_age
+        self.timestamps = array('d')
+        self.values = array('d')
+        self.chunks = []  # type: List[ColdChunk]
+        self._cold_points = 0
+
+    def __len__(self):
+        return self._cold_points + len(self.values)
+
+    def append(self, value: float, timestamp: float):
+        self.timestamps.append(timestamp)
+        self.values.append(value)
+        if len(self.values) >= self.chunk_size:
+            self.chunks.append(ColdChunk(self.timestamps, self.values))
+            self._cold_points += len(self.values)
+            self.timestamps = array('d')
+            self.values = array('d')
+            self._expire(timestamp)
+
+    def _expire(self, now: float):
+        while self.chunks and (
+                (self.max_points is not None and len(self) - self.chunks[0].count >= self.max_points) or
+                (self.max_age is not None and self.chunks[0].end < now - self.max_age)):
+            self._cold_points -= self.chunks.pop(0).count
+
+    def window(self, start: float = None, end: float = None) -> Tuple[array, array]:
+        """
+        取出时间窗口 [start, end] 内的数据
+        :return: (时间戳列, 数值列)
+        """
+        timestamps = array('d')
+        values = array('d')
+        for chunk in self.chunks:
+            if (start is not None and chunk.end < start) or (end is not None and chunk.start > end):
+                continue
+            chunk_ts, chunk_values = chunk.decode()
+            self._extend(timestamps, values, chunk_ts, chunk_values, start, end)
+        self._extend(timestamps, values, self.timestamps, self.values, start, end)
+        return timestamps, values
+
+    def aggregate(self, start: float = None, end: float = None,
+                  percentiles: Iterable[int] = PERCENTILES) -> Dict[str, float]:
+        """
+        时间窗口聚合: 完全落在窗口内的冷数据块使用预先计算的统计值与分位数草图(百分位数为近似值),
+        只有跨越窗口边界的块需要解码
+        """
+        def covers(chunk):
+            return (start is None or chunk.start >= start) and (end is None or chunk.end <= end)
+
+        if not any(covers(chunk) for chunk in self.chunks):
+            return aggregate(*self.window(start, end), percentiles=percentiles)
+        count = 0
+        total = 0.0
+        low, high = math.inf, -math.inf
+        # 窗口内第一个和最后一个点的 (时间戳, 数值), 用于计算 rate
+        first = last = None  # type: Optional[Tuple[float, float]]
+        items = []  # type: List[Tuple[float, float]]
+        exact = []  # type: List[Tuple[array, array]]
+        for chunk in self.chunks:
+            if (start is not None and chunk.end < start) or (end is not None and chunk.start > end):
+                continue
+            if covers(chunk):
+                count += chunk.count
+                total += chunk.total
+                low, high = min(low, chunk.low), max(high, chunk.high)
+                first = first or (chunk.start, chunk.first)
+                last = (chunk.end, chunk.last)
+                weight = chunk.count / len(chunk.sketch)
+                items.extend((value, weight) for value in chunk.sketch)
+                continue
+            timestamps, values = array('d'), array('d')
+            self._extend(timestamps, values, *chunk.decode(), start, end)
+            exact.append((timestamps, values))
+        timestamps, values = array('d'), array('d')
+        self._extend(timestamps, values, self.timestamps, self.values, start, end)
+        exact.append((timestamps, values))
+        for timestamps, values in exact:
+            if not values:
+                continue
+            count += len(values)
+            total += math.fsum(values)
+            low, high = min(low, min(values)), max(high, max(values))
+            # 边界块只可能在已覆盖块之前(窗口起点)或之后(窗口终点与热数据)
+            if first is None or timestamps[0] < first[0]:
+                first = (timestamps[0], values[0])
+            if timestamps[-1] > last[0]:
+                last = (timestamps[-1], values[-1])
+            items.extend((value, 1.0) for value in values)
+        result = {'count': count, 'mean': total / count, 'min': low, 'max': high}
+        result.update(weighted_percentiles(items, percentiles))
+        duration = last[0] - first[0]
+        result['rate'] = (last[1] - first[1]) / duration if duration > 0 else 0.0
+        return result
+
+    @staticmethod
+    def _extend(timestamps: array, values: array, src_ts: array, src_values: array, start, end):
+        if (start is None or (src_ts and src_ts[0] >= start)) and (end is None or (src_ts and src_ts[-1] <= end)):
+            timestamps.extend(src_ts)
+            values.extend(src_values)
+            return
+        for timestamp, value in zip(src_ts, src_values):
+            if (start is None or timestamp >= start) and (end is None or timestamp <= end):
+                timestamps.append(timestamp)
+                values.append(value)
+
+    @property
+    def nbytes(self) -> int:
+        """占用的内存(不含对象开销), 单位字节"""
+        return sum(chunk.nbytes for chunk in self.chunks) + (len(self.timestamps) + len(self.values)) * 8
+
+
+def aggregate(timestamps: array, values: array, percentiles: Iterable[int] = PERCENTILES) -> Dict[str, float]:
+    """
+    计算 count / mean / min / max / 百分位数 / rate(单位时间的增量, 用于累计型指标)
+    安装 numpy 时向量化计算
+    """
+    count = len(values)
+    if count == 0:
+        return {'count': 0}
+    result = {'count': count}
+    if np is not None:
+        data = np.frombuffer(values, dtype=np.float64)
+        result['mean'] = float(data.mean())
+        result['min'] = float(data.min())
+        result['max'] = float(data.max())
+        for p, value in zip(percentiles, np.percentile(data, list(percentiles))):
+            result['p%d' % p] = float(value)
+    else:
+        ordered = sorted(values)
+        result['mean'] = math.fsum(values) / count
+        result['min'] = ordered[0]
+        result['max'] = ordered[-1]
+        for p in percentiles:
+            result['p%d' % p] = _interpolate(ordered, (count - 1) * p / 100.0)
+    duration = timestamps[-1] - timestamps[0]
+    result['rate'] = (values[-1] - values[0]) / duration if duration > 0 else 0.0
+    return result
+
+
+class TimeSeriesStore(object):
+    """
+    性能数据的列式内存存储: 每个序列(如 "<sn>/com.example/cpu.app")一列时间戳 + 一列数值,
+    冷数据以 delta-of-delta / XOR 编码压缩, 支持环形保留与时间窗口聚合(mean / p50 / p90 / p99 / max / rate)
+
+    usage:
+        store = TimeSeriesStore(max_age=6 * 3600)
+        store.add_sample('%s/%s' % (sn, package), kit.get_app_cpuinfo(package))
+        store.summary(start=time.time() - 600)
+    """
+
+    def __init__(self, chunk_size: int = CHUNK_SIZE, max_points: int = None, max_age: float = None):
+        """
+        :param chunk_size: 每个数据块的点数, 写满后压缩
+        :param max_points: 每个序列最多保留的点数
+        :param max_age: 每个序列的最长保留时间, 单位秒
+        """
+        self.chunk_size = chunk_size
+        self.max_points = max_points
+        self.max_age = max_age
+        self._series = {}  # type: Dict[str, Series]
+        self._lock = threading.Lock()
+
+    def series(self, key: str) -> Optional[Series]:
+        return self._series.get(key)
+
+    def keys(self, prefix: str = '') -> List[str]:
+        with self._lock:
+            return [key for key in self._series if key.startswith(prefix)]
+
+    def append(self, key: str, value: float, timestamp: float = None):
+        """
+        :param key: 序列名
+        :param value: 数值
+        :param timestamp: 时间戳, 默认当前时间
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = Series(key, self.chunk_size, self.max_points, self.max_age)
+            series.append(float(value), timestamp)
+
+    def add_sample(self, prefix: str, sample, timestamp: float = None):
+        """
+        写入一次采样结果的全部指标
+        :param prefix: 序列名前缀, 如 <sn>/<package>, 序列名为 <prefix>/<指标名>
+        :param sample: 带 metrics() 方法的采样结果(JiffiesCpuinfo / MemSample / MemInfoDetail ...), None时忽略
+        :param timestamp: 时间戳, 默认当前时间
+        """
+        if sample is None:
+            return
+        timestamp = time.time() if timestamp is None else timestamp
+        for metric, value in sample.metrics().items():
+            if value is not None:
+                self.append('%s/%s' % (prefix, metric) if prefix else metric, value, timestamp)
+
+    def window(self, key: str, start: float = None, end: float = None) -> Tuple[array, array]:
+        """
+        :return: 时间窗口内的 (时间戳列, 数值列), 序列不存在时为空
+        """
+        series = self._series.get(key)
+        if series is None:
+            return array('d'), array('d')
+        with self._lock:
+            return series.window(start, end)
+
+    def aggregate(self, key: str, start: float = None, end: float = None,
+                  percentiles: Iterable[int] = PERCENTILES) -> Dict[str, float]:
+        """
+        :return: 时间窗口内的聚合结果, 完全落在窗口内的冷数据块不解码, 百分位数为近似值
+        """
+        series = self._series.get(key)
+        if series is None:
+            return {'count': 0}
+        with self._lock:
+            return series.aggregate(start, end, percentiles)
+
+    def summary(self, prefix: str = '', start: float = None, end: float = None) -> Dict[str, Dict[str, float]]:
+        """
+        :return: 序列名 -> 聚合结果
+        """
+        return {key: self.aggregate(key, start, end) for key in self.keys(prefix)}
+
+    @property
+    def nbytes(self) -> int:
+        with self._lock:
+            return sum(series.nbytes for series in self._series.values())
@@ -0,0 +1,73 @@
+"""
+PckCpuinfo 解析耗时的微基准测试, 使用录制的 top 输出(Android 8.0以下 / 8.0及以上各一份), 按进程数放大到接近真实设备的规模
+
+usage:
+    python -m mdevice.perf.top_benchmark [--rows 400] [--packages 20] [--loops 200]
+"""
+import argparse
+import timeit
+
+from mdevice.perf.android_cpu import PckCpuinfo
+
+# Android 7.1 toolbox top -n 1 -d 1
+TOP_SDK_25 = '''
+
+User 12%, System 7%, IOW 0%, IRQ 0%
+User 98 + Nice 2 + Sys 61 + Idle 654 + IOW 0 + IRQ 0 + SIRQ 3 = 818
+
+  PID PR CPU% S  #THR     VSS     RSS PCY UID      Name
+ 3021  2   9% S    87 2187540K 241660K  fg u0_a112  com.tencent.mm
+ 1187  0   3% S   178 2401344K 208376K  fg system   system_server
+ 3512  1   2% S    45 1769904K 102544K  bg u0_a112  com.tencent.mm:push
+  612  3   1% S    16 158220K  21220K  fg system   /system/bin/surfaceflinger
+ 4102  0   0% R     1   9208K   1828K  fg shell    top
+    1  0   0% S     1  10972K   1828K  fg root     /init
+'''
+
+# Android 9 toybox top -b -n 1 -d 1
+TOP_SDK_28 = '''Tasks: 512 total,   1 running, 511 sleeping,   0 stopped,   0 zombie
+  Mem:  5794512k total,  5573160k used,   221352k free,    34496k buffers
+ Swap:  2621436k total,   891676k used,  1729760k free,  2318900k cached
+800%cpu  56%user   1%nice  46%sys 685%idle   0%iow  10%irq   2%sirq   0%host
+  PID USER         PR  NI VIRT  RES  SHR S[%CPU] %MEM     TIME+ ARGS
+ 5133 u0_a112      10 -10 4.7G 318M 172M S 24.1   5.6  12:13.54 com.tencent.mm
+ 1465 system       18  -2 4.5G 296M 211M S  8.6   5.2 305:41.12 system_server
+ 5598 u0_a112      20   0 4.2G 130M  88M S  3.4   2.3   1:41.05 com.tencent.mm:push
+  789 system       -2  -8 268M  41M  32M S  3.4   0.7 102:40.71 surfaceflinger
+ 9123 shell        20   0  10M 3.8M 3.1M R  3.4   0.0   0:00.05 top -b -n 1 -d 1
+    1 root         20   0  11M 2.4M 1.6M S  0.0   0.0   0:09.18 init
+'''
+
+
+def scale(sample: str, rows: int) -> str:
+    """复制数据行直到总行数达到 rows, 复制的进程名加序号以免与目标包名重复"""
+    header, _, body = sample.partition('PID')
+    header_line, _, data = body.partition('\n')
+    lines = [line for line in data.split('\n') if line.strip()]
+    out = list(lines)
+    index = 0
+    while len(out) < rows:
+        line = lines[index % len(lines)]
+        out.append('%s.%d' % (line, index))
+        index += 1
+    return header + 'PID' + header_line + '\n' + '\n'.join(out) + '\n'
+
+
+def run(rows: int = 400, packages: int = 20, loops: int = 200):
+    targets = ['com.tencent.mm', 'com.tencent.mm:push', 'system_server'] + \
+              ['com.example.app%d' % i for i in range(max(packages - 3, 0))]
+    for sdk, sample in ((25, TOP_SDK_25), (28, TOP_SDK_28)):
+        source = scale(sample, rows)
+        cpu = PckCpuinfo(targets, source, sdk)
+        seconds = timeit.timeit(lambda: PckCpuinfo(targets, source, sdk), number=loops)
+        print('sdk=%d rows=%d packages=%d: %.3f ms/parse, total_pid_cpu=%s' % (
+            sdk, rows, len(targets), seconds / loops * 1000, cpu.total_pid_cpu))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='PckCpuinfo micro benchmark')
+    parser.add_argument('--rows', type=int, default=400)
+    parser.add_argument('--packages', type=int, default=20)
+    parser.add_argument('--loops', type=int, default=200)
+    args = parser.parse_args()
+    run(args.rows, args.packages, args.loops)
@@ -0,0 +1,235 @@
+import atexit
+import gzip
+import os
+import queue
+import threading
+import time
+from typing import Dict, List, Optional
+
+from mdevice.tools.log import LogUtils
+from mdevice.tools.utils import TimeUtils
+
+logger = LogUtils.LOGGER_DEBUG
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+INDEX_SUFFIX = '.index'
+_STOP = object()
+
+
+class SegmentInfo(object):
+    """
+    索引中的一个分段
+    """
+
+    def __init__(self, path: str, start: float, end: float, records: int, raw_bytes: int):
+        """
+        :param path: 分段文件路径
+        :param start: 第一条记录的时间戳
+        :param end: 最后一条记录的时间戳
+        :param records: 记录条数
+        :param raw_bytes: 压缩前的字节数
+        """
+        self.path = path
+        self.start = start
+        self.end = end
+        self.records = records
+        self.raw_bytes = raw_bytes
+
+    def to_line(self) -> str:
+        return '%s\t%.3f\t%.3f\t%d\t%d\n' % (os.path.basename(self.path), self.start, self.end, self.records,
+                                             self.raw_bytes)
+
+    @classmethod
+    def from_line(cls, directory: str, line: str) -> Optional["SegmentInfo"]:
+        items = line.rstrip('\n').split('\t')
+        if len(items) != 5:
+            return None
+        return cls(os.path.join(directory, items[0]), float(items[1]), float(items[2]), int(items[3]),
+                   int(items[4]))
+
+    def __repr__(self):
+        return 'SegmentInfo(%s, records=%d, %s ~ %s)' % (os.path.basename(self.path), self.records,
+                                                          TimeUtils.formatTimeStamp(self.start),
+                                                          TimeUtils.formatTimeStamp(self.end))
+
+
+class RawLogWriter(object):
+    """
+    原始采样数据(top / dumpsys 输出)的后台写入: 采样线程只把数据放入有界队列, 后台线程写入压缩分段文件,
+    分段按大小或时间轮转, 每个分段关闭时在 <name>.index 中追加一行(文件名、起止时间、记录数、原始大小);
+    队列满时丢弃新记录而不阻塞采样
+
+    记录格式与原有文本日志一致: "<时间> <标题>:\\n<内容>\\n\\n", 解压后可按原方式解析
+
+    usage:
+        writer = RawLogWriter.get('top_cpuinfo_%s' % sn)
+        writer.write('top info', out)
+    """
+    _writers = {}  # type: Dict[str, RawLogWriter]
+    _writers_lock = threading.Lock()
+
+    def __init__(self, name: str, directory: str = '.', max_bytes: int = 32 * 1024 * 1024, max_age: float = 3600,
+                 compression: str = 'gzip', queue_size: int = 1024):
+        """
+        :param name: 日志名, 分段文件名为 <name>.<时间>.log.gz
+        :param directory: 存放目录
+        :param max_bytes: 单个分段压缩前的最大字节数
+        :param max_age: 单个分段的最长时间跨度, 单位秒
+        :param compression: gzip 或 zstd(需安装 zstandard, 未安装时使用gzip)
+        :param queue_size: 待写入队列的长度
+        """
+        if compression == 'zstd' and zstandard is None:
+            logger.warning('zstandard not installed, raw log falls back to gzip')
+            compression = 'gzip'
+        self.name = name
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.compression = compression
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._segment = None  # type: Optional[SegmentInfo]
+        self._raw = None
+        self._stream = None
+        self._thread = threading.Thread(target=self._run, name='raw-log-%s' % name, daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def get(cls, name: str, directory: str = '.', **kwargs) -> "RawLogWriter":
+        """
+        获取指定日志的写入器(进程内共享), 进程退出时自动写完队列中的数据
+        """
+        key = os.path.join(os.path.abspath(directory), name)
+        with cls._writers_lock:
+            writer = cls._writers.get(key)
+            if writer is None:
+                writer = cls._writers[key] = RawLogWriter(name, directory=directory, **kwargs)
+            return writer
+
+    @classmethod
+    def close_all(cls):
+        with cls._writers_lock:
+            writers = list(cls._writers.values())
+            cls._writers.clear()
+        for writer in writers:
+            writer.close()
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.directory, self.name + INDEX_SUFFIX)
+
+    def write(self, title: str, data: str, timestamp: float = None) -> bool:
+        """
+        放入一条记录, 不阻塞
+        :param title: 标题, 如 top info
+        :param data: 原始数据
+        :param timestamp: 采集时间戳, 默认当前时间
+        :return: 队列已满(记录被丢弃)时返回False
+        """
+        try:
+            self._queue.put_nowait((timestamp or time.time(), title, data))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 100 == 1:
+                logger.warning('%s: raw log queue full, %d records dropped' % (self.name, self.dropped))
+            return False
+
+    def flush(self, timeout: float = None):
+        """等待队列中的数据写入磁盘(压缩流同步刷新, 当前分段可被完整解压)"""
+        event = threading.Event()
+        self._queue.put((None, event, None), timeout=timeout)
+        event.wait(timeout)
+
+    def close(self, timeout: float = 10):
+        """写完队列中的数据并关闭当前分段"""
+        if not self._thread.is_alive():
+            return
+        self._queue.put((None, _STOP, None))
+        self._thread.join(timeout)
+
+    def segments(self) -> List[SegmentInfo]:
+        """已关闭分段的索引"""
+        if not os.path.exists(self.index_path):
+            return []
+        with open(self.index_path, encoding='utf-8') as reader:
+            return [segment for segment in (SegmentInfo.from_line(self.directory, line) for line in reader)
+                    if segment is not None]
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            timestamp, title, data = item
+            if timestamp is None:
+                if self._stream is not None:
+                    self._sync()
+                if title is _STOP:
+                    self._rotate()
+                    return
+                title.set()
+                continue
+            try:
+                self._write(timestamp, title, data)
+                if self._queue.empty():
+                    self._sync()
+            except Exception as e:
+                logger.error('%s: raw log write failed: %s' % (self.name, e))
+                self._rotate()
+
+    def _open(self, timestamp: float):
+        os.makedirs(self.directory, exist_ok=True)
+        suffix = '.log.zst' if self.compression == 'zstd' else '.log.gz'
+        base = os.path.join(self.directory, '%s.%s' % (
+            self.name, time.strftime(TimeUtils.UnderLineFormatter, time.localtime(timestamp))))
+        path = base + suffix
+        seq = 1
+        while os.path.exists(path):
+            path = '%s.%d%s' % (base, seq, suffix)
+            seq += 1
+        self._raw = open(path, 'wb')
+        if self.compression == 'zstd':
+            self._stream = zstandard.ZstdCompressor().stream_writer(self._raw)
+        else:
+            self._stream = gzip.GzipFile(fileobj=self._raw, mode='wb', compresslevel=6)
+        self._segment = SegmentInfo(path, timestamp, timestamp, 0, 0)
+
+    def _write(self, timestamp: float, title: str, data: str):
+        segment = self._segment
+        if segment is not None and (segment.raw_bytes >= self.max_bytes or timestamp - segment.start >= self.max_age):
+            self._rotate()
+        if self._segment is None:
+            self._open(timestamp)
+        record = ('%s %s:\n%s\n\n' % (TimeUtils.formatTimeStamp(timestamp), title, data or '')).encode('utf-8')
+        self._stream.write(record)
+        self._segment.end = timestamp
+        self._segment.records += 1
+        self._segment.raw_bytes += len(record)
+
+    def _sync(self):
+        if self.compression == 'zstd':
+            self._stream.flush(zstandard.FLUSH_BLOCK)
+        else:
+            self._stream.flush()
+        self._raw.flush()
+
+    def _rotate(self):
+        """关闭当前分段并写入索引"""
+        if self._segment is None:
+            return
+        segment, self._segment = self._segment, None
+        try:
+            self._stream.close()
+            if not self._raw.closed:
+                self._raw.close()
+        finally:
+            self._stream = self._raw = None
+        if segment.records:
+            with open(self.index_path, 'a', encoding='utf-8') as writer:
+                writer.write(segment.to_line())
+
+
+atexit.register(RawLogWriter.close_all)